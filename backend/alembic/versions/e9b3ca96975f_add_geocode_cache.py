@@ -0,0 +1,39 @@
+"""Add geocode_cache table
+
+Revision ID: e9b3ca96975f
+Revises: 6665a3f74494
+Create Date: 2026-10-18 08:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e9b3ca96975f'
+down_revision: Union[str, None] = '6665a3f74494'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'geocode_cache',
+        sa.Column('key', sa.String(length=64), nullable=False),
+        sa.Column('cache_name', sa.String(length=50), nullable=True),
+        sa.Column('response', sa.Text(), nullable=True),
+        sa.Column('expires_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('key'),
+    )
+    op.create_index(op.f('ix_geocode_cache_cache_name'), 'geocode_cache', ['cache_name'],
+                    unique=False)
+    op.create_index(op.f('ix_geocode_cache_expires_at'), 'geocode_cache', ['expires_at'],
+                    unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_geocode_cache_expires_at'), table_name='geocode_cache')
+    op.drop_index(op.f('ix_geocode_cache_cache_name'), table_name='geocode_cache')
+    op.drop_table('geocode_cache')
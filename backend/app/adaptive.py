@@ -0,0 +1,115 @@
+""" Adaptive coarse-to-fine pickup search that stops once more quotes are unlikely to help. """
+import numpy as np
+from .candidates import candidates_at, prepare_candidates
+from .config import ADAPTIVE_QUOTE_BUDGET, ADAPTIVE_FIRST_RING_BEARINGS, FARE_SEARCH_CONCURRENCY
+from .deadline import SKIPPED, remaining, until_deadline
+
+
+async def adaptive_search(client, start_lat, start_lon, search_range, quote_batch, limit,
+                          quote_budget=ADAPTIVE_QUOTE_BUDGET,
+                          concurrency=FARE_SEARCH_CONCURRENCY,
+                          first_ring_bearings=ADAPTIVE_FIRST_RING_BEARINGS):
+    """
+    Quotes pickup spots coarse-to-fine instead of all at once.
+    quote_batch: async function returning, for a list of candidates, one list of option dicts
+                 (each with a "price") per candidate; each round is quoted with one call
+    Round one quotes the original spot and a sparse ring at half the search range. Each later
+    round only refines around spots that were cheaper than the original: the two neighbouring
+    bearings at half the previous angular step, and the same bearing farther out.
+    Stops when `quote_budget` quotes have been used, or when a round adds nothing to the top
+    `limit` (converged), or when the request's latency budget runs out ("deadline"), or when
+    quote_batch returns SKIPPED because the quote API is unavailable ("unavailable").
+    Returns (options, candidate_stats, stats): the unsorted options, candidate counts summed
+    over all rounds, and how many candidates were quoted and skipped.
+    """
+    step = 360.0 / first_ring_bearings
+    frontier = [(search_range / 2, bearing) for bearing in np.arange(first_ring_bearings) * step]
+    seen = {_key(distance, bearing) for distance, bearing in frontier}
+    quoted = []
+    options = []
+    reference = None
+    rounds = 0
+    stop_reason = "converged"
+    candidate_stats = {}
+    skipped = 0
+
+    while frontier:
+        quotes_left = quote_budget - len(quoted)
+        if quotes_left <= 0:
+            stop_reason = "budget"
+            break
+        time_left = remaining()
+        if time_left is not None and time_left <= 0:
+            stop_reason = "deadline"
+            skipped += len(frontier)
+            break
+        rounds += 1
+
+        distances, bearings = zip(*frontier)
+        raw = candidates_at(start_lat, start_lon, distances, bearings)
+        positions = {label: position for (_, _, label), position in zip(raw, frontier)}
+        if rounds == 1:
+            raw.insert(0, (start_lat, start_lon, "Original"))
+
+        locations, stats = await prepare_candidates(client, raw, taken=quoted,
+                                                    concurrency=concurrency)
+        if len(locations) > quotes_left:
+            stats["quoted"] = quotes_left
+            stats["quotes_saved"] += len(locations) - quotes_left
+            locations = locations[:quotes_left]
+        for name, value in stats.items():
+            candidate_stats[name] = candidate_stats.get(name, 0) + value
+        skipped += stats["skipped"]
+
+        results = await until_deadline(quote_batch(locations)) if locations else []
+        if results is SKIPPED:
+            # Cut off by the latency budget, or the quote API's circuit breaker is open
+            time_left = remaining()
+            stop_reason = "deadline" if time_left is not None and time_left <= 0 else "unavailable"
+            skipped += len(locations)
+            break
+        quoted.extend(locations)
+
+        cheapest = {}
+        for (_, _, label), rides in zip(locations, results):
+            options.extend(rides)
+            if rides:
+                cheapest[label] = min(ride["price"] for ride in rides)
+        if reference is None:
+            # Prices from here on are judged against the original spot (or the first ring)
+            reference = cheapest.get("Original", min(cheapest.values(), default=None))
+
+        ranked = sorted(options, key=lambda x: x["price"])[:limit]
+        new_ids = {id(ride) for rides in results for ride in rides}
+        if rounds > 1 and not any(id(ride) in new_ids for ride in ranked):
+            break
+
+        # Refine only the directions where prices dropped, most promising first
+        step /= 2
+        improving = sorted(
+            (price, positions[label]) for label, price in cheapest.items()
+            if label in positions and reference is not None and price < reference
+        )
+        frontier = []
+        for _, (distance, bearing) in improving:
+            children = [(distance, (bearing - step) % 360), (distance, (bearing + step) % 360)]
+            if distance < search_range:
+                children.append((min(search_range, distance + search_range / 2), bearing))
+            for child in children:
+                if _key(*child) not in seen:
+                    seen.add(_key(*child))
+                    frontier.append(child)
+
+    stats = {
+        "mode": "adaptive",
+        "candidates_quoted": len(quoted),
+        "quote_budget": quote_budget,
+        "rounds": rounds,
+        "stop_reason": stop_reason,
+        "skipped": skipped,
+    }
+    return options, candidate_stats, stats
+
+
+def _key(distance, bearing):
+    return round(float(distance), 1), round(float(bearing) % 360, 3)
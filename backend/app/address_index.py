@@ -0,0 +1,144 @@
+""" Per-user prefix index over saved and previously searched addresses, for local autocomplete. """
+import threading
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from .config import ADDRESS_INDEX_MAX_USERS
+from .geocache import normalize_text
+from .models import User, Address, UserAddress
+
+# Saved addresses rank ahead of history; history is newest first
+SAVED_RANK = 0
+HISTORY_RANK = 1
+
+
+class AddressIndex:
+    """
+    Sorted array of (normalized text, entry number) pairs; a prefix lookup is one bisect
+    plus a scan over the matching run. Addresses are indexed by their text and nickname.
+    Profile updates add entries from threadpool threads while the event loop searches, so
+    both hold the index's lock.
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._entries = []  # entry number -> (rank, prediction)
+        self._lock = threading.Lock()
+
+    def add(self, description, place_id, source, rank, nickname=None):
+        """ Adds one address; `rank` orders matches (lower first). """
+        if not description:
+            return
+        prediction = {"description": description, "place_id": place_id, "source": source}
+        if nickname:
+            prediction["nickname"] = nickname
+        texts = {normalize_text(description), normalize_text(nickname or "")}
+        with self._lock:
+            number = len(self._entries)
+            self._entries.append((rank, prediction))
+            for text in texts:
+                if text:
+                    insort(self._keys, (text, number))
+
+    def add_saved(self, address):
+        """ Adds a UserAddress row. """
+        self.add(address.address, f"saved:{address.id}", "saved", (SAVED_RANK, 0),
+                 address.nickname)
+
+    def add_history(self, entry):
+        """ Adds both ends of an Address history row, most recent searches ranking first. """
+        recency = -entry.timestamp.timestamp() if entry.timestamp else 0
+        self.add(entry.written_address, f"history:{entry.id}:start", "history",
+                 (HISTORY_RANK, recency))
+        self.add(entry.final_address, f"history:{entry.id}:end", "history",
+                 (HISTORY_RANK, recency))
+
+    def search(self, prefix, limit):
+        """ Up to `limit` predictions whose address or nickname starts with `prefix`. """
+        prefix = normalize_text(prefix)
+        if not prefix:
+            return []
+        with self._lock:
+            numbers = set()
+            position = bisect_left(self._keys, (prefix,))
+            while position < len(self._keys) and self._keys[position][0].startswith(prefix):
+                numbers.add(self._keys[position][1])
+                position += 1
+            found = [self._entries[n] for n in numbers]
+
+        matches = []
+        seen = set()
+        for _, prediction in sorted(found, key=lambda e: e[0]):
+            text = normalize_text(prediction["description"])
+            if text not in seen:
+                seen.add(text)
+                matches.append(prediction)
+                if len(matches) == limit:
+                    break
+        return matches
+
+
+_indexes = OrderedDict()  # username -> AddressIndex, least recently used first
+_building = {}  # username -> whether it was written to while its index was being built
+_lock = threading.Lock()
+
+
+def build_user_index(db, username):
+    """ Builds a user's index from their home, saved and history addresses. """
+    index = AddressIndex()
+    user = db.query(User).filter(User.username == username).first()
+    if user is None:
+        return index
+    if user.home_address:
+        index.add(user.home_address, "saved:home", "saved", (SAVED_RANK, -1), "Home")
+    for address in db.query(UserAddress).filter(UserAddress.user_id == user.id):
+        index.add_saved(address)
+    for entry in db.query(Address).filter(Address.user_id == user.id):
+        index.add_history(entry)
+    return index
+
+
+def get_user_index(db, username):
+    """ Returns the user's index, building it on first use and keeping the most recent users. """
+    with _lock:
+        index = _indexes.get(username)
+        if index is not None:
+            _indexes.move_to_end(username)
+            return index
+        _building.setdefault(username, False)
+
+    index = build_user_index(db, username)
+
+    with _lock:
+        # An address written during the build may be missing; use it once and rebuild next time
+        if not _building.pop(username, False):
+            _indexes[username] = index
+            while len(_indexes) > ADDRESS_INDEX_MAX_USERS:
+                _indexes.popitem(last=False)
+    return index
+
+
+def index_saved_address(username, address):
+    """ Adds a newly saved UserAddress to the user's index if it is loaded. """
+    _update(username, lambda index: index.add_saved(address))
+
+
+def index_history(username, entry):
+    """ Adds a new Address history row to the user's index if it is loaded. """
+    _update(username, lambda index: index.add_history(entry))
+
+
+def forget_user(username):
+    """ Drops the user's index after a change that can't be applied incrementally. """
+    with _lock:
+        _indexes.pop(username, None)
+        if username in _building:
+            _building[username] = True
+
+
+def _update(username, apply):
+    with _lock:
+        if username in _building:
+            _building[username] = True
+        index = _indexes.get(username)
+        if index is not None:
+            apply(index)
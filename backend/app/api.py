@@ -1,18 +1,35 @@
 """ Main API router """
-from math import radians, sin, cos, sqrt, atan2
-import random
-import requests
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
 from app.auth import router as auth_router
 from app.profile import router as profile_router
 from app.uber import router as uber_router
 from app.lyft import router as lyft_router
-from .models import PriceEstimate, PriceEstimatesResponse
-from .config import GMAP_API_KEY
-import httpx
+from app.compare import router as compare_router
+from .schemas import (PriceEstimatesResponse, PriceEstimatesBatchRequest,
+                      PriceEstimatesBatchResponse, GeocodeBatchRequest)
+from .pricing import uber_price_estimates, uber_price_estimates_batch
+from .config import (GMAP_API_KEY, GOOGLE_MAPS_API_URL, AUTOCOMPLETE_LOCAL_LIMIT,
+                     AUTOCOMPLETE_LOCAL_ENOUGH, GEOCODE_BATCH_MAX_ITEMS, GEOCODE_BATCH_CONCURRENCY,
+                     METRICS_ENABLED)
+from .database import get_db
+from .auth import verify_session
+from .address_index import get_user_index
+from .scheduler import scheduler, GEOCODING
+from .cache import caches
+from .geocache import (geocode_cache, reverse_geocode_cache, autocomplete_cache, geocode_key,
+                       reverse_geocode_key, autocomplete_key, normalize_text, CACHEABLE_STATUSES)
+from .search import fan_out
+from .upstream import get_client, cassette_stats, stats as upstream_http_stats
+from .resilience import CircuitOpen, call_upstream, stats as resilience_stats
+from .deadline import call_timeout
+from .metrics import render as render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
 
 router = APIRouter()
 GOOGLE_API_KEY = GMAP_API_KEY
+GEOCODE_URL = f"{GOOGLE_MAPS_API_URL}/geocode/json"
+AUTOCOMPLETE_URL = f"{GOOGLE_MAPS_API_URL}/place/autocomplete/json"
 
 # General routes
 @router.get("/", tags=["root"])
@@ -25,116 +42,194 @@ async def get_test():
     """ Test API """
     return {"message": "Hello World, this is a test API"}
 
+@router.get("/stats/upstream")
+async def get_upstream_stats():
+    """ Concurrency, queue depth and wait times for each upstream API """
+    return scheduler.stats()
 
-def haversine_distance(lat1, lon1, lat2, lon2):
-    """ Calculate the great circle distance between two points on the Earth """
-    # Earth radius in kilometers
-    r = 6371.0
+@router.get("/stats/http")
+async def get_http_stats():
+    """ Requests, new connections and TLS handshakes per upstream host """
+    return upstream_http_stats()
 
-    # Convert latitude and longitude from degrees to radians
-    lat1_rad = radians(lat1)
-    lon1_rad = radians(lon1)
-    lat2_rad = radians(lat2)
-    lon2_rad = radians(lat2)
-    lon2_rad = radians(lon2)
+@router.get("/stats/cassette")
+async def get_cassette_stats():
+    """ Requests recorded to or replayed from the upstream cassette """
+    return cassette_stats()
 
-    # Compute differences
-    dlon = lon2_rad - lon1_rad
-    dlat = lat2_rad - lat1_rad
+@router.get("/stats/resilience")
+async def get_resilience_stats():
+    """ Circuit breaker state and hedged-request win rates for each upstream API """
+    return resilience_stats()
 
-    # Haversine formula
-    a = sin(dlat / 2)**2 + cos(lat1_rad) * cos(lat2_rad) * sin(dlon / 2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
+@router.get("/stats/cache")
+async def get_cache_stats():
+    """ Size and hit/miss counters for each cache """
+    return {name: cache.stats() for name, cache in caches.items()}
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """ Prometheus metrics in the text exposition format """
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return Response(render_metrics(), media_type=METRICS_CONTENT_TYPE)
 
-    # Distance in kilometers
-    distance = r * c
-    return distance
 
 @router.get("/estimates/price", response_model=PriceEstimatesResponse)
 def get_price_estimates(start_latitude: float, start_longitude: float,
     end_latitude: float, end_longitude: float, seat_count: int = 1):
     """ Get price estimates for different Uber products """
+    return uber_price_estimates(start_latitude, start_longitude, end_latitude, end_longitude,
+                                seat_count)
+
+
+@router.post("/estimates/price/batch", response_model=PriceEstimatesBatchResponse)
+def get_price_estimates_batch(body: PriceEstimatesBatchRequest):
+    """ Get price estimates for many origin/destination pairs at once, in request order """
+    batch = uber_price_estimates_batch(
+        [r.start_latitude for r in body.requests], [r.start_longitude for r in body.requests],
+        [r.end_latitude for r in body.requests], [r.end_longitude for r in body.requests],
+        body.seat_count,
+    )
+    return {"results": [{"prices": prices} for prices in batch]}
+
+
+async def google_get(url, params, error):
+    """
+    JSON body of a Google Maps API GET, made through the geocoding upstream's breaker,
+    scheduler slot and hedging. Raises HTTPException 503 while the breaker is open, and
+    500 with `error` for a non-200 response.
+    """
+    try:
+        response = await call_upstream(
+            GEOCODING, lambda: get_client().get(url, params=params, timeout=call_timeout())
+        )
+    except CircuitOpen as e:
+        raise HTTPException(status_code=503, detail=str(e)) from e
+    if response.status_code != 200:
+        raise HTTPException(status_code=500, detail=error)
+    return response.json()
 
-    if seat_count > 2:
-        raise HTTPException(status_code=400,
-                            detail="seat_count cannot be greater than 2 for uberPOOL.")
-
-    # Calculate distance between start and end points
-    distance_km = haversine_distance(start_latitude, start_longitude, end_latitude, end_longitude)
-
-    # Define base fare and per km rates for each product
-    products = [
-        {"display_name": "UberX", "base_fare": 6.0, "per_km": 2.5, "product_id": "uberx123"},
-        {"display_name": "UberXL", "base_fare": 7.0, "per_km": 3.5, "product_id": "uberxl123"},
-        {"display_name": "Uber Black", "base_fare": 9.0, "per_km": 4.5,
-                                         "product_id": "uberblack123"},
-    ]
-
-    estimates = []
-    for product in products:
-        # Randomize fare within a range
-        dist = product["per_km"] * distance_km
-        low_estimate = product["base_fare"] + dist + random.uniform(-1, 1)
-        high_estimate = low_estimate * random.uniform(1.1, 1.5)
-        estimate_str = f"${low_estimate:.2f} - ${high_estimate:.2f}"
-
-        estimates.append(PriceEstimate(
-            localized_display_name=product["display_name"],
-            distance=distance_km,
-            display_name=product["display_name"],
-            product_id=product["product_id"],
-            high_estimate=round(high_estimate, 2),
-            low_estimate=round(low_estimate, 2),
-            duration=int(distance_km / 40 * 3600),  # Assuming average speed of 40 km/h
-            estimate=estimate_str,
-            currency_code="USD"
-        ))
-
-    return PriceEstimatesResponse(prices=estimates)
+async def lookup_geocode(address):
+    """ Geocoding data for an address, from the geocoding cache or Google """
+    params = {"address": address, "key": GOOGLE_API_KEY}
+    return await geocode_cache.get_or_fetch(
+        geocode_key(address), lambda: google_get(GEOCODE_URL, params, "Geocoding API failed")
+    )
 
+async def lookup_reverse_geocode(lat, lng):
+    """ Reverse geocoding data for a point, from the geocoding cache or Google """
+    params = {"latlng": f"{lat},{lng}", "key": GOOGLE_API_KEY}
+    return await reverse_geocode_cache.get_or_fetch(
+        reverse_geocode_key(lat, lng),
+        lambda: google_get(GEOCODE_URL, params, "Reverse geocoding API failed"),
+    )
 
 @router.get("/geocode")
-def geocode(address: str):
-    """ Get geocoding data for a given address """
-    url = "https://maps.googleapis.com/maps/api/geocode/json"
-    params = {"address": address, "key": GOOGLE_API_KEY}
-    response = requests.get(url, params=params, timeout=10)
-    if response.status_code != 200:
-        raise HTTPException(status_code=500, detail="Geocoding API failed")
-    return response.json()
+async def geocode(address: str):
+    """ Get geocoding data for a given address (cached per normalized address) """
+    return await lookup_geocode(address)
+
+@router.post("/geocode/batch")
+async def geocode_batch(body: GeocodeBatchRequest):
+    """
+    Geocode many addresses and/or reverse geocode many lat/lng pairs in one request.
+    Duplicates (after cache-key normalization) are looked up once, cached entries are served
+    directly, and the remaining lookups run at most GEOCODE_BATCH_CONCURRENCY at a time.
+    Returns one result per item, in order: {"ok": true, "result": <Google response>} or
+    {"ok": false, "error": "..."}.
+    """
+    if len(body.items) > GEOCODE_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400,
+                            detail=f"At most {GEOCODE_BATCH_MAX_ITEMS} items per batch")
+
+    lookups = {}  # cache key -> async lookup
+    item_keys = []
+    for item in body.items:
+        if item.address:
+            key = ("geocode", geocode_key(item.address))
+            lookups.setdefault(key, lambda address=item.address: lookup_geocode(address))
+        elif item.lat is not None and item.lng is not None:
+            key = ("reverse_geocode", reverse_geocode_key(item.lat, item.lng))
+            lookups.setdefault(key, lambda lat=item.lat, lng=item.lng:
+                               lookup_reverse_geocode(lat, lng))
+        else:
+            key = None
+        item_keys.append(key)
+
+    async def resolve(key):
+        try:
+            result = await lookups[key]()
+        except HTTPException as e:
+            return {"ok": False, "error": e.detail}
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            return {"ok": False, "error": str(e)}
+        if result.get("status") not in CACHEABLE_STATUSES:
+            error = result.get("error_message") or result.get("status") or "Unknown error"
+            return {"ok": False, "error": error}
+        return {"ok": True, "result": result}
+
+    keys = list(lookups)
+    resolved = dict(zip(keys, await fan_out(keys, resolve, GEOCODE_BATCH_CONCURRENCY)))
+    invalid = {"ok": False, "error": "Each item needs an address or both lat and lng"}
+    return {
+        "results": [resolved[key] if key is not None else invalid for key in item_keys],
+        "unique_lookups": len(keys),
+    }
 
 @router.get("/reverse_geocode")
-def reverse_geocode(lat: float, lng: float):
-    """ Get reverse geocoding data for a given latitude and longitude """
-    url = "https://maps.googleapis.com/maps/api/geocode/json"
-    params = {"latlng": f"{lat},{lng}", "key": GOOGLE_API_KEY}
-    response = requests.get(url, params=params, timeout=10)
-    if response.status_code != 200:
-        raise HTTPException(status_code=500, detail="Reverse geocoding API failed")
-    return response.json()
+async def reverse_geocode(lat: float, lng: float):
+    """ Get reverse geocoding data for a given latitude and longitude (cached per ~5 m cell) """
+    return await lookup_reverse_geocode(lat, lng)
 
 @router.get("/autocomplete")
-def get_place_autocomplete(input: str, lat: float = None, lng: float = None):
-    """ Get place autocomplete suggestions for a given input string with optional location bias """
-    url = "https://maps.googleapis.com/maps/api/place/autocomplete/json"
+async def get_place_autocomplete(request: Request, input: str, lat: float = None, lng: float = None,
+                           db: Session = Depends(get_db)):
+    """
+    Get place autocomplete suggestions for a given input string with optional location bias.
+    For a signed-in user, matching saved and previously searched addresses come first
+    ("source": "saved" or "history"); Google is only asked when there are fewer than
+    AUTOCOMPLETE_LOCAL_ENOUGH of them. Google results are cached per normalized input
+    and coarse location-bias cell.
+    """
+    local = []
+    session_token = request.cookies.get("session")
+    username = verify_session(session_token) if session_token else None
+    if username:
+        index = await run_in_threadpool(get_user_index, db, username)
+        local = index.search(input, AUTOCOMPLETE_LOCAL_LIMIT)
+    if len(local) >= AUTOCOMPLETE_LOCAL_ENOUGH:
+        return {"predictions": local, "status": "OK"}
+
     params = {
         "input": input,
         "key": GOOGLE_API_KEY,
         "types": "address"
     }
-    
+
     # Add location bias if coordinates are provided
     if lat is not None and lng is not None:
         params["location"] = f"{lat},{lng}"
         params["radius"] = "50000"  # 50km radius for location bias
-    
-    response = requests.get(url, params=params, timeout=10)
-    if response.status_code != 200:
-        raise HTTPException(status_code=500, detail="Place Autocomplete API failed")
-    return response.json()
+
+    google = await autocomplete_cache.get_or_fetch(
+        autocomplete_key(input, lat, lng),
+        lambda: google_get(AUTOCOMPLETE_URL, params, "Place Autocomplete API failed"),
+    )
+    if not local:
+        return google
+
+    # Local matches first, then Google's suggestions for other addresses
+    seen = {normalize_text(prediction["description"]) for prediction in local}
+    predictions = local + [
+        prediction for prediction in google.get("predictions", [])
+        if normalize_text(prediction.get("description", "")) not in seen
+    ]
+    return {**google, "predictions": predictions, "status": "OK"}
 
 # Include other sub-routers
 router.include_router(auth_router, prefix="/auth", tags=["Auth"])
 router.include_router(profile_router, prefix="/profile", tags=["Profile"])
 router.include_router(uber_router, prefix="/uber", tags=["Uber"])
 router.include_router(lyft_router, prefix="/lyft", tags=["Lyft"])
+router.include_router(compare_router, prefix="/fares", tags=["Fares"])
@@ -0,0 +1,199 @@
+""" In-memory TTL + LRU cache with hit/miss counters and single-flight loading. """
+import asyncio
+import time
+from collections import OrderedDict
+from .metrics import collector
+
+# Every cache registers itself here so its counters can be reported
+caches = {}
+
+# stats() counter -> lookup result reported on /metrics (TTLCache and geocache.TieredCache)
+_LOOKUP_RESULTS = {"hits": "hit", "coalesced": "coalesced", "misses": "miss",
+                   "l1_hits": "l1_hit", "l2_hits": "l2_hit", "upstream_calls": "miss"}
+
+
+class TTLCache:
+    """
+    Memory-bounded LRU cache whose entries expire after `ttl` seconds.
+    Concurrent loads of the same missing key share a single call to the loader.
+    """
+
+    def __init__(self, name, ttl, max_entries, register=True):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._in_flight = {}  # key -> future shared by concurrent loaders
+        if register:
+            caches[name] = self
+
+    def get(self, key):
+        """
+        Returns (True, value) for a live entry, or (False, None) when it is missing or expired.
+        Does not touch the hit/miss counters.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def set(self, key, value, ttl=None):
+        """ Stores a value, evicting the least recently used entries over the size bound. """
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_load(self, key, loader):
+        """
+        Returns the cached value for `key`, or awaits `loader()` to fill it.
+        Callers that miss while the same key is already loading wait for that load instead.
+        """
+        found, value = self.get(key)
+        if found:
+            self.hits += 1
+            return value
+
+        pending = self._in_flight.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not _load_was_cancelled(pending):
+                    raise
+                # The caller that owned the load was cancelled (e.g. its deadline passed);
+                # this one still wants the value, so load it again
+                return await self.get_or_load(key, loader)
+
+        self.misses += 1
+        future = self._start_load(key)
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            raise
+        finally:
+            del self._in_flight[key]
+
+        self.set(key, value)
+        future.set_result(value)
+        return value
+
+    async def get_many_or_load(self, keys, loader):
+        """
+        Batch form of get_or_load: returns one value per key, in order.
+        Keys that are missing and not already loading are passed, deduplicated, to a single
+        `await loader(missing_keys)` call, which must return their values in the same order.
+        Keys another caller is already loading wait for that load instead.
+        """
+        values = {}
+        waiting = {}
+        missing = {}
+        for key in keys:
+            if key in values:
+                self.hits += 1
+                continue
+            if key in waiting or key in missing:
+                self.coalesced += 1
+                continue
+            found, value = self.get(key)
+            if found:
+                self.hits += 1
+                values[key] = value
+            elif key in self._in_flight:
+                self.coalesced += 1
+                waiting[key] = self._in_flight[key]
+            else:
+                self.misses += 1
+                missing[key] = self._start_load(key)
+
+        if missing:
+            try:
+                loaded = list(await loader(list(missing)))
+                if len(loaded) != len(missing):
+                    raise ValueError(f"loader returned {len(loaded)} values for "
+                                     f"{len(missing)} keys")
+            except asyncio.CancelledError:
+                for future in missing.values():
+                    future.cancel()
+                raise
+            except Exception as exc:
+                for future in missing.values():
+                    future.set_exception(exc)
+                raise
+            finally:
+                for key in missing:
+                    del self._in_flight[key]
+
+            for (key, future), value in zip(missing.items(), loaded):
+                self.set(key, value)
+                future.set_result(value)
+                values[key] = value
+
+        for key, future in waiting.items():
+            try:
+                values[key] = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not _load_was_cancelled(future):
+                    raise
+                values[key] = (await self.get_many_or_load([key], loader))[0]
+        return [values[key] for key in keys]
+
+    def _start_load(self, key):
+        """ Registers a future that concurrent callers missing on `key` wait on. """
+        future = asyncio.get_running_loop().create_future()
+        # Keep asyncio quiet when a failed load had no one else waiting on it
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._in_flight[key] = future
+        return future
+
+    def clear(self):
+        """ Drops every entry (counters are kept). """
+        self._entries.clear()
+
+    def stats(self):
+        """ Size and hit/miss counters for this cache. """
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+        }
+
+
+def _load_was_cancelled(future):
+    """ True when a shared load was cancelled by its owner rather than the current task. """
+    return future.cancelled() and not asyncio.current_task().cancelling()
+
+
+@collector
+def collect():
+    """ Lookups by result, entry counts and hit ratios of every cache for /metrics. """
+    stats = {name: cache.stats() for name, cache in caches.items()}
+    return [
+        ("farefinder_cache_lookups", "counter",
+         "Cache lookups by result (coalesced: waited for a load already in flight)",
+         [({"cache": name, "result": result}, figures[key])
+          for name, figures in stats.items()
+          for key, result in _LOOKUP_RESULTS.items() if key in figures]),
+        ("farefinder_cache_hit_ratio", "gauge", "Share of lookups answered without loading",
+         [({"cache": name}, figures["hit_ratio"]) for name, figures in stats.items()]),
+        ("farefinder_cache_entries", "gauge", "Entries held in memory",
+         [({"cache": name}, figures["size"]) for name, figures in stats.items()]),
+    ]
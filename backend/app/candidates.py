@@ -0,0 +1,167 @@
+""" Pickup candidate generation and preparation shared by the Uber and Lyft fare searches. """
+import math
+import numpy as np
+from .config import (SNAP_CANDIDATES, SNAP_DEDUPE_DISTANCE_M, CANDIDATE_PATTERN,
+                     CANDIDATE_BEARINGS, CANDIDATE_SPACING_FT, MAX_CANDIDATES,
+                     FARE_SEARCH_CONCURRENCY, STREET_VALIDATION_BACKEND)
+from .geo import distance_m, METERS_PER_DEGREE
+from .deadline import SKIPPED, quote_reserve, until_deadline
+from .metrics import search_candidates, street_check_seconds
+from .search import fan_out
+from .streets import is_valid_street, snap_to_street
+
+PATTERNS = ("rings", "hex", "random")
+
+FEET_TO_METERS = 0.3048
+
+_street_check_seconds = street_check_seconds.labels(STREET_VALIDATION_BACKEND)
+
+_COMPASS = {0: "N", 45: "NE", 90: "E", 135: "SE", 180: "S", 225: "SW", 270: "W", 315: "NW"}
+
+
+def generate_candidates(lat, lon, search_range, pattern=CANDIDATE_PATTERN,
+                        bearings=CANDIDATE_BEARINGS, spacing_ft=CANDIDATE_SPACING_FT,
+                        max_candidates=MAX_CANDIDATES, rng=None):
+    """
+    Generates (lat, lon, label) pickup candidates around a start point, starting with the
+    original spot, using one batched NumPy offset computation.
+    search_range: Radius in feet; the number of rings / grid cells grows with it
+    pattern: "rings" (concentric rings of `bearings` points, `spacing_ft` apart),
+             "hex" (hexagonal grid with `spacing_ft` between points) or
+             "random" (uniform samples over the disk, as many as the rings pattern would make)
+    """
+    if pattern not in PATTERNS:
+        raise ValueError(f"Unknown candidate pattern: {pattern}")
+    if search_range <= 0:
+        raise ValueError(f"search_range must be positive, got {search_range}")
+
+    ring_count = max(1, round(search_range / spacing_ft))
+    if pattern == "rings":
+        # Keep whole rings under the candidate cap
+        ring_count = max(1, min(ring_count, (max_candidates - 1) // max(1, bearings)))
+        radii = search_range * np.arange(1, ring_count + 1) / ring_count
+        angles = np.arange(bearings) * (360.0 / bearings)
+        distances_ft = np.repeat(radii, bearings)
+        bearings_deg = np.tile(angles, ring_count)
+    elif pattern == "hex":
+        distances_ft, bearings_deg = _hex_grid(search_range, search_range / ring_count)
+    else:
+        count = ring_count * bearings
+        rng = rng or np.random.default_rng()
+        distances_ft = search_range * np.sqrt(rng.uniform(0.0, 1.0, count))
+        bearings_deg = rng.uniform(0.0, 360.0, count)
+
+    # Nearest points first, so snapping/dedupe keeps the shortest walks
+    order = np.lexsort((bearings_deg, np.round(distances_ft, 6)))[:max(0, max_candidates - 1)]
+    return [(lat, lon, "Original")] + candidates_at(lat, lon, distances_ft[order],
+                                                     bearings_deg[order])
+
+
+def candidates_at(lat, lon, distances_ft, bearings_deg):
+    """
+    Labelled (lat, lon, label) candidates at the given distances (feet) and bearings
+    (degrees clockwise from north) from a start point.
+    """
+    distances_ft = np.asarray(distances_ft, dtype=np.float64)
+    bearings_deg = np.asarray(bearings_deg, dtype=np.float64)
+    lats, lons = offset_points(lat, lon, distances_ft * FEET_TO_METERS, bearings_deg)
+    return [
+        (float(p_lat), float(p_lon), candidate_label(dist, bearing))
+        for p_lat, p_lon, dist, bearing in zip(lats, lons, distances_ft, bearings_deg)
+    ]
+
+
+def offset_points(lat, lon, distances_m, bearings_deg):
+    """
+    Moves a start point by arrays of distances (meters) along bearings (degrees clockwise
+    from north). Returns arrays of latitudes and longitudes.
+    """
+    theta = np.radians(bearings_deg)
+    delta = np.asarray(distances_m, dtype=np.float64) / METERS_PER_DEGREE
+    lats = lat + delta * np.cos(theta)
+    lons = lon + delta * np.sin(theta) / math.cos(math.radians(lat))
+    return lats, lons
+
+
+def _hex_grid(search_range, spacing):
+    """ Distance/bearing pairs of hexagonal grid points inside the search disk, minus the centre. """
+    steps = int(search_range // spacing) + 1
+    rows, cols = np.meshgrid(np.arange(-steps, steps + 1), np.arange(-steps, steps + 1),
+                             indexing="ij")
+    x = (cols + 0.5 * (rows % 2)) * spacing
+    y = rows * spacing * math.sqrt(3) / 2
+    dist = np.hypot(x, y).ravel()
+    keep = (dist > 0) & (dist <= search_range + 1e-9)
+    bearing = np.degrees(np.arctan2(x.ravel(), y.ravel())) % 360
+    return dist[keep], bearing[keep]
+
+
+def candidate_label(distance_ft, bearing):
+    """ "NE 500ft" for compass bearings, "123° 500ft" otherwise. """
+    rounded = round(float(bearing), 6) % 360
+    direction = _COMPASS.get(rounded) if rounded.is_integer() else None
+    return f"{direction or f'{round(rounded) % 360}°'} {int(round(distance_ft))}ft"
+
+
+async def prepare_candidates(client, locations, snap=SNAP_CANDIDATES, taken=(),
+                             concurrency=FARE_SEARCH_CONCURRENCY):
+    """
+    Turns raw (lat, lon, label) offsets into the candidates worth quoting.
+    With `snap` set, each offset is moved onto the nearest street point and snapped points
+    that land within SNAP_DEDUPE_DISTANCE_M of an earlier candidate, or of one in `taken`
+    (already quoted), are dropped; otherwise offsets that aren't on a street are simply
+    filtered out.
+    concurrency: Maximum number of street checks in flight at the same time
+    Under a latency budget, offsets whose street check hasn't finished when the budget less
+    its quoting share runs out are skipped.
+    Returns (candidates, stats) where stats counts how many quotes were saved.
+    """
+    reserve = quote_reserve()
+    if snap:
+        points = await fan_out(
+            locations,
+            lambda loc: until_deadline(_timed(snap_to_street(client, loc[0], loc[1])), reserve),
+            concurrency,
+        )
+    else:
+        valid = await fan_out(
+            locations,
+            lambda loc: until_deadline(_timed(is_valid_street(client, loc[0], loc[1])), reserve),
+            concurrency,
+        )
+        points = [ok if ok is SKIPPED else (loc[0], loc[1]) if ok else None
+                  for loc, ok in zip(locations, valid)]
+
+    candidates = []
+    duplicates = 0
+    skipped = 0
+    for (_, _, label), point in zip(locations, points):
+        if point is SKIPPED:
+            skipped += 1
+            continue
+        if point is None:
+            continue
+        if snap and any(distance_m(point[0], point[1], lat, lon) < SNAP_DEDUPE_DISTANCE_M
+                        for lat, lon, _ in [*taken, *candidates]):
+            duplicates += 1
+            continue
+        candidates.append((point[0], point[1], label))
+
+    stats = {
+        "generated": len(locations),
+        "off_street": len(locations) - len(candidates) - duplicates - skipped,
+        "duplicates": duplicates,
+        "skipped": skipped,
+        "quoted": len(candidates),
+        "quotes_saved": len(locations) - len(candidates) - skipped,
+    }
+    search_candidates.labels("generated").observe(stats["generated"])
+    search_candidates.labels("valid").observe(len(candidates) + duplicates)
+    search_candidates.labels("quoted").observe(stats["quoted"])
+    return candidates, stats
+
+
+async def _timed(check):
+    """ Awaits a street check, recording how long it took. """
+    with _street_check_seconds.time():
+        return await check
@@ -0,0 +1,211 @@
+"""
+Record/replay of upstream HTTP traffic, so benchmarks and regression runs get the same
+upstream responses every time.
+
+A cassette is one binary file: a header, the recorded responses appended one after another,
+then a sorted index of (request key, offset) pairs written when recording stops (at app
+shutdown or process exit, not when the HTTP client is replaced). Replay
+memory-maps the file and binary-searches the index, so a lookup reads only the entry it
+needs however large the cassette is.
+"""
+import asyncio
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+from urllib.parse import urlencode
+import httpx
+
+MAGIC = b"FFCAS1\0\0"
+INDEX_MAGIC = b"FFCASIDX"
+KEY_SIZE = 16
+
+# key, status code, upstream seconds, headers length, body length
+_RECORD = struct.Struct(f"<{KEY_SIZE}sHfII")
+# key, record offset
+_ENTRY = struct.Struct(f"<{KEY_SIZE}sQ")
+# index offset, entry count, magic
+_FOOTER = struct.Struct("<QI8s")
+
+# Query parameters that don't change the response (credentials)
+IGNORED_PARAMS = {"key", "client_secret"}
+
+# Response headers that describe the original transfer rather than the stored body
+TRANSFER_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection",
+                    "date"}
+
+
+class CassetteMiss(httpx.NetworkError):
+    """ A replayed request that isn't in the cassette; callers see it as an unreachable host. """
+
+
+def request_key(request):
+    """
+    Key of a request: method, URL without credentials and with sorted query parameters,
+    and the body, with JSON bodies re-serialized with sorted keys.
+    """
+    url = request.url
+    params = sorted((name, value) for name, value in url.params.multi_items()
+                    if name not in IGNORED_PARAMS)
+    body = request.content
+    if body and request.headers.get("content-type", "").startswith("application/json"):
+        body = json.dumps(json.loads(body), sort_keys=True, separators=(",", ":")).encode("utf-8")
+    normalized = f"{request.method} {url.scheme}://{url.host}{url.path}?{urlencode(params)}\n"
+    return hashlib.blake2b(normalized.encode("utf-8") + body, digest_size=KEY_SIZE).digest()
+
+
+class CassetteWriter:
+    """
+    Cassette file being recorded. Responses are appended as they arrive and the sorted index
+    is written by close(). With `resume`, an existing cassette is reopened: its index is read
+    back and dropped from the file, and new responses are appended after the recorded ones.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self._offsets = {}
+        if resume and os.path.exists(path):
+            cassette = Cassette(path)
+            self._offsets = dict(cassette.entries())
+            end = cassette.index_offset
+            cassette.close()
+            self._file = open(path, "r+b")  # pylint: disable=consider-using-with
+            self._file.truncate(end)
+            self._file.seek(end)
+        else:
+            self._file = open(path, "wb")  # pylint: disable=consider-using-with
+            self._file.write(MAGIC)
+        self.stats = {"mode": "record", "path": path, "recorded": 0, "duplicates": 0}
+
+    @property
+    def closed(self):
+        """ Whether the index has been written and the file closed. """
+        return self._file.closed
+
+    def add(self, key, status, elapsed, headers, body):
+        """ Appends a response unless one is already recorded for `key`. """
+        if key in self._offsets:
+            self.stats["duplicates"] += 1
+            return
+        headers = json.dumps(headers).encode("utf-8")
+        self._offsets[key] = self._file.tell()
+        self._file.write(_RECORD.pack(key, status, elapsed, len(headers), len(body)))
+        self._file.write(headers)
+        self._file.write(body)
+        self.stats["recorded"] += 1
+
+    def close(self):
+        """ Writes the index and closes the file; later calls do nothing. """
+        if self._file.closed:
+            return
+        index_offset = self._file.tell()
+        for key in sorted(self._offsets):
+            self._file.write(_ENTRY.pack(key, self._offsets[key]))
+        self._file.write(_FOOTER.pack(index_offset, len(self._offsets), INDEX_MAGIC))
+        self._file.close()
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """
+    Passes requests on to `transport` and records every distinct request's response with
+    `writer`. Closing the transport leaves the writer open, so a client that replaces this
+    one keeps adding to the same cassette.
+    """
+
+    def __init__(self, transport, writer):
+        self.transport = transport
+        self.writer = writer
+
+    @property
+    def stats(self):
+        """ What the cassette has recorded so far. """
+        return self.writer.stats
+
+    async def handle_async_request(self, request):
+        key = request_key(request)
+        started = time.monotonic()
+        response = await self.transport.handle_async_request(request)
+        body = await response.aread()
+        elapsed = time.monotonic() - started
+
+        headers = [(name, value) for name, value in response.headers.multi_items()
+                   if name.lower() not in TRANSFER_HEADERS]
+        self.writer.add(key, response.status_code, elapsed, headers, body)
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class Cassette:
+    """ Read-only, memory-mapped view of a cassette file. """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a cassette")
+        index_offset, self.count, magic = _FOOTER.unpack_from(self._map, len(self._map)
+                                                               - _FOOTER.size)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{path} has no index; was the recording app shut down cleanly?")
+        self.index_offset = index_offset
+
+    def find(self, key):
+        """ (status, upstream seconds, headers, body) recorded for `key`, or None. """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            entry_key, offset = _ENTRY.unpack_from(self._map,
+                                                   self.index_offset + middle * _ENTRY.size)
+            if entry_key < key:
+                low = middle + 1
+            elif entry_key > key:
+                high = middle
+            else:
+                _, status, elapsed, headers_length, body_length = _RECORD.unpack_from(
+                    self._map, offset)
+                start = offset + _RECORD.size
+                headers = json.loads(self._map[start:start + headers_length])
+                start += headers_length
+                return status, elapsed, headers, self._map[start:start + body_length]
+        return None
+
+    def entries(self):
+        """ (key, record offset) of every recorded request, in key order. """
+        for position in range(self.count):
+            yield _ENTRY.unpack_from(self._map, self.index_offset + position * _ENTRY.size)
+
+    def close(self):
+        """ Unmaps the file. """
+        self._map.close()
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """
+    Answers every request from the cassette at `path` without touching the network, after
+    the recorded upstream time multiplied by `time_scale` (0 answers at once).
+    """
+
+    def __init__(self, path, time_scale=1.0):
+        self.cassette = Cassette(path)
+        self.time_scale = time_scale
+        self.stats = {"mode": "replay", "path": path, "entries": self.cassette.count,
+                      "replayed": 0, "misses": 0}
+
+    async def handle_async_request(self, request):
+        found = self.cassette.find(request_key(request))
+        if found is None:
+            self.stats["misses"] += 1
+            raise CassetteMiss(f"{request.method} {request.url.copy_remove_param('key')} "
+                               "is not in the cassette", request=request)
+        status, elapsed, headers, body = found
+        if self.time_scale > 0:
+            await asyncio.sleep(elapsed * self.time_scale)
+        self.stats["replayed"] += 1
+        return httpx.Response(status, headers=headers, content=body)
+
+    async def aclose(self):
+        self.cassette.close()
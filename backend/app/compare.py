@@ -0,0 +1,154 @@
+""" Cross-provider fare comparison: one candidate set, one batch quote per provider, one merged ranking. """
+import asyncio
+from typing import List, Literal, Optional
+from fastapi import APIRouter, HTTPException, Query
+from .candidates import generate_candidates, prepare_candidates
+from .config import CANDIDATE_PATTERN, FARE_SEARCH_CONCURRENCY, ROUTE_MAX_STALE
+from .route_results import cached_search, route_key
+from .upstream import get_client
+from .deadline import SKIPPED, until_deadline
+from .streaming import search_events, stream_response
+from . import lyft, uber
+
+router = APIRouter()
+
+
+# Provider name -> async quote function returning ranked-list options for one pickup spot
+PROVIDERS = {
+    "uber": uber.quote_location,
+    "lyft": lyft.quote_location,
+}
+
+# Provider name -> async quote function returning one options list per pickup spot, in order
+BATCH_PROVIDERS = {
+    "uber": uber.quote_locations,
+    "lyft": lyft.quote_locations,
+}
+
+
+async def quote_providers(client, location, end_lat, end_lon, providers):
+    """
+    Quotes one pickup spot with every provider concurrently; options carry a "provider" field.
+    Providers whose circuit breaker is open are left out, and SKIPPED is returned if all are.
+    """
+    quotes = await asyncio.gather(*(
+        PROVIDERS[name](client, location, end_lat, end_lon) for name in providers
+    ))
+    if all(options is SKIPPED for options in quotes):
+        return SKIPPED
+    return [
+        {**option, "provider": name}
+        for name, options in zip(providers, quotes) if options is not SKIPPED
+        for option in options
+    ]
+
+
+@router.get("/compare")
+async def compare_fares(
+    start_lat: float,
+    start_lon: float,
+    end_lat: float,
+    end_lon: float,
+    limit: int = 3,
+    search_range: int = Query(500, gt=0),
+    pattern: Literal["rings", "hex", "random"] = CANDIDATE_PATTERN,
+    providers: List[Literal["uber", "lyft"]] = Query(["uber", "lyft"]),
+    max_stale: float = Query(ROUTE_MAX_STALE, ge=0),
+    budget_ms: Optional[int] = Query(None, ge=1),
+):
+    """
+    Returns the top `limit` cheapest fares across providers from original+nearby pickup spots.
+    Candidates are generated and street-checked once, then every provider prices all
+    candidates with one batch call, the providers running concurrently.
+    search_range: Maximum distance in feet to search for alternative pickup locations (default: 500 feet)
+    providers: Providers to compare (default: all)
+    max_stale: Seconds old a previous result for the same route may be; it is returned at
+               once (see "age_seconds") and refreshed in the background
+    budget_ms: Latency budget in milliseconds; spots not checked or quoted in time are
+               left out and counted in "skipped", with "partial" set
+    """
+    try:
+        providers = list(dict.fromkeys(providers))
+        key = route_key("compare", start_lat, start_lon, end_lat, end_lon,
+                        limit, search_range, pattern, tuple(providers))
+        return await cached_search(
+            key,
+            lambda: compare_top_fares(start_lat, start_lon, end_lat, end_lon, limit,
+                                      search_range, pattern, providers),
+            max_stale,
+            budget_ms,
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e)) from e
+
+
+@router.get("/compare/stream")
+async def stream_compare_fares(
+    start_lat: float,
+    start_lon: float,
+    end_lat: float,
+    end_lon: float,
+    limit: int = 3,
+    search_range: int = Query(500, gt=0),
+    pattern: Literal["rings", "hex", "random"] = CANDIDATE_PATTERN,
+    providers: List[Literal["uber", "lyft"]] = Query(["uber", "lyft"]),
+    format: Literal["ndjson", "sse"] = "ndjson",  # pylint: disable=redefined-builtin
+    budget_ms: Optional[int] = Query(None, ge=1),
+):
+    """
+    Streams each pickup spot's quotes from every provider as they arrive, plus running
+    top `limit` updates. The last message ({"type": "result"}) is the authoritative ranked list.
+    """
+    providers = list(dict.fromkeys(providers))
+    events = search_events(
+        start_lat, start_lon, search_range, pattern,
+        lambda client, loc: quote_providers(client, loc, end_lat, end_lon, providers), limit,
+        budget_ms=budget_ms,
+    )
+    return stream_response(events, format)
+
+
+async def compare_top_fares(start_lat, start_lon, end_lat, end_lon, limit, search_range=500,
+                            pattern=CANDIDATE_PATTERN, providers=tuple(PROVIDERS),
+                            concurrency=FARE_SEARCH_CONCURRENCY):
+    """
+    Finds the top `limit` cheapest fares over all `providers`. Each option carries a
+    "provider" field; "search" reports per provider the candidates quoted and the quotes
+    used (estimates loaded from upstream, so quote cache hits don't count). "skipped" counts
+    candidates missing at least one provider's quote because the latency budget ran out.
+    """
+    providers = list(dict.fromkeys(providers))
+
+    client = get_client()
+    locations = generate_candidates(start_lat, start_lon, search_range, pattern)
+    locations, candidate_stats = await prepare_candidates(client, locations,
+                                                          concurrency=concurrency)
+
+    usage = {name: {"upstream_quotes": 0} for name in providers}
+    quotes = await asyncio.gather(*(
+        until_deadline(BATCH_PROVIDERS[name](client, locations, end_lat, end_lon, usage[name]))
+        for name in providers
+    ))
+    quotes = {name: results for name, results in zip(providers, quotes) if results is not SKIPPED}
+    skipped = candidate_stats["skipped"]
+    if len(quotes) < len(providers):
+        skipped += len(locations)
+
+    all_results = [
+        {**option, "provider": name}
+        for name, results in quotes.items()
+        for options in results
+        for option in options
+    ]
+    all_results.sort(key=lambda x: x["price"])
+    return {
+        "options": all_results[:limit],
+        "candidates": candidate_stats,
+        "search": {
+            "mode": "compare",
+            "candidates_quoted": {name: len(quotes.get(name, [])) for name in providers},
+            "quotes_used": {name: usage[name]["upstream_quotes"] for name in providers},
+        },
+        "partial": skipped > 0,
+        "skipped": skipped,
+    }
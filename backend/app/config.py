@@ -18,6 +18,139 @@ GMAP_API_KEY = os.getenv("GMAP_API_KEY", "123")
 UBER_CLIENT_ID = os.getenv("UBER_CLIENT_ID", "123")
 UBER_CLIENT_SECRET = os.getenv("UBER_CLIENT_SECRET", "123")
 
+# Upstream API base URLs. Point them at the upstream simulator (app.simulator) to run
+# without Google or the pricing services, e.g. http://localhost:8001/maps/api
+GOOGLE_MAPS_API_URL = os.getenv("GOOGLE_MAPS_API_URL", "https://maps.googleapis.com/maps/api")
+UBER_ESTIMATE_API_URL = os.getenv("UBER_ESTIMATE_API_URL", "http://localhost:8000/estimates")
+LYFT_COST_API_URL = os.getenv("LYFT_COST_API_URL", "http://localhost:8000/lyft")
+
+# Upstream simulator: behaviour profile per simulated API (see simulator.py for the format),
+# how long a simulated timeout hangs, the share of points that reverse geocode to a street,
+# and the random seed (empty for a different run each time)
+SIM_GOOGLE_PROFILE = os.getenv("SIM_GOOGLE_PROFILE", "latency=lognormal:60:0.5")
+SIM_UBER_PROFILE = os.getenv("SIM_UBER_PROFILE", "latency=lognormal:120:0.6")
+SIM_LYFT_PROFILE = os.getenv("SIM_LYFT_PROFILE", "latency=lognormal:120:0.6")
+SIM_TIMEOUT_SECONDS = float(os.getenv("SIM_TIMEOUT_SECONDS", "30"))
+SIM_STREET_RATIO = float(os.getenv("SIM_STREET_RATIO", "0.85"))
+SIM_SEED = os.getenv("SIM_SEED", "")
+
+# Fare search tuning
+FARE_SEARCH_CONCURRENCY = int(os.getenv("FARE_SEARCH_CONCURRENCY", "17"))  # Candidates in flight
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "10"))  # Seconds per upstream call
+
+# Share of a request's latency budget (budget_ms) held back for quoting after street checks
+BUDGET_QUOTE_SHARE = float(os.getenv("BUDGET_QUOTE_SHARE", "0.3"))
+
+# Shared upstream HTTP client: connection pool bounds, idle keep-alive seconds, connect and
+# pool-wait timeouts, and whether to negotiate HTTP/2 (needs the h2 package)
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "200"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "100"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "60"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "3"))
+UPSTREAM_POOL_TIMEOUT = float(os.getenv("UPSTREAM_POOL_TIMEOUT", "5"))
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "false").lower() == "true"
+
+# Record/replay of upstream traffic: "off", "record" (call the upstreams and save each distinct
+# request's response to UPSTREAM_CASSETTE_PATH) or "replay" (answer only from the cassette),
+# and the factor applied to recorded upstream times on replay (0 answers at once)
+UPSTREAM_CASSETTE_MODE = os.getenv("UPSTREAM_CASSETTE_MODE", "off")
+UPSTREAM_CASSETTE_PATH = os.getenv("UPSTREAM_CASSETTE_PATH", "upstream.cassette")
+UPSTREAM_REPLAY_TIME_SCALE = float(os.getenv("UPSTREAM_REPLAY_TIME_SCALE", "1"))
+
+# Where fare searches get their quotes: "local" runs the mock pricing logic in-process,
+# "http" calls the estimate URLs (use this for real external providers)
+PRICING_PROVIDER = os.getenv("PRICING_PROVIDER", "local")
+
+# Street validation backend: "google" reverse-geocodes each point, "roads" checks a local
+# road-segment index (built with `python -m app.roads`) without any network call
+STREET_VALIDATION_BACKEND = os.getenv("STREET_VALIDATION_BACKEND", "google")
+ROAD_INDEX_PATH = os.getenv("ROAD_INDEX_PATH", "road_index")
+ROAD_MAX_DISTANCE_M = float(os.getenv("ROAD_MAX_DISTANCE_M", "15"))  # Max meters from a road
+
+# Candidate pattern around the pickup point: "rings", "hex" or "random". Rings/grid rows are
+# CANDIDATE_SPACING_FT apart, so denser searches come from a larger search_range
+CANDIDATE_PATTERN = os.getenv("CANDIDATE_PATTERN", "rings")
+CANDIDATE_BEARINGS = int(os.getenv("CANDIDATE_BEARINGS", "8"))
+CANDIDATE_SPACING_FT = float(os.getenv("CANDIDATE_SPACING_FT", "250"))
+MAX_CANDIDATES = int(os.getenv("MAX_CANDIDATES", "49"))  # Including the original spot
+
+# Search mode for /uber/best-uber-fare/: "exhaustive" quotes every candidate, "adaptive"
+# refines coarse-to-fine and stops at ADAPTIVE_QUOTE_BUDGET quotes or on convergence
+SEARCH_MODE = os.getenv("SEARCH_MODE", "exhaustive")
+ADAPTIVE_QUOTE_BUDGET = int(os.getenv("ADAPTIVE_QUOTE_BUDGET", "12"))
+ADAPTIVE_FIRST_RING_BEARINGS = int(os.getenv("ADAPTIVE_FIRST_RING_BEARINGS", "4"))
+
+# Candidate generation: snap offsets onto the nearest street point and drop snapped points
+# closer than SNAP_DEDUPE_DISTANCE_M to one already kept, before any price quote is made
+SNAP_CANDIDATES = os.getenv("SNAP_CANDIDATES", "true").lower() == "true"
+SNAP_MAX_DISTANCE_M = float(os.getenv("SNAP_MAX_DISTANCE_M", "60"))
+SNAP_DEDUPE_DISTANCE_M = float(os.getenv("SNAP_DEDUPE_DISTANCE_M", "20"))
+
+# Street-validity cache: geohash precision of a cell (8 is ~38 m x 19 m), TTL and size bound
+STREET_CACHE_PRECISION = int(os.getenv("STREET_CACHE_PRECISION", "8"))
+STREET_CACHE_TTL = float(os.getenv("STREET_CACHE_TTL", "86400"))
+STREET_CACHE_MAX_ENTRIES = int(os.getenv("STREET_CACHE_MAX_ENTRIES", "50000"))
+
+# Fare-quote cache: pickup and drop-off geohash precisions (8 is ~38 m, 7 is ~150 m),
+# TTL and size bound. A TTL of 0 keeps only the coalescing of identical in-flight quotes.
+QUOTE_CACHE_PICKUP_PRECISION = int(os.getenv("QUOTE_CACHE_PICKUP_PRECISION", "8"))
+QUOTE_CACHE_DROPOFF_PRECISION = int(os.getenv("QUOTE_CACHE_DROPOFF_PRECISION", "7"))
+QUOTE_CACHE_TTL = float(os.getenv("QUOTE_CACHE_TTL", "30"))
+QUOTE_CACHE_MAX_ENTRIES = int(os.getenv("QUOTE_CACHE_MAX_ENTRIES", "20000"))
+
+# Stale-while-revalidate results of whole searches: how long results are kept, the size
+# bound, the default staleness a request accepts (0 = always search), and the age after
+# which serving a stored result also refreshes it in the background
+ROUTE_CACHE_MAX_AGE = float(os.getenv("ROUTE_CACHE_MAX_AGE", "600"))
+ROUTE_CACHE_MAX_ENTRIES = int(os.getenv("ROUTE_CACHE_MAX_ENTRIES", "5000"))
+ROUTE_MAX_STALE = float(os.getenv("ROUTE_MAX_STALE", "0"))
+ROUTE_REFRESH_AFTER = float(os.getenv("ROUTE_REFRESH_AFTER", "5"))
+
+# Geocoding cache (/geocode, /reverse_geocode, /autocomplete): TTL per endpoint, in-memory
+# size bound, whether to also keep entries in the geocode_cache table, the geohash precision
+# reverse geocoding points share a result at (9 is ~5 m), and that of the autocomplete
+# location-bias cell (4 is ~39 km x 20 km)
+GEOCODE_CACHE_TTL = float(os.getenv("GEOCODE_CACHE_TTL", "2592000"))
+REVERSE_GEOCODE_CACHE_TTL = float(os.getenv("REVERSE_GEOCODE_CACHE_TTL", "604800"))
+AUTOCOMPLETE_CACHE_TTL = float(os.getenv("AUTOCOMPLETE_CACHE_TTL", "86400"))
+GEO_CACHE_MAX_ENTRIES = int(os.getenv("GEO_CACHE_MAX_ENTRIES", "20000"))
+GEO_CACHE_PERSIST = os.getenv("GEO_CACHE_PERSIST", "true").lower() == "true"
+REVERSE_GEOCODE_CACHE_PRECISION = int(os.getenv("REVERSE_GEOCODE_CACHE_PRECISION", "9"))
+AUTOCOMPLETE_BIAS_PRECISION = int(os.getenv("AUTOCOMPLETE_BIAS_PRECISION", "4"))
+
+# Batch geocoding: maximum items per request and distinct lookups resolved at the same time
+GEOCODE_BATCH_MAX_ITEMS = int(os.getenv("GEOCODE_BATCH_MAX_ITEMS", "100"))
+GEOCODE_BATCH_CONCURRENCY = int(os.getenv("GEOCODE_BATCH_CONCURRENCY", "8"))
+
+# Local autocomplete from saved and history addresses: users whose index stays in memory,
+# local matches returned, and how many of them make the Google call unnecessary
+ADDRESS_INDEX_MAX_USERS = int(os.getenv("ADDRESS_INDEX_MAX_USERS", "10000"))
+AUTOCOMPLETE_LOCAL_LIMIT = int(os.getenv("AUTOCOMPLETE_LOCAL_LIMIT", "5"))
+AUTOCOMPLETE_LOCAL_ENOUGH = int(os.getenv("AUTOCOMPLETE_LOCAL_ENOUGH", "3"))
+
+# Process-wide caps on concurrent upstream calls, shared by all requests
+GEOCODING_CONCURRENCY = int(os.getenv("GEOCODING_CONCURRENCY", "32"))
+UBER_ESTIMATE_CONCURRENCY = int(os.getenv("UBER_ESTIMATE_CONCURRENCY", "32"))
+LYFT_COST_CONCURRENCY = int(os.getenv("LYFT_COST_CONCURRENCY", "32"))
+
+# Hedged upstream calls: a duplicate request is sent when the first one hasn't answered after
+# the HEDGE_PERCENTILE latency of the last HEDGE_WINDOW calls (at least HEDGE_MIN_DELAY_MS),
+# once HEDGE_MIN_SAMPLES are known, and for at most HEDGE_MAX_SHARE of all calls
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "200"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MIN_DELAY_MS = float(os.getenv("HEDGE_MIN_DELAY_MS", "20"))
+HEDGE_MAX_SHARE = float(os.getenv("HEDGE_MAX_SHARE", "0.1"))
+
+# Circuit breakers per upstream: consecutive failures that open one, and seconds it stays
+# open (failing fast) before a single trial call is let through
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+
+# Prometheus metrics at /metrics; turning them off also drops the per-request timing middleware
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
 conf = ConnectionConfig(
     MAIL_USERNAME=MAIL_USERNAME,
     MAIL_PASSWORD=MAIL_PASSWORD,
@@ -1,7 +1,9 @@
 """Database Configuration for FastAPI App"""
 import os
-from sqlalchemy import create_engine
+import time
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
+from .metrics import collector, db_connection_held_seconds
 
 # Load environment variable or fallback to default MySQL connection
 DATABASE_URL = os.getenv(
@@ -11,6 +13,20 @@ DATABASE_URL = os.getenv(
 # Create the SQLAlchemy engine
 engine = create_engine(DATABASE_URL, echo=True, pool_pre_ping=True, pool_recycle=1800)
 
+
+@event.listens_for(engine, "checkout")
+def _on_checkout(_dbapi_connection, connection_record, _connection_proxy):
+    """ Notes when a connection leaves the pool, for the held-time histogram. """
+    connection_record.info["checked_out_at"] = time.perf_counter()
+
+
+@event.listens_for(engine, "checkin")
+def _on_checkin(_dbapi_connection, connection_record):
+    """ Records how long the connection was checked out. """
+    started = connection_record.info.pop("checked_out_at", None)
+    if started is not None:
+        db_connection_held_seconds.observe(time.perf_counter() - started)
+
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -30,3 +46,17 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+@collector
+def collect():
+    """ Connection pool usage for /metrics (pools without a fixed size report what they can). """
+    pool = engine.pool
+    figures = [
+        ("farefinder_db_pool_size", "Connections the pool keeps open", "size"),
+        ("farefinder_db_pool_checked_out", "Connections in use", "checkedout"),
+        # QueuePool counts overflow from -size while the pool isn't full yet
+        ("farefinder_db_pool_overflow", "Connections open beyond the pool size", "overflow"),
+    ]
+    return [(name, "gauge", documentation, [({}, max(0, getattr(pool, method)()))])
+            for name, documentation, method in figures if hasattr(pool, method)]
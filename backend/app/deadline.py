@@ -0,0 +1,70 @@
+""" Per-request latency budgets: one deadline carried to every upstream call made for a request. """
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+import httpx
+from .config import UPSTREAM_TIMEOUT, BUDGET_QUOTE_SHARE
+
+# Monotonic time by which the current request must answer, or None for no budget
+current_deadline = ContextVar("current_deadline", default=None)
+
+# Returned by until_deadline for work the budget cut off
+SKIPPED = object()
+
+
+class BudgetExceeded(Exception):
+    """ The request's latency budget ran out before an upstream call could be made. """
+
+
+@contextmanager
+def budget_scope(budget_ms):
+    """
+    Gives every upstream call made inside the block a deadline `budget_ms` from now.
+    With `budget_ms` None the block runs without a deadline.
+    """
+    deadline = None if budget_ms is None else time.monotonic() + budget_ms / 1000
+    token = current_deadline.set(deadline)
+    try:
+        yield
+    finally:
+        current_deadline.reset(token)
+
+
+def remaining():
+    """ Seconds left in the current budget, or None when there is no deadline. """
+    deadline = current_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def call_timeout(default=UPSTREAM_TIMEOUT):
+    """ Timeout for the next upstream call: `default`, capped at the time left in the budget. """
+    left = remaining()
+    if left is None:
+        return default
+    if left <= 0:
+        raise BudgetExceeded()
+    return min(default, left)
+
+
+def quote_reserve():
+    """
+    Seconds of the remaining budget held back for quoting, so street checks can't use it all.
+    """
+    left = remaining()
+    return 0.0 if left is None else max(left, 0.0) * BUDGET_QUOTE_SHARE
+
+
+async def until_deadline(awaitable, reserve=0.0):
+    """
+    Awaits `awaitable`, or cancels it and returns SKIPPED once the budget, less `reserve`
+    seconds, runs out. Upstream timeouts under a budget count as cut off too, since
+    call_timeout caps them at the deadline. Without a deadline this is a plain await.
+    """
+    left = remaining()
+    if left is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, max(left - reserve, 0.0))
+    except (asyncio.TimeoutError, BudgetExceeded, httpx.TimeoutException):
+        return SKIPPED
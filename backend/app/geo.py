@@ -0,0 +1,46 @@
+""" Small geographic helpers shared across the app. """
+import math
+
+# Meters per degree of latitude (WGS84 equatorial radius)
+METERS_PER_DEGREE = 6378137 * math.pi / 180
+
+_GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash(lat, lon, precision=8):
+    """
+    Encodes a latitude/longitude as a geohash string of `precision` characters.
+    Points in the same cell share a hash (precision 7 is ~150 m, 8 is ~38 m, 9 is ~5 m).
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+def distance_m(lat1, lon1, lat2, lon2):
+    """
+    Approximate distance in meters between two nearby points (equirectangular projection).
+    Accurate to well under a percent over the few hundred meters of a pickup search.
+    """
+    dy = (lat2 - lat1) * METERS_PER_DEGREE
+    dx = (lon2 - lon1) * METERS_PER_DEGREE * math.cos(math.radians((lat1 + lat2) / 2))
+    return math.hypot(dx, dy)
@@ -0,0 +1,148 @@
+""" Two-tier cache for Google geocoding responses: an in-memory LRU in front of a SQL table. """
+import hashlib
+import json
+from datetime import datetime, timedelta
+from sqlalchemy import delete, insert, select
+from sqlalchemy.exc import SQLAlchemyError
+from fastapi.concurrency import run_in_threadpool
+from .cache import TTLCache, caches
+from .config import (GEOCODE_CACHE_TTL, REVERSE_GEOCODE_CACHE_TTL, AUTOCOMPLETE_CACHE_TTL,
+                     GEO_CACHE_MAX_ENTRIES, GEO_CACHE_PERSIST, REVERSE_GEOCODE_CACHE_PRECISION,
+                     AUTOCOMPLETE_BIAS_PRECISION)
+from .database import engine
+from .geo import geohash
+from .models import GeocodeCacheEntry
+
+# Google statuses worth caching; anything else (quota, denied, errors) is retried next time
+CACHEABLE_STATUSES = {"OK", "ZERO_RESULTS"}
+
+_table = GeocodeCacheEntry.__table__
+
+
+class TieredCache:
+    """
+    Per-process TTLCache (L1) in front of the geocode_cache table (L2), which survives
+    restarts and is shared by every worker using the same database.
+    Database queries run in the threadpool so they don't block the event loop.
+    """
+
+    def __init__(self, name, ttl, max_entries=GEO_CACHE_MAX_ENTRIES, persist=GEO_CACHE_PERSIST):
+        self.name = name
+        self.ttl = ttl
+        self.persist = persist
+        self.memory = TTLCache(name, ttl, max_entries, register=False)
+        self.l1_hits = 0
+        self.l2_hits = 0
+        self.misses = 0
+        self.l2_errors = 0
+        caches[name] = self
+
+    async def get_or_fetch(self, key, fetch):
+        """
+        Returns the cached response for `key` from memory, then from the database, or awaits
+        `fetch()` (the upstream request) and stores its JSON body in both tiers when Google
+        reports a cacheable status.
+        """
+        found, value = self.memory.get(key)
+        if found:
+            self.l1_hits += 1
+            return value
+
+        if self.persist:
+            value, remaining = await run_in_threadpool(self._load, key)
+            if value is not None:
+                self.l2_hits += 1
+                self.memory.set(key, value, ttl=min(self.ttl, remaining))
+                return value
+
+        self.misses += 1
+        value = await fetch()
+        if value.get("status") in CACHEABLE_STATUSES:
+            self.memory.set(key, value)
+            if self.persist:
+                await run_in_threadpool(self._store, key, value)
+        return value
+
+    def _row_key(self, key):
+        return hashlib.sha256(f"{self.name}|{key}".encode("utf-8")).hexdigest()
+
+    def _load(self, key):
+        """ (value, seconds left) from the database, or (None, 0) when missing or expired. """
+        try:
+            with engine.connect() as conn:
+                row = conn.execute(
+                    select(_table.c.response, _table.c.expires_at)
+                    .where(_table.c.key == self._row_key(key))
+                ).first()
+        except SQLAlchemyError:
+            self.l2_errors += 1
+            return None, 0
+        if row is None:
+            return None, 0
+        remaining = (row.expires_at - datetime.now()).total_seconds()
+        if remaining <= 0:
+            return None, 0
+        return json.loads(row.response), remaining
+
+    def _store(self, key, value):
+        """ Replaces the database row for `key`; failures only cost the persistent copy. """
+        row_key = self._row_key(key)
+        try:
+            with engine.begin() as conn:
+                conn.execute(delete(_table).where(_table.c.key == row_key))
+                conn.execute(insert(_table).values(
+                    key=row_key,
+                    cache_name=self.name,
+                    response=json.dumps(value),
+                    expires_at=datetime.now() + timedelta(seconds=self.ttl),
+                ))
+        except SQLAlchemyError:
+            # Another worker may have stored the same key first
+            self.l2_errors += 1
+
+    def stats(self):
+        """ Hits per tier, upstream calls made and saved, and the combined hit ratio. """
+        lookups = self.l1_hits + self.l2_hits + self.misses
+        return {
+            "size": self.memory.stats()["size"],
+            "max_entries": self.memory.max_entries,
+            "ttl_seconds": self.ttl,
+            "persistent": self.persist,
+            "l1_hits": self.l1_hits,
+            "l2_hits": self.l2_hits,
+            "l2_errors": self.l2_errors,
+            "upstream_calls": self.misses,
+            "upstream_calls_saved": self.l1_hits + self.l2_hits,
+            "hit_ratio": round((self.l1_hits + self.l2_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+geocode_cache = TieredCache("geocode", GEOCODE_CACHE_TTL)
+reverse_geocode_cache = TieredCache("reverse_geocode", REVERSE_GEOCODE_CACHE_TTL)
+autocomplete_cache = TieredCache("autocomplete", AUTOCOMPLETE_CACHE_TTL)
+
+
+def normalize_text(text):
+    """ Case- and whitespace-insensitive form of user-typed input. """
+    return " ".join(text.lower().split())
+
+
+def geocode_key(address):
+    """ Cache key for a forward geocode. """
+    return normalize_text(address)
+
+
+def reverse_geocode_key(lat, lng):
+    """ Cache key for a reverse geocode: the point's geohash cell. """
+    return geohash(lat, lng, REVERSE_GEOCODE_CACHE_PRECISION)
+
+
+def autocomplete_key(text, lat=None, lng=None):
+    """
+    Cache key for an autocomplete prefix: the normalized input plus the coarse cell of the
+    location bias, so nearby users typing the same prefix share suggestions.
+    """
+    cell = "-"
+    if lat is not None and lng is not None:
+        cell = geohash(lat, lng, AUTOCOMPLETE_BIAS_PRECISION)
+    return f"{cell}|{normalize_text(text)}"
@@ -1,153 +1,216 @@
 """ Lyft API functions for finding the best fare for a given location and for cost estimates. """
-from math import radians, sin, cos, sqrt, atan2
+from math import radians, cos
 import random
 import math
-import string
-import requests
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Literal, Optional
 from fastapi import APIRouter, HTTPException, Query
-from .models import PriceEstimate, LyftCostEstimate, LyftCostEstimatesResponse
-from .config import GMAP_API_KEY
+from .schemas import (LyftCostEstimatesResponse, LyftCostBatchRequest,
+                      LyftCostEstimatesBatchResponse)
+from .config import (FARE_SEARCH_CONCURRENCY, PRICING_PROVIDER, CANDIDATE_PATTERN, ROUTE_MAX_STALE,
+                     LYFT_COST_API_URL)
+from .pricing import lyft_cost_estimates, lyft_cost_estimates_batch
+from .upstream import get_client
+from .deadline import SKIPPED, call_timeout, until_deadline
+from .scheduler import LYFT_COST
+from .resilience import CircuitOpen, call_upstream
+from .quotes import quote_cache, quote_key
+from .route_results import cached_search, route_key
+from .candidates import prepare_candidates, generate_candidates
+from .streaming import search_events, stream_response
 
 router = APIRouter()
 
 EARTH_RADIUS = 6378137
-LYFT_COST_URL = "http://localhost:8000/lyft/cost"
-
-# Fake Lyft products
-LYFT_PRODUCTS = [
-    {"display_name": "Lyft", "base_fare": 5.0, "per_km": 2.0, "product_id": "lyft_standard"},
-    {"display_name": "Lyft XL", "base_fare": 7.0, "per_km": 3.0, "product_id": "lyft_xl"},
-    {"display_name": "Lyft Lux", "base_fare": 10.0, "per_km": 4.0, "product_id": "lyft_lux"},
-]
-
-def haversine_distance(lat1, lon1, lat2, lon2):
-    """Calculate the great circle distance between two points on the Earth (in kilometers)."""
-    r = 6371.0  # Earth radius in kilometers
-    lat1_rad = radians(lat1)
-    lon1_rad = radians(lon1)
-    lat2_rad = radians(lat2)
-    lon2_rad = radians(lon2)
-    dlat = lat2_rad - lat1_rad
-    dlon = lon2_rad - lon1_rad
-    a = sin(dlat/2)**2 + cos(lat1_rad) * cos(lat2_rad) * sin(dlon/2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
-    return r * c
-
-def get_lyft_cost_estimates(start_lat, start_lon, end_lat, end_lon, ride_type="lyft_standard"):
-    """
-    Queries the mock Lyft /cost API to get ride cost estimates.
+LYFT_COST_URL = f"{LYFT_COST_API_URL}/cost"
+LYFT_COST_BATCH_URL = f"{LYFT_COST_API_URL}/cost/batch"
+
+async def get_lyft_cost_estimates(client, start_lat, start_lon, end_lat, end_lon,
+                                  ride_type=None):
+    """
+    Gets ride cost estimates from the mock Lyft pricing logic, either in-process
+    or through the /cost API depending on PRICING_PROVIDER.
+    ride_type: A ride type, a list of them, or None for every Lyft product in one call
+    Estimates are cached briefly per pickup/drop-off cell and ride types, and identical
+    concurrent requests share one upstream call.
     """
+    key = quote_key("lyft", ride_type, start_lat, start_lon, end_lat, end_lon)
+    return await quote_cache.get_or_load(
+        key,
+        lambda: _fetch_lyft_cost_estimates(client, start_lat, start_lon, end_lat, end_lon,
+                                           ride_type),
+    )
+
+async def _fetch_lyft_cost_estimates(client, start_lat, start_lon, end_lat, end_lon, ride_type):
+    """ Uncached single-pickup call behind the quote cache """
+    if PRICING_PROVIDER == "local":
+        response = lyft_cost_estimates(ride_type, start_lat, start_lon, end_lat, end_lon)
+        return [estimate.model_dump() for estimate in response.cost_estimates]
+
     params = {
-        "ride_type": ride_type,
         "start_lat": start_lat,
         "start_lng": start_lon,
         "end_lat": end_lat,
         "end_lng": end_lon,
     }
-    
-    response = requests.get(LYFT_COST_URL, params=params, timeout=10)
-    
+    if ride_type is not None:
+        params["ride_type"] = ride_type
+
+    response = await call_upstream(
+        LYFT_COST, lambda: client.get(LYFT_COST_URL, params=params, timeout=call_timeout())
+    )
+
     if response.status_code != 200:
         raise HTTPException(status_code=response.status_code, detail=response.json())
-    
+
     return response.json().get("cost_estimates", [])
 
-def move_location(lat, lon, meters, direction):
+async def get_lyft_cost_estimates_batch(client, starts, end_lat, end_lon, ride_type=None,
+                                        usage=None):
     """
-    Moves a latitude/longitude coordinate by a given number of meters in the specified direction.
+    Gets cost estimates from every start point to the same destination in one call:
+    one vectorized pass in-process, or one POST to the batch /cost API.
+    starts: (lat, lon, ...) tuples; returns one list of estimates per start, in input order.
+    Only starts whose cell isn't in the quote cache (or already being quoted) are sent.
+    usage: Optional dict whose "upstream_quotes" is increased by the number of starts sent
     """
-    delta_lat = (meters / EARTH_RADIUS) * (180 / math.pi)
-    delta_lon = (meters / EARTH_RADIUS) * (180 / math.pi) / cos(radians(lat))
-    directions = {
-        "N": (lat + delta_lat, lon),
-        "S": (lat - delta_lat, lon),
-        "E": (lat, lon + delta_lon),
-        "W": (lat, lon - delta_lon),
-        "NE": (lat + delta_lat, lon + delta_lon),
-        "NW": (lat + delta_lat, lon - delta_lon),
-        "SE": (lat - delta_lat, lon + delta_lon),
-        "SW": (lat - delta_lat, lon - delta_lon),
+    keys = [quote_key("lyft", ride_type, start[0], start[1], end_lat, end_lon) for start in starts]
+    by_key = dict(zip(keys, starts))
+
+    async def load(missing):
+        estimates = await _fetch_lyft_cost_estimates_batch(
+            client, [by_key[key] for key in missing], end_lat, end_lon, ride_type
+        )
+        if usage is not None:
+            usage["upstream_quotes"] += len(missing)
+        return estimates
+
+    return await quote_cache.get_many_or_load(keys, load)
+
+async def _fetch_lyft_cost_estimates_batch(client, starts, end_lat, end_lon, ride_type):
+    """ Uncached batch call behind the quote cache """
+    start_lats = [start[0] for start in starts]
+    start_lngs = [start[1] for start in starts]
+
+    if PRICING_PROVIDER == "local":
+        return lyft_cost_estimates_batch(ride_type, start_lats, start_lngs, end_lat, end_lon)
+
+    body = {
+        "requests": [
+            {"start_lat": lat, "start_lng": lng, "end_lat": end_lat, "end_lng": end_lon}
+            for lat, lng in zip(start_lats, start_lngs)
+        ],
     }
-    return directions.get(direction, (lat, lon))
+    if ride_type is not None:
+        body["ride_type"] = [ride_type] if isinstance(ride_type, str) else list(ride_type)
+
+    response = await call_upstream(
+        LYFT_COST, lambda: client.post(LYFT_COST_BATCH_URL, json=body, timeout=call_timeout())
+    )
 
-def is_valid_street(lat, lon):
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail=response.json())
+
+    return [result.get("cost_estimates", []) for result in response.json().get("results", [])]
+
+async def process_location(client, location, end_lat, end_lon):
     """
-    Uses Google Maps Reverse Geocoding API to check if the coordinates correspond to a valid street.
+    Retrieves Lyft cost estimates for a candidate from prepare_candidates.
+    Returns a tuple of (label, prices).
     """
-    if not GMAP_API_KEY:
-        return True
+    lat, lon, label = location
+    prices = await get_lyft_cost_estimates(client, lat, lon, end_lat, end_lon)
+    return (label, prices)
 
-    url = f"https://maps.googleapis.com/maps/api/geocode/json?latlng={lat},{lon}&key={GMAP_API_KEY}"
-    response = requests.get(url, timeout=10).json()
-    for result in response.get("results", []):
-        if "route" in result.get("types", []):
-            return True
-    return False
+async def quote_location(client, location, end_lat, end_lon):
+    """
+    Quotes one pickup spot and returns its ranked-list options, or SKIPPED while the
+    cost API's circuit breaker is open.
+    """
+    try:
+        _, prices = await process_location(client, location, end_lat, end_lon)
+    except CircuitOpen:
+        return SKIPPED
+    return lyft_options(location, prices)
 
+async def quote_locations(client, locations, end_lat, end_lon, usage=None):
+    """
+    Quotes many pickup spots with a single batch cost call.
+    Returns one list of ranked-list options per location, in input order, or SKIPPED
+    while the cost API's circuit breaker is open.
+    usage: Optional dict whose "upstream_quotes" counts the estimates loaded from upstream
+    """
+    try:
+        batch = await get_lyft_cost_estimates_batch(client, locations, end_lat, end_lon,
+                                                    usage=usage)
+    except CircuitOpen:
+        return SKIPPED
+    return [lyft_options(location, prices) for location, prices in zip(locations, batch)]
 
-def process_location(location, end_lat, end_lon):
+def lyft_options(location, prices):
     """
-    Checks if a given location is valid and retrieves Lyft cost estimates.
-    Returns a tuple of (label, prices) if valid, or None otherwise.
+    Turns the Lyft cost estimates for one pickup spot into ranked-list options (prices in dollars).
     """
     lat, lon, label = location
-    if is_valid_street(lat, lon):
-        prices = get_lyft_cost_estimates(lat, lon, end_lat, end_lon)
-        return (label, prices)
-    return None
+    return [
+        {
+            "location":    label,
+            "pickup_lat":  lat,
+            "pickup_lon":  lon,
+            "price":       ride["estimated_cost_cents_min"] / 100.0,
+            "ride_type":   ride.get("display_name"),
+        }
+        for ride in prices
+        if ride.get("estimated_cost_cents_min") is not None
+    ]
 
-def find_best_fare(start_lat, start_lon, end_lat, end_lon):
+async def find_best_fare(start_lat, start_lon, end_lat, end_lon, search_range=500,
+                         concurrency=FARE_SEARCH_CONCURRENCY, pattern=CANDIDATE_PATTERN):
     """
     Finds the best Lyft fare by checking the original location and several
-    nearby pickup spots in parallel.
-    """
-    # Generate a list of nearby pickup locations (300ft and 500ft offsets in various directions)
-    locations = [
-        (start_lat, start_lon, "Original"),
-        move_location(start_lat, start_lon, 91, "N") + ("N 300ft",),
-        move_location(start_lat, start_lon, 152, "N") + ("N 500ft",),
-        move_location(start_lat, start_lon, 91, "E") + ("E 300ft",),
-        move_location(start_lat, start_lon, 152, "E") + ("E 500ft",),
-        move_location(start_lat, start_lon, 91, "S") + ("S 300ft",),
-        move_location(start_lat, start_lon, 152, "S") + ("S 500ft",),
-        move_location(start_lat, start_lon, 91, "W") + ("W 300ft",),
-        move_location(start_lat, start_lon, 152, "W") + ("W 500ft",),
-        move_location(start_lat, start_lon, 91, "NE") + ("NE 300ft",),
-        move_location(start_lat, start_lon, 152, "NE") + ("NE 500ft",),
-        move_location(start_lat, start_lon, 91, "NW") + ("NW 300ft",),
-        move_location(start_lat, start_lon, 152, "NW") + ("NW 500ft",),
-        move_location(start_lat, start_lon, 91, "SE") + ("SE 300ft",),
-        move_location(start_lat, start_lon, 152, "SE") + ("SE 500ft",),
-        move_location(start_lat, start_lon, 91, "SW") + ("SW 300ft",),
-        move_location(start_lat, start_lon, 152, "SW") + ("SW 500ft",),
-    ]
-    
+    nearby pickup spots concurrently.
+    search_range: Maximum distance in feet to search for alternative pickup locations
+    concurrency: Maximum number of pickup spots street-checked at the same time
+    pattern: Candidate layout passed to generate_candidates
+    "skipped" counts candidates cut off by the request's latency budget or left unpriced
+    while the cost API's circuit breaker is open ("partial" if any).
+    """
+    locations = generate_candidates(start_lat, start_lon, search_range, pattern)
+
     best_price = None
     best_location = None
     best_ride_type = None
 
-    # Use a thread pool to process locations concurrently
-    with ThreadPoolExecutor(max_workers=len(locations)) as executor:
-        futures = [executor.submit(process_location, loc, end_lat, end_lon) for loc in locations]
-        for future in as_completed(futures):
-            result = future.result()
-            if result is None:
-                continue
-            label, prices = result
-            for ride in prices:
-                # Convert cents to dollars for comparison
-                price = ride.get("estimated_cost_cents_min") / 100.0
-                ride_type = ride.get("display_name")
-                if best_price is None or (price is not None and price < best_price):
-                    best_price = price
-                    best_location = label
-                    best_ride_type = ride_type
+    # Check streets concurrently, then price every candidate with one batch call
+    client = get_client()
+    locations, candidate_stats = await prepare_candidates(client, locations,
+                                                          concurrency=concurrency)
+    skipped = candidate_stats["skipped"]
+    try:
+        batch = await until_deadline(get_lyft_cost_estimates_batch(client, locations,
+                                                                   end_lat, end_lon))
+    except CircuitOpen:
+        batch = SKIPPED
+    if batch is SKIPPED:
+        skipped += len(locations)
+        batch = []
+
+    for (_, _, label), prices in zip(locations, batch):
+        for ride in prices:
+            # Convert cents to dollars for comparison
+            price = ride.get("estimated_cost_cents_min") / 100.0
+            ride_type = ride.get("display_name")
+            if best_price is None or (price is not None and price < best_price):
+                best_price = price
+                best_location = label
+                best_ride_type = ride_type
 
     return {
         "best_location": best_location,
         "best_price": best_price,
-        "best_ride_type": best_ride_type
+        "best_ride_type": best_ride_type,
+        "candidates": candidate_stats,
+        "partial": skipped > 0,
+        "skipped": skipped,
     }
 
 def random_offset(lat, lon, max_offset=400):
@@ -163,64 +226,86 @@ def random_offset(lat, lon, max_offset=400):
     return round(new_lat, 6), round(new_lon, 6)
 
 @router.get("/best-lyft-fare/")
-def get_best_lyft_fare(start_lat: float, start_lon: float, end_lat: float, end_lon: float):
+async def get_best_lyft_fare(
+    start_lat: float,
+    start_lon: float,
+    end_lat: float,
+    end_lon: float,
+    search_range: int = Query(500, gt=0),
+    pattern: Literal["rings", "hex", "random"] = CANDIDATE_PATTERN,
+    max_stale: float = Query(ROUTE_MAX_STALE, ge=0),
+    budget_ms: Optional[int] = Query(None, ge=1),
+):
     """
     API Endpoint to find the best Lyft fare by checking multiple nearby pickup locations.
+    search_range: Maximum distance in feet to search for alternative pickup locations (default: 500 feet)
+    pattern: How nearby pickup spots are laid out: "rings", "hex" or "random"
+    max_stale: Seconds old a previous result for the same route may be; it is returned at
+               once (see "age_seconds") and refreshed in the background
+    budget_ms: Latency budget in milliseconds; spots not checked or quoted in time are
+               left out and counted in "skipped", with "partial" set
     """
     try:
-        best_fare = find_best_fare(start_lat, start_lon, end_lat, end_lon)
-        return best_fare
+        key = route_key("lyft", start_lat, start_lon, end_lat, end_lon, search_range, pattern)
+        return await cached_search(
+            key,
+            lambda: find_best_fare(start_lat, start_lon, end_lat, end_lon, search_range,
+                                   pattern=pattern),
+            max_stale,
+            budget_ms,
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) from e
 
-def generate_token() -> str:
-    """Generate a fake token string."""
-    return ''.join(random.choices(string.ascii_letters + string.digits, k=20))
+@router.get("/best-lyft-fare/stream")
+async def stream_best_lyft_fare(
+    start_lat: float,
+    start_lon: float,
+    end_lat: float,
+    end_lon: float,
+    limit: int = 3,
+    search_range: int = Query(500, gt=0),
+    pattern: Literal["rings", "hex", "random"] = CANDIDATE_PATTERN,
+    format: Literal["ndjson", "sse"] = "ndjson",  # pylint: disable=redefined-builtin
+    budget_ms: Optional[int] = Query(None, ge=1),
+):
+    """
+    Streams each pickup spot's Lyft quotes as they arrive, plus running top `limit` updates.
+    The last message ({"type": "result"}) is the authoritative ranked list.
+    format: "ndjson" (one JSON message per line) or "sse" (server-sent events)
+    """
+    events = search_events(
+        start_lat, start_lon, search_range, pattern,
+        lambda client, loc: quote_location(client, loc, end_lat, end_lon), limit,
+        budget_ms=budget_ms,
+    )
+    return stream_response(events, format)
 
 @router.get("/cost", response_model=LyftCostEstimatesResponse)
 def get_lyft_cost_estimates_endpoint(
-    ride_type: str = Query(..., description="ID of a ride type"),
+    ride_type: Optional[List[str]] = Query(
+        None, description="ID of a ride type; repeat it or leave it out to get several products"
+    ),
     start_lat: float = Query(..., description="Latitude of the starting location"),
     start_lng: float = Query(..., description="Longitude of the starting location"),
     end_lat: float = Query(..., description="Latitude of the ending location"),
     end_lng: float = Query(..., description="Longitude of the ending location")
 ):
     """
-    Fake Lyft cost estimates endpoint that mimics the real Lyft API.
-    """
-    # Filter product based on ride_type
-    matching_products = [p for p in LYFT_PRODUCTS if p["product_id"] == ride_type]
-    if not matching_products:
-        raise HTTPException(status_code=400, detail="Invalid ride_type provided")
-    product = matching_products[0]
-
-    # Calculate distance in kilometers and convert to miles
-    distance_km = haversine_distance(start_lat, start_lng, end_lat, end_lng)
-    distance_miles = distance_km * 0.621371
-
-    # Calculate fake fare in dollars
-    cost_dollars = product["base_fare"] + (product["per_km"] * distance_km)
-    low_estimate = cost_dollars + random.uniform(-0.5, 0.5)
-    high_estimate = low_estimate * random.uniform(1.05, 1.2)
-    estimated_cost_cents_min = round(low_estimate * 100)
-    estimated_cost_cents_max = round(high_estimate * 100)
-
-    # Estimate duration using an assumed average speed
-    average_speed_mph = 30
-    estimated_duration_seconds = round(distance_miles / average_speed_mph * 3600)
-
-    token = generate_token()
-    cost_estimate = LyftCostEstimate(
-        cost_token=token,
-        display_name=product["display_name"],
-        estimated_cost_cents_min=estimated_cost_cents_min,
-        estimated_cost_cents_max=estimated_cost_cents_max,
-        estimated_distance_miles=round(distance_miles, 1),
-        estimated_duration_seconds=estimated_duration_seconds,
-        is_valid_estimate=True,
-        primetime_confirmation_token=token,
-        primetime_percentage="25%",
-        ride_type=product["product_id"]
-    )
+    Fake Lyft cost estimates endpoint that mimics the real Lyft API: estimates for every
+    product when ride_type is omitted, or for each ride_type given.
+    """
+    return lyft_cost_estimates(ride_type, start_lat, start_lng, end_lat, end_lng)
 
-    return LyftCostEstimatesResponse(cost_estimates=[cost_estimate])
+@router.post("/cost/batch", response_model=LyftCostEstimatesBatchResponse)
+def get_lyft_cost_estimates_batch_endpoint(body: LyftCostBatchRequest):
+    """
+    Fake Lyft cost estimates for many origin/destination pairs in one call.
+    Results are returned in request order, each with the same products as /cost.
+    """
+    batch = lyft_cost_estimates_batch(
+        body.ride_type,
+        [r.start_lat for r in body.requests], [r.start_lng for r in body.requests],
+        [r.end_lat for r in body.requests], [r.end_lng for r in body.requests],
+    )
+    return {"results": [{"cost_estimates": estimates} for estimates in batch]}
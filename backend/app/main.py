@@ -2,9 +2,13 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.api import router as api_router
+from app.config import METRICS_ENABLED
 from app.database import init_db
+from app.metrics import MetricsMiddleware
+from app.upstream import lifespan
 
-app = FastAPI()
+# The lifespan opens and closes the shared upstream connection pools
+app = FastAPI(lifespan=lifespan)
 
 # start db
 init_db()
@@ -18,3 +22,7 @@ app.add_middleware(
 )
 
 app.include_router(api_router)
+
+# Outermost, so request timings include the other middleware
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
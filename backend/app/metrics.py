@@ -0,0 +1,281 @@
+"""
+Prometheus metrics served at /metrics, in the text exposition format.
+
+Hot paths only bump in-process counters and histogram buckets: a dict lookup, a bisect and a
+few additions, without locks. Nearly all updates happen on the event loop; the few made from
+worker threads (DB checkins) may rarely lose an increment to a race, which is accepted.
+Figures the app already keeps (cache counters, scheduler lanes, breakers, the DB pool) are
+read by collectors when /metrics is scraped instead of being tracked twice.
+"""
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+import anyio.to_thread
+
+# Seconds; from cache-hit street checks up to calls that run into UPSTREAM_TIMEOUT
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0)
+# Candidates per search
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 17, 25, 50, 75, 100, 150, 200)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Every metric and collector registers itself here, in exposition order
+_metrics = []
+_collectors = []
+
+
+class _Metric(ABC):
+    """ A named metric family with one child per combination of label values. """
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        _metrics.append(self)
+
+    def labels(self, *values):
+        """ The child for these label values (in `labelnames` order), created on first use. """
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    @abstractmethod
+    def _new_child(self):
+        """ A fresh child holding the state for one combination of label values. """
+
+    @abstractmethod
+    def samples(self):
+        """ (suffix, labels, value) for every sample of this family. """
+
+
+class _CounterChild:  # pylint: disable=too-few-public-methods
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        """ Adds `amount` (never negative) to the counter. """
+        self.value += amount
+
+
+class Counter(_Metric):
+    """ Monotonic count, e.g. requests served. """
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        """ Increments the counter of a metric without labels. """
+        self._children[()].inc(amount)
+
+    def samples(self):
+        for values, child in self._children.items():
+            yield "_total", dict(zip(self.labelnames, values)), child.value
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        """ Records one observation. """
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    @contextmanager
+    def time(self):
+        """ Observes the seconds spent in the block. """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+
+class Histogram(_Metric):
+    """ Distribution of observations (latencies, sizes) over fixed buckets. """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        """ Records one observation of a metric without labels. """
+        self._children[()].observe(value)
+
+    def time(self):
+        """ Observes the seconds spent in the block, for a metric without labels. """
+        return self._children[()].time()
+
+    def samples(self):
+        for values, child in self._children.items():
+            labels = dict(zip(self.labelnames, values))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), child.counts):
+                cumulative += count
+                yield "_bucket", {**labels, "le": _number(bound)}, cumulative
+            yield "_count", labels, cumulative
+            yield "_sum", labels, child.sum
+
+
+def collector(function):
+    """
+    Registers `function` to run on every scrape. It returns (name, kind, documentation,
+    [(labels, value), ...]) tuples, with kind "gauge" or "counter" (name without "_total").
+    """
+    _collectors.append(function)
+    return function
+
+
+def render():
+    """ Every registered metric and collected value, in the text exposition format. """
+    lines = []
+    for metric in _metrics:
+        _header(lines, metric.name, metric.kind, metric.documentation)
+        for suffix, labels, value in metric.samples():
+            lines.append(_sample(metric.name + suffix, labels, value))
+    for function in _collectors:
+        for name, kind, documentation, samples in function():
+            _header(lines, name, kind, documentation)
+            suffix = "_total" if kind == "counter" else ""
+            for labels, value in samples:
+                lines.append(_sample(name + suffix, labels, value))
+    lines.append("")
+    return "\n".join(lines)
+
+
+def _header(lines, name, kind, documentation):
+    lines.append(f"# HELP {name} {_escape(documentation, quote=False)}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def _sample(name, labels, value):
+    if not labels:
+        return f"{name} {_number(value)}"
+    text = ",".join(f'{key}="{_escape(str(label))}"' for key, label in labels.items())
+    return f"{name}{{{text}}} {_number(value)}"
+
+
+def _escape(text, quote=True):
+    text = text.replace("\\", "\\\\").replace("\n", "\\n")
+    return text.replace('"', '\\"') if quote else text
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+# HTTP requests, by route template (not raw path) so label values stay bounded
+http_request_seconds = Histogram(
+    "farefinder_http_request_duration_seconds",
+    "Time to serve a request, to the end of the response body",
+    ("method", "route"),
+)
+http_requests = Counter(
+    "farefinder_http_requests", "Requests served", ("method", "route", "status"),
+)
+
+# Upstream calls made through the breakers (resilience.call_upstream)
+upstream_call_seconds = Histogram(
+    "farefinder_upstream_call_duration_seconds",
+    "Time for one upstream call, including the scheduler wait and any hedged duplicate",
+    ("upstream",),
+)
+upstream_calls = Counter(
+    "farefinder_upstream_calls",
+    "Upstream calls by outcome: ok, error (failed response or transport error), timeout, "
+    "rejected (circuit open) or abandoned (cancelled or cut off by the latency budget)",
+    ("upstream", "outcome"),
+)
+
+# Fare searches
+street_check_seconds = Histogram(
+    "farefinder_street_check_duration_seconds",
+    "Time to check or snap one pickup candidate onto a street",
+    ("backend",),
+)
+search_candidates = Histogram(
+    "farefinder_search_candidates",
+    "Pickup candidates per candidate preparation: generated, on a valid street, and sent "
+    "for quotes",
+    ("stage",),
+    buckets=COUNT_BUCKETS,
+)
+
+# SQLAlchemy pool
+db_connection_held_seconds = Histogram(
+    "farefinder_db_connection_held_seconds",
+    "Time a connection stays checked out of the SQLAlchemy pool, from checkout to checkin",
+)
+
+
+@collector
+def _collect_threadpool():
+    """ Use of the worker threads that run sync endpoints and database work. """
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    return [
+        ("farefinder_threadpool_limit", "gauge", "Worker threads available",
+         [({}, limiter.total_tokens)]),
+        ("farefinder_threadpool_busy", "gauge", "Worker threads running a task",
+         [({}, limiter.borrowed_tokens)]),
+        ("farefinder_threadpool_queued", "gauge", "Tasks waiting for a worker thread",
+         [({}, limiter.statistics().tasks_waiting)]),
+    ]
+
+
+class MetricsMiddleware:  # pylint: disable=too-few-public-methods
+    """
+    ASGI middleware timing every HTTP request by method and route template. Requests that
+    match no route are counted under route "unmatched".
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            route = scope.get("route")
+            labels = (scope["method"], getattr(route, "path", "unmatched"))
+            http_request_seconds.labels(*labels).observe(time.perf_counter() - started)
+            http_requests.labels(*labels, str(status)).inc()
@@ -1,9 +1,7 @@
 """This module contains the SQLAlchemy model for the User table."""
-from typing import List
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Float
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Float, Text
 from sqlalchemy.orm import relationship
-from pydantic import BaseModel
 from .database import Base
 
 # pylint: disable=too-few-public-methods
@@ -42,42 +40,6 @@ class Address(Base):
 
     user = relationship("User", back_populates="addresses")
 
-# Uber Prices
-class PriceEstimate(BaseModel):
-    """ PriceEstimate model """
-    localized_display_name: str
-    distance: float
-    display_name: str
-    product_id: str
-    high_estimate: float
-    low_estimate: float
-    duration: int
-    estimate: str
-    currency_code: str
-
-class PriceEstimatesResponse(BaseModel):
-    """ PriceEstimatesResponse model """
-    prices: List[PriceEstimate]
-
-
-# Lyft Cost Estimates Endpoint
-class LyftCostEstimate(BaseModel):
-    """ LyftCostEstimate model """
-    cost_token: str
-    display_name: str
-    estimated_cost_cents_min: int
-    estimated_cost_cents_max: int
-    estimated_distance_miles: float
-    estimated_duration_seconds: int
-    is_valid_estimate: bool
-    primetime_confirmation_token: str
-    primetime_percentage: str
-    ride_type: str
-
-class LyftCostEstimatesResponse(BaseModel):
-    """ LyftCostEstimatesResponse model """
-    cost_estimates: List[LyftCostEstimate]
-
 # User Addresses
 class UserAddress(Base):
     """ UserAddress model for storing user addresses """
@@ -91,3 +53,13 @@ class UserAddress(Base):
     longitude = Column(Float)
 
     user = relationship("User", back_populates="saved_addresses")
+
+# Persistent tier of the geocoding cache
+class GeocodeCacheEntry(Base):
+    """ GeocodeCacheEntry model for storing Google geocoding responses """
+    __tablename__ = "geocode_cache"
+
+    key = Column(String(64), primary_key=True)  # sha256 of the normalized request
+    cache_name = Column(String(50), index=True)  # e.g. "geocode", "autocomplete"
+    response = Column(Text)  # JSON body returned by Google
+    expires_at = Column(DateTime, index=True)
@@ -0,0 +1,216 @@
+""" Mock Uber and Lyft pricing logic, shared by the HTTP endpoints and the in-process fare search. """
+from math import radians, sin, cos, sqrt, atan2
+import random
+import string
+import numpy as np
+from fastapi import HTTPException
+from .schemas import PriceEstimate, PriceEstimatesResponse, LyftCostEstimate, LyftCostEstimatesResponse
+
+# Fake Uber products
+UBER_PRODUCTS = [
+    {"display_name": "UberX", "base_fare": 6.0, "per_km": 2.5, "product_id": "uberx123"},
+    {"display_name": "UberXL", "base_fare": 7.0, "per_km": 3.5, "product_id": "uberxl123"},
+    {"display_name": "Uber Black", "base_fare": 9.0, "per_km": 4.5,
+                                     "product_id": "uberblack123"},
+]
+
+# Fake Lyft products
+LYFT_PRODUCTS = [
+    {"display_name": "Lyft", "base_fare": 5.0, "per_km": 2.0, "product_id": "lyft_standard"},
+    {"display_name": "Lyft XL", "base_fare": 7.0, "per_km": 3.0, "product_id": "lyft_xl"},
+    {"display_name": "Lyft Lux", "base_fare": 10.0, "per_km": 4.0, "product_id": "lyft_lux"},
+]
+
+# Random source for the batch pricing functions
+_rng = np.random.default_rng()
+
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    """ Calculate the great circle distance between two points on the Earth (in kilometers) """
+    r = 6371.0  # Earth radius in kilometers
+    lat1_rad = radians(lat1)
+    lon1_rad = radians(lon1)
+    lat2_rad = radians(lat2)
+    lon2_rad = radians(lon2)
+    dlat = lat2_rad - lat1_rad
+    dlon = lon2_rad - lon1_rad
+    a = sin(dlat/2)**2 + cos(lat1_rad) * cos(lat2_rad) * sin(dlon/2)**2
+    c = 2 * atan2(sqrt(a), sqrt(1 - a))
+    return r * c
+
+
+def haversine_distance_batch(lat1, lon1, lat2, lon2):
+    """ Vectorized haversine_distance over arrays of coordinates (in kilometers) """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64))
+                              for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    return 6371.0 * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def generate_token() -> str:
+    """Generate a fake token string."""
+    return ''.join(random.choices(string.ascii_letters + string.digits, k=20))
+
+
+def uber_price_estimates(start_latitude, start_longitude, end_latitude, end_longitude,
+                         seat_count=1):
+    """ Computes mock price estimates for every Uber product """
+    if seat_count > 2:
+        raise HTTPException(status_code=400,
+                            detail="seat_count cannot be greater than 2 for uberPOOL.")
+
+    # Calculate distance between start and end points
+    distance_km = haversine_distance(start_latitude, start_longitude, end_latitude, end_longitude)
+
+    estimates = []
+    for product in UBER_PRODUCTS:
+        # Randomize fare within a range
+        dist = product["per_km"] * distance_km
+        low_estimate = product["base_fare"] + dist + random.uniform(-1, 1)
+        high_estimate = low_estimate * random.uniform(1.1, 1.5)
+        estimate_str = f"${low_estimate:.2f} - ${high_estimate:.2f}"
+
+        estimates.append(PriceEstimate(
+            localized_display_name=product["display_name"],
+            distance=distance_km,
+            display_name=product["display_name"],
+            product_id=product["product_id"],
+            high_estimate=round(high_estimate, 2),
+            low_estimate=round(low_estimate, 2),
+            duration=int(distance_km / 40 * 3600),  # Assuming average speed of 40 km/h
+            estimate=estimate_str,
+            currency_code="USD"
+        ))
+
+    return PriceEstimatesResponse(prices=estimates)
+
+
+def lyft_cost_estimates(ride_type, start_lat, start_lng, end_lat, end_lng):
+    """
+    Computes mock Lyft cost estimates. Like the real Lyft API, `ride_type` may be a single
+    ride type, a list of them, or None for every product in LYFT_PRODUCTS.
+    """
+    products = select_lyft_products(ride_type)
+
+    # Calculate distance in kilometers and convert to miles
+    distance_km = haversine_distance(start_lat, start_lng, end_lat, end_lng)
+    distance_miles = distance_km * 0.621371
+
+    # Estimate duration using an assumed average speed
+    average_speed_mph = 30
+    estimated_duration_seconds = round(distance_miles / average_speed_mph * 3600)
+
+    cost_estimates = []
+    for product in products:
+        # Calculate fake fare in dollars
+        cost_dollars = product["base_fare"] + (product["per_km"] * distance_km)
+        low_estimate = cost_dollars + random.uniform(-0.5, 0.5)
+        high_estimate = low_estimate * random.uniform(1.05, 1.2)
+
+        token = generate_token()
+        cost_estimates.append(LyftCostEstimate(
+            cost_token=token,
+            display_name=product["display_name"],
+            estimated_cost_cents_min=round(low_estimate * 100),
+            estimated_cost_cents_max=round(high_estimate * 100),
+            estimated_distance_miles=round(distance_miles, 1),
+            estimated_duration_seconds=estimated_duration_seconds,
+            is_valid_estimate=True,
+            primetime_confirmation_token=token,
+            primetime_percentage="25%",
+            ride_type=product["product_id"]
+        ))
+
+    return LyftCostEstimatesResponse(cost_estimates=cost_estimates)
+
+
+def select_lyft_products(ride_type):
+    """ LYFT_PRODUCTS matching a ride type, a list of ride types, or None for all of them """
+    if ride_type is None:
+        return LYFT_PRODUCTS
+    wanted = [ride_type] if isinstance(ride_type, str) else list(ride_type)
+    by_id = {p["product_id"]: p for p in LYFT_PRODUCTS}
+    if not wanted or any(r not in by_id for r in wanted):
+        raise HTTPException(status_code=400, detail="Invalid ride_type provided")
+    return [by_id[r] for r in dict.fromkeys(wanted)]
+
+
+def uber_price_estimates_batch(start_lats, start_lons, end_lats, end_lons, seat_count=1):
+    """
+    Computes mock Uber price estimates for many origin/destination pairs in one NumPy pass.
+    Returns one list of price estimate dicts per pair, in input order.
+    """
+    if seat_count > 2:
+        raise HTTPException(status_code=400,
+                            detail="seat_count cannot be greater than 2 for uberPOOL.")
+
+    distance_km = haversine_distance_batch(start_lats, start_lons, end_lats, end_lons)
+    base_fare = np.array([p["base_fare"] for p in UBER_PRODUCTS])
+    per_km = np.array([p["per_km"] for p in UBER_PRODUCTS])
+
+    # Same fare model as uber_price_estimates, one row per pair and one column per product
+    low = base_fare + per_km * distance_km[:, None] + _rng.uniform(-1, 1, (len(distance_km),
+                                                                           len(UBER_PRODUCTS)))
+    high = low * _rng.uniform(1.1, 1.5, low.shape)
+    durations = (distance_km / 40 * 3600).astype(int).tolist()  # Average speed of 40 km/h
+
+    results = []
+    for distance, duration, lows, highs in zip(distance_km.tolist(), durations,
+                                                low.tolist(), high.tolist()):
+        results.append([
+            {
+                "localized_display_name": product["display_name"],
+                "distance": distance,
+                "display_name": product["display_name"],
+                "product_id": product["product_id"],
+                "high_estimate": round(high_estimate, 2),
+                "low_estimate": round(low_estimate, 2),
+                "duration": duration,
+                "estimate": f"${low_estimate:.2f} - ${high_estimate:.2f}",
+                "currency_code": "USD",
+            }
+            for product, low_estimate, high_estimate in zip(UBER_PRODUCTS, lows, highs)
+        ])
+    return results
+
+
+def lyft_cost_estimates_batch(ride_type, start_lats, start_lngs, end_lats, end_lngs):
+    """
+    Computes mock Lyft cost estimates for many origin/destination pairs in one NumPy pass.
+    Returns one list of cost estimate dicts per pair, in input order.
+    """
+    products = select_lyft_products(ride_type)
+
+    distance_km = haversine_distance_batch(start_lats, start_lngs, end_lats, end_lngs)
+    distance_miles = distance_km * 0.621371
+    base_fare = np.array([p["base_fare"] for p in products])
+    per_km = np.array([p["per_km"] for p in products])
+
+    # Same fare model as lyft_cost_estimates, one row per pair and one column per product
+    low = base_fare + per_km * distance_km[:, None] + _rng.uniform(-0.5, 0.5, (len(distance_km),
+                                                                               len(products)))
+    high = low * _rng.uniform(1.05, 1.2, low.shape)
+    cents_min = np.rint(low * 100).astype(int).tolist()
+    cents_max = np.rint(high * 100).astype(int).tolist()
+    durations = np.rint(distance_miles / 30 * 3600).astype(int).tolist()  # 30 mph average
+    miles = np.round(distance_miles, 1).tolist()
+
+    results = []
+    for row_min, row_max, duration, distance in zip(cents_min, cents_max, durations, miles):
+        estimates = []
+        for product, estimate_min, estimate_max in zip(products, row_min, row_max):
+            token = generate_token()
+            estimates.append({
+                "cost_token": token,
+                "display_name": product["display_name"],
+                "estimated_cost_cents_min": estimate_min,
+                "estimated_cost_cents_max": estimate_max,
+                "estimated_distance_miles": distance,
+                "estimated_duration_seconds": duration,
+                "is_valid_estimate": True,
+                "primetime_confirmation_token": token,
+                "primetime_percentage": "25%",
+                "ride_type": product["product_id"],
+            })
+        results.append(estimates)
+    return results
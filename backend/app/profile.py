@@ -8,6 +8,7 @@ from .database import get_db
 from .config import SECRET_KEY
 from .models import User, Address, UserAddress
 from .auth import verify_session  # Assuming verify_session is a function in auth.py
+from .address_index import index_saved_address, index_history, forget_user
 
 
 router = APIRouter()
@@ -69,6 +70,7 @@ def update_user_info(
 
     # Commit changes to the database
     db.commit()
+    forget_user(username)  # The home address is part of the autocomplete index
 
     return {
         "first_name": user.first_name,
@@ -210,6 +212,7 @@ def add_user_history(
     # Add the new address to the session and commit
     db.add(new_address)
     db.commit()
+    index_history(username, new_address)
 
     return {"message": "Address history entry added successfully"}
 
@@ -282,6 +285,7 @@ def add_saved_address(
 
     db.add(new_address)
     db.commit()
+    index_saved_address(username, new_address)
 
     return {"message": "Address saved successfully"}
 
@@ -314,5 +318,6 @@ def delete_saved_address(
 
     db.delete(address)
     db.commit()
+    forget_user(username)
 
     return {"message": "Address deleted successfully"}
@@ -0,0 +1,23 @@
+""" Short-lived fare quote cache shared by the Uber and Lyft pricing calls. """
+from .cache import TTLCache
+from .config import (QUOTE_CACHE_PICKUP_PRECISION, QUOTE_CACHE_DROPOFF_PRECISION,
+                     QUOTE_CACHE_TTL, QUOTE_CACHE_MAX_ENTRIES)
+from .geo import geohash
+
+# Provider estimates per (provider, products, pickup cell, drop-off cell)
+quote_cache = TTLCache("fare_quotes", QUOTE_CACHE_TTL, QUOTE_CACHE_MAX_ENTRIES)
+
+
+def quote_key(provider, products, start_lat, start_lon, end_lat, end_lon):
+    """
+    Cache key for a quote: the provider, the requested products (None for all of them),
+    and the geohash cells of the pickup and drop-off points.
+    """
+    if products is not None and not isinstance(products, str):
+        products = tuple(products)
+    return (
+        provider,
+        products,
+        geohash(start_lat, start_lon, QUOTE_CACHE_PICKUP_PRECISION),
+        geohash(end_lat, end_lon, QUOTE_CACHE_DROPOFF_PRECISION),
+    )
@@ -0,0 +1,281 @@
+""" Hedged requests and circuit breakers for the upstream APIs (geocoding, Uber, Lyft). """
+import asyncio
+import time
+from collections import deque
+import httpx
+from .config import (HEDGE_ENABLED, HEDGE_PERCENTILE, HEDGE_WINDOW, HEDGE_MIN_SAMPLES,
+                     HEDGE_MIN_DELAY_MS, HEDGE_MAX_SHARE, BREAKER_FAILURE_THRESHOLD,
+                     BREAKER_RESET_TIMEOUT)
+from .deadline import remaining
+from .metrics import collector, upstream_call_seconds, upstream_calls
+from .scheduler import scheduler, GEOCODING, UBER_ESTIMATES, LYFT_COST
+
+# Breaker states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# New latency samples between recomputations of the hedge delay
+_RECOMPUTE_EVERY = 10
+
+# Statuses Google reports in the JSON body of a 200 response when the call failed
+GOOGLE_FAILURE_STATUSES = {"OVER_QUERY_LIMIT", "REQUEST_DENIED", "UNKNOWN_ERROR"}
+
+
+class CircuitOpen(Exception):
+    """ The upstream's circuit breaker is open, so the call was not made. """
+
+    def __init__(self, upstream):
+        super().__init__(f"{upstream} is unavailable (circuit open)")
+        self.upstream = upstream
+
+
+class CircuitBreaker:
+    """
+    Closed, calls go through; after `threshold` consecutive failures it opens and calls fail
+    fast. Once `reset_timeout` seconds have passed one trial call is let through (half-open),
+    and its outcome closes the breaker again or reopens it.
+    """
+
+    def __init__(self, threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.threshold = max(1, threshold)
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._trial = False
+
+    def allow(self):
+        """ Whether a call may be made now; a half-open breaker allows one at a time. """
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self.rejected += 1
+                return False
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            if self._trial:
+                self.rejected += 1
+                return False
+            self._trial = True
+        return True
+
+    def succeeded(self):
+        """ Records a successful call, closing the breaker. """
+        self._trial = False
+        self.failures = 0
+        self.state = CLOSED
+
+    def failed(self):
+        """ Records a failed call, opening the breaker after too many in a row. """
+        self._trial = False
+        self.failures += 1
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.threshold):
+            self.state = OPEN
+            self.times_opened += 1
+            self.opened_at = time.monotonic()
+
+    def abandoned(self):
+        """ Records a call that ended without a verdict (cancelled or cut off by the budget). """
+        self._trial = False
+
+    def stats(self):
+        """ Current state and how often the breaker has opened and rejected calls. """
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
+
+
+class Upstream:
+    """
+    Call path for one upstream API: a circuit breaker in front, then the scheduler slot, and
+    a hedged duplicate request when the first one is slower than usual.
+    is_failure: Tells whether a response counts as a failed call (HTTP 5xx and 429 by default)
+    """
+
+    def __init__(self, name, is_failure=None):
+        self.name = name
+        self.is_failure = is_failure or is_http_failure
+        self.breaker = CircuitBreaker()
+        self.calls = 0
+        self.errors = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self._latencies = deque(maxlen=HEDGE_WINDOW)
+        self._new_samples = 0
+        self._hedge_delay = None
+        self._seconds = upstream_call_seconds.labels(name)
+
+    async def request(self, send):
+        """
+        Returns the response of `await send()` (an httpx request to this upstream).
+        Raises CircuitOpen without calling when the breaker is open. Transport errors and
+        responses `is_failure` rejects count as failures; timeouts caused by the request's own
+        latency budget and cancelled calls don't count either way.
+        """
+        if not self.breaker.allow():
+            upstream_calls.labels(self.name, "rejected").inc()
+            raise CircuitOpen(self.name)
+        self.calls += 1
+        started = time.perf_counter()
+        try:
+            response = await self._hedged(send)
+        except httpx.TimeoutException:
+            if _budget_spent():
+                self._abandoned(started)
+            else:
+                self._failed(started, "timeout")
+            raise
+        except httpx.TransportError:
+            self._failed(started, "error")
+            raise
+        except BaseException:
+            self._abandoned(started)
+            raise
+
+        if self.is_failure(response):
+            self._failed(started, "error")
+        else:
+            self.breaker.succeeded()
+            self._finished(started, "ok")
+        return response
+
+    def hedge_delay(self):
+        """ Seconds to wait before hedging a call, or None when it shouldn't be hedged. """
+        if not HEDGE_ENABLED or len(self._latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        if self.hedged >= self.calls * HEDGE_MAX_SHARE:
+            return None
+        if self._hedge_delay is None or self._new_samples >= _RECOMPUTE_EVERY:
+            ordered = sorted(self._latencies)
+            position = min(len(ordered) - 1, int(len(ordered) * HEDGE_PERCENTILE / 100))
+            self._hedge_delay = max(ordered[position], HEDGE_MIN_DELAY_MS / 1000)
+            self._new_samples = 0
+        return self._hedge_delay
+
+    async def _hedged(self, send):
+        delay = self.hedge_delay()
+        if delay is None:
+            return await self._attempt(send)
+
+        primary = asyncio.ensure_future(self._attempt(send))
+        attempts = [primary]
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=delay)
+            if done:
+                return primary.result()
+
+            self.hedged += 1
+            attempts.append(asyncio.ensure_future(self._attempt(send)))
+            pending = set(attempts)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for attempt in done:
+                    if attempt.exception() is None and not self.is_failure(attempt.result()):
+                        if attempt is not primary:
+                            self.hedge_wins += 1
+                        return attempt.result()
+            # Both failed: report the original request's outcome
+            return primary.result()
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+
+    async def _attempt(self, send):
+        async with scheduler.slot(self.name):
+            started = time.monotonic()
+            response = await send()
+        if not self.is_failure(response):
+            self._latencies.append(time.monotonic() - started)
+            self._new_samples += 1
+        return response
+
+    def _failed(self, started, outcome):
+        self.errors += 1
+        self.breaker.failed()
+        self._finished(started, outcome)
+
+    def _abandoned(self, started):
+        self.breaker.abandoned()
+        self._finished(started, "abandoned")
+
+    def _finished(self, started, outcome):
+        self._seconds.observe(time.perf_counter() - started)
+        upstream_calls.labels(self.name, outcome).inc()
+
+    def stats(self):
+        """ Breaker state, call and error counts, and how often hedging paid off. """
+        delay = self._hedge_delay
+        return {
+            "breaker": self.breaker.stats(),
+            "calls": self.calls,
+            "errors": self.errors,
+            "hedge_delay_ms": round(delay * 1000, 3) if delay is not None else None,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "hedge_win_rate": round(self.hedge_wins / self.hedged, 4) if self.hedged else 0.0,
+        }
+
+
+def is_http_failure(response):
+    """ Server errors and rate limiting. """
+    return response.status_code >= 500 or response.status_code == 429
+
+
+def is_google_failure(response):
+    """ HTTP failures, and 200 responses whose JSON status reports a quota or server error. """
+    if is_http_failure(response):
+        return True
+    if response.status_code != 200:
+        return False
+    try:
+        return response.json().get("status") in GOOGLE_FAILURE_STATUSES
+    except ValueError:
+        return False
+
+
+def _budget_spent():
+    left = remaining()
+    return left is not None and left <= 0.001
+
+
+upstreams = {
+    GEOCODING: Upstream(GEOCODING, is_failure=is_google_failure),
+    UBER_ESTIMATES: Upstream(UBER_ESTIMATES),
+    LYFT_COST: Upstream(LYFT_COST),
+}
+
+
+async def call_upstream(name, send):
+    """ Makes one call to upstream `name` through its breaker, slot and hedging. """
+    return await upstreams[name].request(send)
+
+
+def stats():
+    """ Breaker and hedging figures for every upstream. """
+    return {name: upstream.stats() for name, upstream in upstreams.items()}
+
+
+@collector
+def collect():
+    """ Breaker states and hedged-call counts for /metrics. """
+    states = (CLOSED, HALF_OPEN, OPEN)
+    return [
+        ("farefinder_upstream_breaker_state", "gauge",
+         "1 for the current circuit breaker state of each upstream",
+         [({"upstream": name, "state": state}, int(upstream.breaker.state == state))
+          for name, upstream in upstreams.items() for state in states]),
+        ("farefinder_upstream_breaker_opened", "counter", "Times each circuit breaker opened",
+         [({"upstream": name}, upstream.breaker.times_opened)
+          for name, upstream in upstreams.items()]),
+        ("farefinder_upstream_hedged_calls", "counter",
+         "Calls that sent a hedged duplicate request, and those the duplicate answered first",
+         [({"upstream": name, "winner": winner}, count)
+          for name, upstream in upstreams.items()
+          for winner, count in (("primary", upstream.hedged - upstream.hedge_wins),
+                                ("hedge", upstream.hedge_wins))]),
+    ]
@@ -0,0 +1,221 @@
+"""
+Offline road-network index for street validation without a geocoding call.
+
+Road segments are loaded from a CSV with one segment per line
+(lat1,lon1,lat2,lon2[,highway]), for example converted from an OSM extract,
+and bucketed into a uniform grid. A prebuilt index is saved as a directory of
+.npy arrays so it can be memory-mapped at startup.
+
+Build an index with:
+    python -m app.roads roads.csv road_index/
+"""
+import argparse
+import csv
+import json
+import math
+import os
+import numpy as np
+from .geo import METERS_PER_DEGREE
+
+# OSM highway classes that cars can drive on
+DRIVABLE_HIGHWAYS = {
+    "motorway", "trunk", "primary", "secondary", "tertiary", "unclassified",
+    "residential", "service", "living_street", "motorway_link", "trunk_link",
+    "primary_link", "secondary_link", "tertiary_link",
+}
+
+_ARRAYS = ("segments", "cell_ids", "cell_offsets", "cell_items")
+
+
+class RoadIndex:
+    """
+    Uniform-grid spatial index over road segments, projected to local meters
+    around the centre of the extract.
+    """
+
+    def __init__(self, meta, segments, cell_ids, cell_offsets, cell_items):
+        self.meta = meta
+        self.segments = segments          # (n, 4) x1, y1, x2, y2 in meters
+        self.cell_ids = cell_ids          # sorted ids of non-empty cells
+        self.cell_offsets = cell_offsets  # cell_items[cell_offsets[i]:cell_offsets[i + 1]]
+        self.cell_items = cell_items      # segment indices, grouped by cell
+        self._lat0 = meta["origin_lat"]
+        self._lon0 = meta["origin_lon"]
+        self._lon_scale = METERS_PER_DEGREE * math.cos(math.radians(self._lat0))
+        self._cell = meta["cell_size_m"]
+        self._nx = meta["nx"]
+        self._ny = meta["ny"]
+        self._min_x = meta["min_x"]
+        self._min_y = meta["min_y"]
+
+    @classmethod
+    def build(cls, segments_latlon, cell_size_m=50.0):
+        """
+        Builds an index from an (n, 4) array of lat1, lon1, lat2, lon2 rows.
+        """
+        latlon = np.asarray(segments_latlon, dtype=np.float64).reshape(-1, 4)
+        lat0 = float(latlon[:, [0, 2]].mean()) if len(latlon) else 0.0
+        lon0 = float(latlon[:, [1, 3]].mean()) if len(latlon) else 0.0
+        lon_scale = METERS_PER_DEGREE * math.cos(math.radians(lat0))
+
+        segments = np.empty_like(latlon)
+        segments[:, 0] = (latlon[:, 1] - lon0) * lon_scale
+        segments[:, 1] = (latlon[:, 0] - lat0) * METERS_PER_DEGREE
+        segments[:, 2] = (latlon[:, 3] - lon0) * lon_scale
+        segments[:, 3] = (latlon[:, 2] - lat0) * METERS_PER_DEGREE
+
+        xs = segments[:, [0, 2]]
+        ys = segments[:, [1, 3]]
+        min_x = float(xs.min()) if len(segments) else 0.0
+        min_y = float(ys.min()) if len(segments) else 0.0
+        nx = int((xs.max() - min_x) // cell_size_m) + 1 if len(segments) else 1
+        ny = int((ys.max() - min_y) // cell_size_m) + 1 if len(segments) else 1
+
+        # Every segment goes into each cell its bounding box touches
+        ix0 = ((xs.min(axis=1) - min_x) // cell_size_m).astype(np.int64)
+        ix1 = ((xs.max(axis=1) - min_x) // cell_size_m).astype(np.int64)
+        iy0 = ((ys.min(axis=1) - min_y) // cell_size_m).astype(np.int64)
+        iy1 = ((ys.max(axis=1) - min_y) // cell_size_m).astype(np.int64)
+        span_y = iy1 - iy0 + 1
+        counts = (ix1 - ix0 + 1) * span_y
+        seg_idx = np.repeat(np.arange(len(segments), dtype=np.int32), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cx = np.repeat(ix0, counts) + local // np.repeat(span_y, counts)
+        cy = np.repeat(iy0, counts) + local % np.repeat(span_y, counts)
+        ids = cx * ny + cy
+
+        order = np.argsort(ids, kind="stable")
+        ids = ids[order]
+        cell_items = seg_idx[order]
+        cell_ids, starts = np.unique(ids, return_index=True)
+        cell_offsets = np.append(starts, len(ids)).astype(np.int64)
+
+        meta = {
+            "origin_lat": lat0, "origin_lon": lon0, "cell_size_m": float(cell_size_m),
+            "nx": nx, "ny": ny, "min_x": min_x, "min_y": min_y,
+            "segment_count": int(len(segments)),
+        }
+        return cls(meta, segments, cell_ids, cell_offsets, cell_items)
+
+    @classmethod
+    def from_csv(cls, path, cell_size_m=50.0, drivable_only=True):
+        """
+        Loads segments from a lat1,lon1,lat2,lon2[,highway] CSV file and builds an index.
+        Rows whose highway class is not drivable are skipped when `drivable_only` is set.
+        """
+        rows = []
+        with open(path, newline="", encoding="utf-8") as handle:
+            for row in csv.reader(handle):
+                if not row or row[0].startswith("#"):
+                    continue
+                try:
+                    coords = [float(value) for value in row[:4]]
+                except ValueError:
+                    continue  # header line
+                if drivable_only and len(row) > 4 and row[4] not in DRIVABLE_HIGHWAYS:
+                    continue
+                rows.append(coords)
+        return cls.build(rows, cell_size_m)
+
+    def save(self, directory):
+        """ Writes the index as .npy arrays plus meta.json. """
+        os.makedirs(directory, exist_ok=True)
+        for name in _ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as handle:
+            json.dump(self.meta, handle)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """ Loads a prebuilt index, memory-mapping the arrays unless `mmap` is False. """
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as handle:
+            meta = json.load(handle)
+        arrays = [np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r" if mmap else None)
+                  for name in _ARRAYS]
+        return cls(meta, *arrays)
+
+    def _project(self, lat, lon):
+        return (lon - self._lon0) * self._lon_scale, (lat - self._lat0) * METERS_PER_DEGREE
+
+    def _nearby_segments(self, x, y, radius):
+        """ Indices of segments in the grid cells within `radius` meters of (x, y). """
+        ix0 = max(int((x - radius - self._min_x) // self._cell), 0)
+        ix1 = min(int((x + radius - self._min_x) // self._cell), self._nx - 1)
+        iy0 = max(int((y - radius - self._min_y) // self._cell), 0)
+        iy1 = min(int((y + radius - self._min_y) // self._cell), self._ny - 1)
+        if ix0 > ix1 or iy0 > iy1 or not len(self.cell_ids):
+            return np.empty(0, dtype=np.int32)
+
+        wanted = (np.arange(ix0, ix1 + 1)[:, None] * self._ny
+                  + np.arange(iy0, iy1 + 1)[None, :]).ravel()
+        pos = np.minimum(np.searchsorted(self.cell_ids, wanted), len(self.cell_ids) - 1)
+        pos = pos[self.cell_ids[pos] == wanted]
+        if not len(pos):
+            return np.empty(0, dtype=np.int32)
+        # A segment can show up once per cell it touches; duplicates don't change the minimum
+        offsets = self.cell_offsets
+        if len(pos) == 1:
+            return self.cell_items[offsets[pos[0]]:offsets[pos[0] + 1]]
+        return np.concatenate([self.cell_items[offsets[p]:offsets[p + 1]] for p in pos])
+
+    def nearest(self, lat, lon, max_distance_m):
+        """
+        Returns (lat, lon, distance_m) of the closest road point within `max_distance_m`,
+        or None when no road is that close.
+        """
+        x, y = self._project(lat, lon)
+        candidates = self._nearby_segments(x, y, max_distance_m)
+        if not len(candidates):
+            return None
+
+        seg = np.asarray(self.segments[candidates])
+        x1, y1, x2, y2 = seg[:, 0], seg[:, 1], seg[:, 2], seg[:, 3]
+        dx = x2 - x1
+        dy = y2 - y1
+        length_sq = dx * dx + dy * dy
+        t = np.where(length_sq > 0,
+                     ((x - x1) * dx + (y - y1) * dy) / np.where(length_sq > 0, length_sq, 1), 0)
+        t = np.clip(t, 0.0, 1.0)
+        px = x1 + t * dx
+        py = y1 + t * dy
+        dist = np.hypot(px - x, py - y)
+        best = int(np.argmin(dist))
+        if dist[best] > max_distance_m:
+            return None
+        return (float(py[best] / METERS_PER_DEGREE + self._lat0),
+                float(px[best] / self._lon_scale + self._lon0),
+                float(dist[best]))
+
+    def is_near_road(self, lat, lon, max_distance_m):
+        """ True if a drivable road lies within `max_distance_m` meters of the point. """
+        return self.nearest(lat, lon, max_distance_m) is not None
+
+
+_loaded_index = None
+
+
+def get_road_index(path):
+    """ Returns the process-wide road index, memory-mapping it from `path` on first use. """
+    global _loaded_index  # pylint: disable=global-statement
+    if _loaded_index is None:
+        _loaded_index = RoadIndex.load(path)
+    return _loaded_index
+
+
+def main():
+    """ Command line entry point for building an index from a CSV extract. """
+    parser = argparse.ArgumentParser(description="Build a road-segment index for street validation")
+    parser.add_argument("csv_path", help="lat1,lon1,lat2,lon2[,highway] segment file")
+    parser.add_argument("output_dir", help="directory to write the index to")
+    parser.add_argument("--cell-size", type=float, default=50.0, help="grid cell size in meters")
+    parser.add_argument("--all-highways", action="store_true",
+                        help="keep segments that are not drivable roads")
+    args = parser.parse_args()
+
+    index = RoadIndex.from_csv(args.csv_path, args.cell_size, drivable_only=not args.all_highways)
+    index.save(args.output_dir)
+    print(f"Indexed {index.meta['segment_count']} segments into {len(index.cell_ids)} cells")
+
+
+if __name__ == "__main__":
+    main()
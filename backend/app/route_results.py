@@ -0,0 +1,88 @@
+""" Stale-while-revalidate cache of whole fare-search results, keyed by quantized route. """
+import asyncio
+import time
+from .cache import TTLCache
+from .deadline import budget_scope
+from .config import (ROUTE_CACHE_MAX_AGE, ROUTE_CACHE_MAX_ENTRIES, ROUTE_REFRESH_AFTER,
+                     QUOTE_CACHE_PICKUP_PRECISION, QUOTE_CACHE_DROPOFF_PRECISION)
+from .geo import geohash
+
+# (stored_at, result) per route key; entries older than ROUTE_CACHE_MAX_AGE are never served
+route_cache = TTLCache("route_results", ROUTE_CACHE_MAX_AGE, ROUTE_CACHE_MAX_ENTRIES)
+
+# Route key -> task running the search that will replace its entry
+_refreshing = {}
+
+
+def route_key(kind, start_lat, start_lon, end_lat, end_lon, *options):
+    """
+    Key for a search result: the kind of search, the geohash cells of the start and end
+    points, and every other parameter that changes the result (search range, limit, ...).
+    """
+    return (
+        kind,
+        geohash(start_lat, start_lon, QUOTE_CACHE_PICKUP_PRECISION),
+        geohash(end_lat, end_lon, QUOTE_CACHE_DROPOFF_PRECISION),
+        *options,
+    )
+
+
+async def cached_search(key, search, max_stale, budget_ms=None):
+    """
+    Returns the result of `await search()` with an "age_seconds" field added.
+    A stored result for `key` at most `max_stale` seconds old is returned at once; once it
+    is older than ROUTE_REFRESH_AFTER a background search (one per key) replaces it for the
+    next caller. Otherwise the caller waits for a fresh search, sharing one already running.
+    With `budget_ms` the caller runs its own search under that latency budget instead, and
+    the result is only stored if the budget didn't cut it short.
+    """
+    found, entry = route_cache.get(key)
+    if found:
+        stored_at, result = entry
+        age = time.monotonic() - stored_at
+        if age <= max_stale:
+            route_cache.hits += 1
+            if age >= ROUTE_REFRESH_AFTER:
+                _refresh(key, search)
+            return {**result, "age_seconds": round(age, 3)}
+
+    if budget_ms is not None:
+        route_cache.misses += 1
+        with budget_scope(budget_ms):
+            result = await search()
+        if not result.get("partial"):
+            route_cache.set(key, (time.monotonic(), result))
+        return {**result, "age_seconds": 0.0}
+
+    if key in _refreshing:
+        route_cache.coalesced += 1
+    else:
+        route_cache.misses += 1
+    # Shielded so a caller that disconnects doesn't cancel the search others may be sharing
+    result = await asyncio.shield(_refresh(key, search))
+    return {**result, "age_seconds": 0.0}
+
+
+def _refresh(key, search):
+    """ Starts the search that refreshes `key`, or returns the one already running. """
+    task = _refreshing.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_store(key, search))
+        _refreshing[key] = task
+        task.add_done_callback(lambda t: _finished(key, t))
+    return task
+
+
+def _finished(key, task):
+    del _refreshing[key]
+    # A background refresh has no caller to report a failure to; retrieve it so asyncio
+    # doesn't log it, and keep serving the previous result
+    if not task.cancelled():
+        task.exception()
+
+
+async def _store(key, search):
+    """ Runs the search and stores its result with the current time. """
+    result = await search()
+    route_cache.set(key, (time.monotonic(), result))
+    return result
@@ -0,0 +1,160 @@
+""" Process-wide scheduler that bounds concurrent calls to each upstream API. """
+import asyncio
+import itertools
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from .config import GEOCODING_CONCURRENCY, UBER_ESTIMATE_CONCURRENCY, LYFT_COST_CONCURRENCY
+from .metrics import collector
+
+# Upstream names
+GEOCODING = "geocoding"
+UBER_ESTIMATES = "uber_estimates"
+LYFT_COST = "lyft_cost"
+
+# Identifies the request an upstream call belongs to, so waiting calls can be
+# served round-robin between requests instead of first come, first served.
+_request_ids = itertools.count(1)
+current_request = ContextVar("current_request", default=0)
+
+
+@contextmanager
+def request_scope():
+    """
+    Tags every upstream call made inside the block as belonging to one new request.
+    """
+    token = current_request.set(next(_request_ids))
+    try:
+        yield
+    finally:
+        current_request.reset(token)
+
+
+class _Lane:
+    """ Concurrency limit and fair wait queue for a single upstream. """
+
+    def __init__(self, limit):
+        self.limit = max(1, limit)
+        self.in_flight = 0
+        self.waiting = 0
+        self.acquired = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        # request id -> deque of waiting futures, rotated after each grant
+        self._queues = OrderedDict()
+
+    async def acquire(self, request_id):
+        """ Waits for a free slot, taking turns with the other queued requests. """
+        started = time.monotonic()
+        if self.in_flight < self.limit and not self.waiting:
+            self.in_flight += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._queues.setdefault(request_id, deque()).append(future)
+            self.waiting += 1
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # The slot was granted just before the cancellation landed
+                    self.release()
+                else:
+                    self._discard(request_id, future)
+                raise
+
+        waited = time.monotonic() - started
+        self.acquired += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    def release(self):
+        """ Frees a slot and hands it to the next request in line. """
+        self.in_flight -= 1
+        while self.in_flight < self.limit and self._queues:
+            request_id, queue = next(iter(self._queues.items()))
+            future = queue.popleft()
+            if queue:
+                self._queues.move_to_end(request_id)
+            else:
+                del self._queues[request_id]
+            self.waiting -= 1
+            self.in_flight += 1
+            future.set_result(None)
+
+    def _discard(self, request_id, future):
+        queue = self._queues.get(request_id)
+        if queue is None or future not in queue:
+            return
+        queue.remove(future)
+        self.waiting -= 1
+        if not queue:
+            del self._queues[request_id]
+
+    def stats(self):
+        """ Current queue depth and wait time figures for this upstream. """
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "queued_requests": len(self._queues),
+            "acquired": self.acquired,
+            "avg_wait_ms": round(self.total_wait / self.acquired * 1000, 3) if self.acquired else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+        }
+
+
+class UpstreamScheduler:
+    """
+    Caps the number of concurrent calls per upstream across the whole process.
+    Calls that have to wait are queued per request and served round-robin.
+    """
+
+    def __init__(self, limits):
+        self._lanes = {name: _Lane(limit) for name, limit in limits.items()}
+
+    @asynccontextmanager
+    async def slot(self, upstream):
+        """
+        Holds one of `upstream`'s slots for the duration of the block.
+        """
+        lane = self._lanes[upstream]
+        await lane.acquire(current_request.get())
+        try:
+            yield
+        finally:
+            lane.release()
+
+    def lanes(self):
+        """ (name, lane) for every upstream. """
+        return self._lanes.items()
+
+    def stats(self):
+        """ Returns queue depth and wait time figures for every upstream. """
+        return {name: lane.stats() for name, lane in self._lanes.items()}
+
+
+scheduler = UpstreamScheduler({
+    GEOCODING: GEOCODING_CONCURRENCY,
+    UBER_ESTIMATES: UBER_ESTIMATE_CONCURRENCY,
+    LYFT_COST: LYFT_COST_CONCURRENCY,
+})
+
+
+@collector
+def collect():
+    """ Slot usage and queueing of every upstream lane for /metrics. """
+    lanes = scheduler.lanes()
+    return [
+        ("farefinder_upstream_slots_limit", "gauge", "Concurrent calls allowed per upstream",
+         [({"upstream": name}, lane.limit) for name, lane in lanes]),
+        ("farefinder_upstream_slots_in_use", "gauge", "Upstream calls holding a slot",
+         [({"upstream": name}, lane.in_flight) for name, lane in lanes]),
+        ("farefinder_upstream_queue_depth", "gauge", "Upstream calls waiting for a slot",
+         [({"upstream": name}, lane.waiting) for name, lane in lanes]),
+        ("farefinder_upstream_slot_wait_seconds", "counter",
+         "Seconds spent waiting for upstream slots",
+         [({"upstream": name}, lane.total_wait) for name, lane in lanes]),
+        ("farefinder_upstream_slots_acquired", "counter", "Upstream slots handed out",
+         [({"upstream": name}, lane.acquired) for name, lane in lanes]),
+    ]
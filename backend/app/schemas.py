@@ -1,4 +1,5 @@
 """This module contains the Pydantic models for the FastAPI application."""
+from typing import List, Optional
 from pydantic import BaseModel, EmailStr
 
 # pylint: disable=too-few-public-methods
@@ -16,3 +17,81 @@ class UserCreate(UserLogin):
     class Config:
         """Config class"""
         orm_mode = True
+
+# Uber Prices
+class PriceEstimate(BaseModel):
+    """ PriceEstimate model """
+    localized_display_name: str
+    distance: float
+    display_name: str
+    product_id: str
+    high_estimate: float
+    low_estimate: float
+    duration: int
+    estimate: str
+    currency_code: str
+
+class PriceEstimatesResponse(BaseModel):
+    """ PriceEstimatesResponse model """
+    prices: List[PriceEstimate]
+
+class PriceEstimateRequest(BaseModel):
+    """ One origin/destination pair of a batch price estimate request """
+    start_latitude: float
+    start_longitude: float
+    end_latitude: float
+    end_longitude: float
+
+class PriceEstimatesBatchRequest(BaseModel):
+    """ PriceEstimatesBatchRequest model """
+    requests: List[PriceEstimateRequest]
+    seat_count: int = 1
+
+class PriceEstimatesBatchResponse(BaseModel):
+    """ PriceEstimatesBatchResponse model, results in request order """
+    results: List[PriceEstimatesResponse]
+
+
+# Lyft Cost Estimates Endpoint
+class LyftCostEstimate(BaseModel):
+    """ LyftCostEstimate model """
+    cost_token: str
+    display_name: str
+    estimated_cost_cents_min: int
+    estimated_cost_cents_max: int
+    estimated_distance_miles: float
+    estimated_duration_seconds: int
+    is_valid_estimate: bool
+    primetime_confirmation_token: str
+    primetime_percentage: str
+    ride_type: str
+
+class LyftCostEstimatesResponse(BaseModel):
+    """ LyftCostEstimatesResponse model """
+    cost_estimates: List[LyftCostEstimate]
+
+class LyftCostRequest(BaseModel):
+    """ One origin/destination pair of a batch Lyft cost request """
+    start_lat: float
+    start_lng: float
+    end_lat: float
+    end_lng: float
+
+class LyftCostBatchRequest(BaseModel):
+    """ LyftCostBatchRequest model; ride_type None means every product """
+    requests: List[LyftCostRequest]
+    ride_type: Optional[List[str]] = None
+
+class LyftCostEstimatesBatchResponse(BaseModel):
+    """ LyftCostEstimatesBatchResponse model, results in request order """
+    results: List[LyftCostEstimatesResponse]
+
+class GeocodeBatchItem(BaseModel):
+    """ One item of a batch geocode request: an address, or a lat/lng pair to reverse geocode """
+    address: Optional[str] = None
+    lat: Optional[float] = None
+    lng: Optional[float] = None
+
+class GeocodeBatchRequest(BaseModel):
+    """ GeocodeBatchRequest model """
+    items: List[GeocodeBatchItem]
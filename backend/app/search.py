@@ -0,0 +1,41 @@
+""" Asyncio fan-out helpers shared by the Uber and Lyft fare searches. """
+import asyncio
+from .config import FARE_SEARCH_CONCURRENCY
+from .scheduler import request_scope
+
+
+async def fan_out(locations, worker, concurrency=FARE_SEARCH_CONCURRENCY):
+    """
+    Runs `worker(location)` for every location with at most `concurrency` calls in flight.
+    Results are returned in the same order as `locations`. All upstream calls made by
+    the workers are queued as one request in the shared upstream scheduler.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(location):
+        async with semaphore:
+            return await worker(location)
+
+    with request_scope():
+        return await asyncio.gather(*(run(loc) for loc in locations))
+
+
+async def fan_out_as_completed(locations, worker, concurrency=FARE_SEARCH_CONCURRENCY):
+    """
+    Like fan_out, but yields (location, result) pairs as soon as each worker finishes.
+    Workers still running when the consumer stops are cancelled.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(location):
+        async with semaphore:
+            return location, await worker(location)
+
+    with request_scope():
+        tasks = [asyncio.ensure_future(run(loc)) for loc in locations]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
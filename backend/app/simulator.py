@@ -0,0 +1,288 @@
+"""
+Standalone simulator of the upstream APIs (Google Geocoding/Places, Uber estimates, Lyft cost)
+with configurable latency, errors, timeouts and rate limits, for load tests on one machine.
+
+Run it next to the app and point the app at it:
+    uvicorn app.simulator:app --port 8001
+    GOOGLE_MAPS_API_URL=http://localhost:8001/maps/api \\
+    UBER_ESTIMATE_API_URL=http://localhost:8001/estimates \\
+    LYFT_COST_API_URL=http://localhost:8001/lyft PRICING_PROVIDER=http uvicorn app.main:app
+
+Each simulated API has a profile of comma-separated settings, e.g.
+    latency=pareto:40:1.8,errors=0.02,timeouts=0.005,rate=200
+  latency   fixed:MS | lognormal:MEDIAN_MS:SIGMA | pareto:MIN_MS:ALPHA (heavy tail)
+  errors    share of calls answered with a 500 (Google: status UNKNOWN_ERROR)
+  timeouts  share of calls that hang for SIM_TIMEOUT_SECONDS and then answer 504
+  rate      calls per second allowed (burst of one second); the rest get 429
+            (Google: status OVER_QUERY_LIMIT). 0 means unlimited
+Profiles come from SIM_GOOGLE_PROFILE, SIM_UBER_PROFILE and SIM_LYFT_PROFILE and can be
+changed while running with PUT /_sim/profiles/{google,uber,lyft}?spec=...
+"""
+import asyncio
+import hashlib
+import math
+import random
+import time
+from typing import List, Optional
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import JSONResponse
+from .config import (SIM_GOOGLE_PROFILE, SIM_UBER_PROFILE, SIM_LYFT_PROFILE, SIM_TIMEOUT_SECONDS,
+                     SIM_STREET_RATIO, SIM_SEED)
+from .schemas import PriceEstimatesBatchRequest, LyftCostBatchRequest
+from .pricing import (uber_price_estimates, uber_price_estimates_batch, lyft_cost_estimates,
+                      lyft_cost_estimates_batch)
+
+# Simulated addresses are spread over this (south, west, north, east) box
+ADDRESS_BOX = (37.70, -122.51, 37.81, -122.38)
+
+_rng = random.Random(SIM_SEED or None)
+
+
+class Profile:
+    """ Latency distribution, failure rates and rate limit of one simulated API. """
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.latency = ("fixed", (0.0,))
+        self.errors = 0.0
+        self.timeouts = 0.0
+        self.rate = 0.0
+        for setting in filter(None, (part.strip() for part in spec.split(","))):
+            name, _, value = setting.partition("=")
+            if name == "latency":
+                kind, *params = value.split(":")
+                if kind not in ("fixed", "lognormal", "pareto") or \
+                        len(params) != (1 if kind == "fixed" else 2):
+                    raise ValueError(f"Bad latency distribution: {value}")
+                self.latency = (kind, tuple(map(float, params)))
+            elif name in ("errors", "timeouts", "rate"):
+                setattr(self, name, float(value))
+            else:
+                raise ValueError(f"Unknown profile setting: {name}")
+        self._tokens = self.rate
+        self._refilled = time.monotonic()
+
+    def delay(self):
+        """ Seconds to wait before answering, drawn from the latency distribution. """
+        # The constructor checked the parameter count: one for fixed, two otherwise
+        kind, params = self.latency
+        if kind == "fixed":
+            ms = params[0]
+        elif kind == "lognormal":
+            median, sigma = params[0], params[1]
+            ms = _rng.lognormvariate(math.log(max(median, 1e-3)), sigma)
+        else:
+            minimum, alpha = params[0], params[1]
+            ms = minimum * _rng.paretovariate(alpha)
+        return ms / 1000
+
+    def admit(self):
+        """ Takes a token from the rate limiter; False when the caller should be throttled. """
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        self._tokens = min(self.rate, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+class SimulatedApi:
+    """ One simulated API: its profile and what it has answered so far. """
+
+    def __init__(self, spec, in_band_errors):
+        self.profile = Profile(spec)
+        # Google reports quota and server errors in the JSON status of a 200 response
+        self.in_band_errors = in_band_errors
+        self.counts = {"requests": 0, "ok": 0, "errors": 0, "timeouts": 0, "rate_limited": 0}
+        self.total_delay = 0.0
+
+    async def respond(self, build):
+        """ Answers with `build()` after the simulated delay, unless a failure is drawn. """
+        self.counts["requests"] += 1
+        profile = self.profile
+        if not profile.admit():
+            self.counts["rate_limited"] += 1
+            if self.in_band_errors:
+                return {"status": "OVER_QUERY_LIMIT", "results": [],
+                        "error_message": "You have exceeded your rate-limit for this API."}
+            return JSONResponse({"error": "rate_limited"}, status_code=429,
+                                headers={"Retry-After": "1"})
+
+        draw = _rng.random()
+        if draw < profile.timeouts:
+            self.counts["timeouts"] += 1
+            await asyncio.sleep(SIM_TIMEOUT_SECONDS)
+            return JSONResponse({"error": "upstream_timeout"}, status_code=504)
+
+        delay = profile.delay()
+        self.total_delay += delay
+        await asyncio.sleep(delay)
+        if draw < profile.timeouts + profile.errors:
+            self.counts["errors"] += 1
+            if self.in_band_errors:
+                return {"status": "UNKNOWN_ERROR", "results": []}
+            return JSONResponse({"error": "internal_error"}, status_code=500)
+
+        self.counts["ok"] += 1
+        return build()
+
+    def stats(self):
+        """ Current profile, answers by kind and the mean simulated delay. """
+        answered = self.counts["requests"] - self.counts["rate_limited"] - self.counts["timeouts"]
+        return {
+            "profile": self.profile.spec,
+            **self.counts,
+            "avg_delay_ms": round(self.total_delay / answered * 1000, 3) if answered else 0.0,
+        }
+
+
+apis = {
+    "google": SimulatedApi(SIM_GOOGLE_PROFILE, in_band_errors=True),
+    "uber": SimulatedApi(SIM_UBER_PROFILE, in_band_errors=False),
+    "lyft": SimulatedApi(SIM_LYFT_PROFILE, in_band_errors=False),
+}
+
+app = FastAPI(title="Upstream simulator")
+
+
+def _unit(*parts):
+    """ Deterministic number in [0, 1) for the given values, so repeated lookups agree. """
+    digest = hashlib.blake2b("|".join(map(str, parts)).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2 ** 64
+
+
+def _place_id(*parts):
+    return "sim_" + hashlib.blake2b("|".join(map(str, parts)).encode("utf-8"),
+                                    digest_size=10).hexdigest()
+
+
+def _reverse_geocode(lat, lng):
+    # Points ~10 m apart share an answer; most land on a street a few meters away
+    cell = (round(lat, 4), round(lng, 4))
+    if _unit("street", *cell) >= SIM_STREET_RATIO:
+        return {"status": "OK", "results": [{
+            "types": ["establishment", "point_of_interest"],
+            "formatted_address": f"Simulated Plaza {cell[0]},{cell[1]}",
+            "geometry": {"location": {"lat": lat, "lng": lng}},
+            "place_id": _place_id("poi", *cell),
+        }]}
+    street_lat = lat + (_unit("dlat", *cell) - 0.5) * 1e-4
+    street_lng = lng + (_unit("dlng", *cell) - 0.5) * 1e-4
+    return {"status": "OK", "results": [{
+        "types": ["route"],
+        "formatted_address": f"{int(_unit('street no', *cell) * 900) + 100} Simulated St",
+        "geometry": {"location": {"lat": round(street_lat, 7), "lng": round(street_lng, 7)}},
+        "place_id": _place_id("route", *cell),
+    }]}
+
+
+def _geocode(address):
+    south, west, north, east = ADDRESS_BOX
+    text = " ".join(address.lower().split())
+    return {"status": "OK", "results": [{
+        "types": ["street_address"],
+        "formatted_address": address,
+        "geometry": {"location": {
+            "lat": round(south + _unit("lat", text) * (north - south), 7),
+            "lng": round(west + _unit("lng", text) * (east - west), 7),
+        }},
+        "place_id": _place_id("address", text),
+    }]}
+
+
+@app.get("/maps/api/geocode/json")
+async def geocode(address: Optional[str] = None, latlng: Optional[str] = None):
+    """ Google Geocoding API: forward (address) or reverse (latlng="lat,lng") lookups. """
+    if latlng:
+        try:
+            lat, lng = (float(value) for value in latlng.split(","))
+        except ValueError:
+            return {"status": "INVALID_REQUEST", "results": []}
+        return await apis["google"].respond(lambda: _reverse_geocode(lat, lng))
+    if address:
+        return await apis["google"].respond(lambda: _geocode(address))
+    return {"status": "INVALID_REQUEST", "results": []}
+
+
+@app.get("/maps/api/place/autocomplete/json")
+async def autocomplete(input: str):  # pylint: disable=redefined-builtin
+    """ Google Places Autocomplete API: five suggestions completing the input. """
+    def build():
+        suffixes = ["St", "Ave", "Blvd", "Way", "Ct"]
+        predictions = [
+            {
+                "description": f"{input} {suffix}, San Francisco, CA, USA",
+                "place_id": _place_id("autocomplete", input, suffix),
+            }
+            for suffix in suffixes
+        ]
+        return {"status": "OK", "predictions": predictions}
+
+    return await apis["google"].respond(build)
+
+
+@app.get("/estimates/price")
+async def uber_estimates(start_latitude: float, start_longitude: float, end_latitude: float,
+                         end_longitude: float, seat_count: int = 1):
+    """ Uber price estimates for one trip. """
+    return await apis["uber"].respond(lambda: uber_price_estimates(
+        start_latitude, start_longitude, end_latitude, end_longitude, seat_count
+    ).model_dump())
+
+
+@app.post("/estimates/price/batch")
+async def uber_estimates_batch(body: PriceEstimatesBatchRequest):
+    """ Uber price estimates for many trips, in request order. """
+    def build():
+        batch = uber_price_estimates_batch(
+            [r.start_latitude for r in body.requests], [r.start_longitude for r in body.requests],
+            [r.end_latitude for r in body.requests], [r.end_longitude for r in body.requests],
+            body.seat_count,
+        )
+        return {"results": [{"prices": prices} for prices in batch]}
+
+    return await apis["uber"].respond(build)
+
+
+@app.get("/lyft/cost")
+async def lyft_cost(start_lat: float, start_lng: float, end_lat: float, end_lng: float,
+                    ride_type: Optional[List[str]] = Query(None)):
+    """ Lyft cost estimates for one trip. """
+    return await apis["lyft"].respond(lambda: lyft_cost_estimates(
+        ride_type, start_lat, start_lng, end_lat, end_lng
+    ).model_dump())
+
+
+@app.post("/lyft/cost/batch")
+async def lyft_cost_batch(body: LyftCostBatchRequest):
+    """ Lyft cost estimates for many trips, in request order. """
+    def build():
+        batch = lyft_cost_estimates_batch(
+            body.ride_type,
+            [r.start_lat for r in body.requests], [r.start_lng for r in body.requests],
+            [r.end_lat for r in body.requests], [r.end_lng for r in body.requests],
+        )
+        return {"results": [{"cost_estimates": estimates} for estimates in batch]}
+
+    return await apis["lyft"].respond(build)
+
+
+@app.get("/_sim/stats")
+async def get_stats():
+    """ Profile and answer counts for each simulated API. """
+    return {name: api.stats() for name, api in apis.items()}
+
+
+@app.put("/_sim/profiles/{name}")
+async def set_profile(name: str, spec: str):
+    """ Replaces a simulated API's profile while running. """
+    if name not in apis:
+        raise HTTPException(status_code=404, detail=f"No simulated API named {name}")
+    try:
+        apis[name].profile = Profile(spec)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    return apis[name].stats()
@@ -0,0 +1,71 @@
+""" Streaming variants of the best-fare searches, sent as NDJSON or server-sent events. """
+import json
+from fastapi.responses import StreamingResponse
+from .candidates import generate_candidates, prepare_candidates
+from .config import FARE_SEARCH_CONCURRENCY
+from .deadline import SKIPPED, budget_scope, until_deadline
+from .search import fan_out_as_completed
+from .upstream import get_client
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+
+async def search_events(start_lat, start_lon, search_range, pattern, quote, limit,
+                        concurrency=FARE_SEARCH_CONCURRENCY, budget_ms=None):
+    """
+    Runs a fare search and yields messages as it goes:
+      {"type": "candidates", ...}  once the pickup spots have been street-checked
+      {"type": "quote", "location": ..., "options": [...]}  for each spot as its quote arrives
+      {"type": "top", "options": [...]}  whenever the running top `limit` changes
+      {"type": "result", "options": [...], "candidates": {...}}  the authoritative final ranking
+    quote: async function (client, location) returning the options for one pickup spot
+    budget_ms: Latency budget; spots not quoted in time are counted in the result's "skipped"
+    """
+    with budget_scope(budget_ms):
+        client = get_client()
+        locations = generate_candidates(start_lat, start_lon, search_range, pattern)
+        locations, candidate_stats = await prepare_candidates(client, locations)
+        yield {"type": "candidates", **candidate_stats}
+
+        all_results = []
+        top = []
+        skipped = candidate_stats["skipped"]
+        async for location, options in fan_out_as_completed(
+            locations, lambda loc: until_deadline(quote(client, loc)), concurrency
+        ):
+            if options is SKIPPED:
+                skipped += 1
+                continue
+            all_results.extend(options)
+            yield {"type": "quote", "location": location[2], "options": options}
+            running = sorted(all_results, key=lambda x: x["price"])[:limit]
+            if running != top:
+                top = running
+                yield {"type": "top", "options": top}
+
+    all_results.sort(key=lambda x: x["price"])
+    yield {"type": "result", "options": all_results[:limit], "candidates": candidate_stats,
+           "partial": skipped > 0, "skipped": skipped}
+
+
+def encode_event(message, fmt):
+    """ Serializes one message as an NDJSON line or a server-sent event. """
+    data = json.dumps(message)
+    if fmt == "sse":
+        return f"event: {message['type']}\ndata: {data}\n\n"
+    return data + "\n"
+
+
+def stream_response(events, fmt="ndjson"):
+    """
+    Wraps a message generator in a StreamingResponse. Errors after the stream has started
+    are sent as a final {"type": "error"} message, since the status code is already out.
+    """
+    async def body():
+        try:
+            async for message in events:
+                yield encode_event(message, fmt)
+        except Exception as e:  # pylint: disable=broad-except
+            yield encode_event({"type": "error", "detail": str(e)}, fmt)
+
+    return StreamingResponse(body(), media_type=MEDIA_TYPES[fmt])
@@ -0,0 +1,89 @@
+""" Street validity checks for candidate pickup spots, shared by the Uber and Lyft searches. """
+import httpx
+from .cache import TTLCache
+from .config import (GMAP_API_KEY, GOOGLE_MAPS_API_URL, STREET_CACHE_PRECISION,
+                     STREET_CACHE_TTL, STREET_CACHE_MAX_ENTRIES, STREET_VALIDATION_BACKEND,
+                     ROAD_INDEX_PATH, ROAD_MAX_DISTANCE_M, SNAP_MAX_DISTANCE_M)
+from .geo import geohash, distance_m
+from .geocache import CACHEABLE_STATUSES
+from .roads import get_road_index
+from .scheduler import GEOCODING
+from .deadline import call_timeout
+from .resilience import CircuitOpen, call_upstream
+
+GEOCODE_URL = f"{GOOGLE_MAPS_API_URL}/geocode/json"
+
+# Street point (or None) per geohash cell, so nearby points and repeated searches share one lookup
+street_cache = TTLCache("street_validity", STREET_CACHE_TTL, STREET_CACHE_MAX_ENTRIES)
+
+
+class GeocodingError(Exception):
+    """ Google answered with an HTTP error or an error status such as OVER_QUERY_LIMIT. """
+
+
+async def is_valid_street(client, lat, lon):
+    """
+    Checks if the given latitude/longitude corresponds to a valid street address.
+    With the "roads" backend this is a local index lookup; otherwise Google results
+    are cached per geohash cell of STREET_CACHE_PRECISION characters.
+    """
+    if STREET_VALIDATION_BACKEND == "roads":
+        return get_road_index(ROAD_INDEX_PATH).is_near_road(lat, lon, ROAD_MAX_DISTANCE_M)
+    return await snap_to_street(client, lat, lon) is not None
+
+
+async def snap_to_street(client, lat, lon, max_distance_m=SNAP_MAX_DISTANCE_M):
+    """
+    Returns the (lat, lon) of the nearest street point, or None if the point isn't on a street.
+    The "roads" backend snaps to the closest road within `max_distance_m`. The Google
+    backend uses the location of the cached "route" result when it is that close, and
+    otherwise keeps the point as is. While geocoding is unavailable (its circuit breaker is
+    open, the connection fails or Google reports an error) the point is assumed to be on a
+    street, and nothing is cached for it. Timeouts propagate, so a latency budget
+    (until_deadline) counts the point as skipped rather than as checked.
+    """
+    if STREET_VALIDATION_BACKEND == "roads":
+        nearest = get_road_index(ROAD_INDEX_PATH).nearest(lat, lon, max_distance_m)
+        return nearest[:2] if nearest else None
+
+    if not GMAP_API_KEY:
+        return (lat, lon)
+
+    key = geohash(lat, lon, STREET_CACHE_PRECISION)
+    try:
+        street = await street_cache.get_or_load(
+            key, lambda: reverse_geocode_street(client, lat, lon)
+        )
+    except (CircuitOpen, httpx.NetworkError, GeocodingError):
+        return (lat, lon)
+    if street is None:
+        return None
+    if distance_m(lat, lon, *street) > max_distance_m:
+        return (lat, lon)
+    return street
+
+
+async def reverse_geocode_street(client, lat, lon):
+    """
+    Uses Google Maps Reverse Geocoding API to find the street the point lies on.
+    Returns the (lat, lon) of the "route" result, or None if there is no street.
+    Raises GeocodingError unless Google answers OK or ZERO_RESULTS, so errors aren't cached
+    as "no street".
+    """
+    params = {"latlng": f"{lat},{lon}", "key": GMAP_API_KEY}
+    response = await call_upstream(
+        GEOCODING, lambda: client.get(GEOCODE_URL, params=params, timeout=call_timeout())
+    )
+    if response.status_code != 200:
+        raise GeocodingError(f"Reverse geocoding failed with HTTP {response.status_code}")
+    data = response.json()
+    if data.get("status") not in CACHEABLE_STATUSES:
+        raise GeocodingError(f"Reverse geocoding failed with status {data.get('status')}")
+
+    for result in data.get("results", []):
+        if "route" in result.get("types", []):  # "route" type indicates a valid street
+            location = result.get("geometry", {}).get("location")
+            if not location:
+                return (lat, lon)
+            return (location["lat"], location["lng"])
+    return None
@@ -1,47 +1,97 @@
 """ Uber API functions for finding the best fare for a given location. """
 import math
 import random
-import requests
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from fastapi import APIRouter, HTTPException
-from .config import UBER_CLIENT_ID, UBER_CLIENT_SECRET, GMAP_API_KEY
+from typing import Literal, Optional
+from fastapi import APIRouter, HTTPException, Query
+from .config import (UBER_CLIENT_ID, UBER_CLIENT_SECRET, FARE_SEARCH_CONCURRENCY, PRICING_PROVIDER,
+                     CANDIDATE_PATTERN, SEARCH_MODE, ADAPTIVE_QUOTE_BUDGET, ROUTE_MAX_STALE,
+                     UBER_ESTIMATE_API_URL)
+from .pricing import uber_price_estimates, uber_price_estimates_batch
+from .upstream import get_client
+from .deadline import SKIPPED, call_timeout, until_deadline
+from .scheduler import UBER_ESTIMATES
+from .resilience import CircuitOpen, call_upstream
+from .quotes import quote_cache, quote_key
+from .route_results import cached_search, route_key
+from .candidates import prepare_candidates, generate_candidates
+from .adaptive import adaptive_search
+from .streaming import search_events, stream_response
 
 router = APIRouter()
 
 # Uber API URLs
 UBER_TOKEN_URL = "https://auth.uber.com/oauth/v2/token"
 UBER_ESTIMATE_URL = "https://api.uber.com/v1.2/estimates/price"
-MOCK_ESTIMATE_URL = "http://localhost:8000/estimates/price"
-
-USE_GOOGLE_MAPS = True  # Use Google Maps API for reverse geocoding
-
-if GMAP_API_KEY is None:
-    USE_GOOGLE_MAPS = False
+MOCK_ESTIMATE_URL = f"{UBER_ESTIMATE_API_URL}/price"
+MOCK_ESTIMATE_BATCH_URL = f"{UBER_ESTIMATE_API_URL}/price/batch"
 
 # Earth's radius in meters
 EARTH_RADIUS = 6378137
 
 @router.get("/best-uber-fare/")
-def get_best_uber_fare(
+async def get_best_uber_fare(
     start_lat: float,
     start_lon: float,
     end_lat: float,
     end_lon: float,
     limit: int = 3,
-    search_range: int = 500,
+    search_range: int = Query(500, gt=0),
+    pattern: Literal["rings", "hex", "random"] = CANDIDATE_PATTERN,
+    mode: Literal["exhaustive", "adaptive"] = SEARCH_MODE,
+    quote_budget: int = Query(ADAPTIVE_QUOTE_BUDGET, ge=1),
+    max_stale: float = Query(ROUTE_MAX_STALE, ge=0),
+    budget_ms: Optional[int] = Query(None, ge=1),
 ):
     """
     Returns the top `limit` cheapest Uber fares from original+nearby pickup spots.
     search_range: Maximum distance in feet to search for alternative pickup locations (default: 500 feet)
+    pattern: How nearby pickup spots are laid out: "rings", "hex" or "random"
+    mode: "exhaustive" quotes every spot; "adaptive" refines only where prices drop
+    quote_budget: Maximum number of quotes in adaptive mode
+    max_stale: Seconds old a previous result for the same route may be; it is returned at
+               once (see "age_seconds") and refreshed in the background
+    budget_ms: Latency budget in milliseconds; spots not checked or quoted in time are
+               left out and counted in "skipped", with "partial" set
     """
     try:
-        options = find_top_fares(start_lat, start_lon, end_lat, end_lon, limit, search_range)
-        return {"options": options}
+        key = route_key("uber", start_lat, start_lon, end_lat, end_lon,
+                        limit, search_range, pattern, mode, quote_budget)
+        return await cached_search(
+            key,
+            lambda: find_top_fares(start_lat, start_lon, end_lat, end_lon, limit, search_range,
+                                   pattern=pattern, mode=mode, quote_budget=quote_budget),
+            max_stale,
+            budget_ms,
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) from e
 
+@router.get("/best-uber-fare/stream")
+async def stream_best_uber_fare(
+    start_lat: float,
+    start_lon: float,
+    end_lat: float,
+    end_lon: float,
+    limit: int = 3,
+    search_range: int = Query(500, gt=0),
+    pattern: Literal["rings", "hex", "random"] = CANDIDATE_PATTERN,
+    format: Literal["ndjson", "sse"] = "ndjson",  # pylint: disable=redefined-builtin
+    budget_ms: Optional[int] = Query(None, ge=1),
+):
+    """
+    Streams each pickup spot's Uber quotes as they arrive, plus running top `limit` updates.
+    The last message ({"type": "result"}) is the authoritative ranked list.
+    format: "ndjson" (one JSON message per line) or "sse" (server-sent events)
+    """
+    events = search_events(
+        start_lat, start_lon, search_range, pattern,
+        lambda client, loc: quote_location(client, loc, end_lat, end_lon), limit,
+        budget_ms=budget_ms,
+    )
+    return stream_response(events, format)
+
 # Currently Unused
-def get_uber_access_token():
+async def get_uber_access_token():
     """
     Fetches an OAuth access token for Uber API using Client Credentials.
     Uber API does NOT support scope for Client Credentials Grant.
@@ -54,7 +104,7 @@ def get_uber_access_token():
 
     headers = {"Content-Type": "application/x-www-form-urlencoded"}
 
-    response = requests.post(UBER_TOKEN_URL, data=data, headers=headers, timeout=10)
+    response = await get_client().post(UBER_TOKEN_URL, data=data, headers=headers)
 
     if response.status_code == 200:
         return response.json()["access_token"]
@@ -64,105 +114,118 @@ def get_uber_access_token():
         detail=f"Failed to get Uber access token: {response.json()}"
     )
 
-def find_top_fares(start_lat, start_lon, end_lat, end_lon, limit, search_range=500):
+async def find_top_fares(start_lat, start_lon, end_lat, end_lon, limit, search_range=500,
+                         concurrency=FARE_SEARCH_CONCURRENCY, pattern=CANDIDATE_PATTERN,
+                         mode=SEARCH_MODE, quote_budget=ADAPTIVE_QUOTE_BUDGET):
     """
     Finds the top `limit` cheapest Uber fares from original and nearby pickup spots.
     Distances are specified in feet, but converted to meters under the hood.
     Each option now includes 'pickup_lat' and 'pickup_lon'.
+    concurrency: Maximum number of pickup spots street-checked at the same time; all
+                 candidates are then priced with one batch estimate call (one per round
+                 in adaptive mode)
+    pattern: Candidate layout passed to generate_candidates (exhaustive mode)
+    mode: "exhaustive" quotes every candidate; "adaptive" refines coarse-to-fine and stops
+          after `quote_budget` quotes or once the top `limit` stops improving
+    Returns {"options": [...], "candidates": {...}, "search": {...}, "partial": bool,
+    "skipped": int} where "candidates" reports how many pickup spots were generated and
+    quoted, "search" the quotes used (estimates loaded from upstream, so quote cache hits
+    don't count in either mode), and "skipped" how many candidates the request's latency
+    budget cut off (making the result partial).
     """
-    directions   = ("N","E","S","W","NE","NW","SE","SW")
-    distances_ft = [int(search_range * 0.5), int(search_range)]
-    distances_m  = [round(ft * 0.3048) for ft in distances_ft]
-
-    # build a list of (lat, lon, label) tuples
-    locations = [
-        (start_lat, start_lon, "Original"),
-        *[
-            move_location(start_lat, start_lon, meters, dir)
-            + (f"{dir} {feet}ft",)
-            for dir in directions
-            for meters, feet in zip(distances_m, distances_ft)
-        ],
-    ]
-
-    all_results = []
-    with ThreadPoolExecutor(max_workers=len(locations)) as executor:
-        # map each Future back to its original loc tuple
-        future_to_loc = {
-            executor.submit(process_location_uber, loc, end_lat, end_lon): loc
-            for loc in locations
-        }
-
-        for future in as_completed(future_to_loc):
-            loc = future_to_loc[future]
-            lat, lon, label = loc
-
-            result = future.result()
-            if not result:
-                continue
-
-            _, prices = result
-            for ride in prices:
-                price = ride.get("low_estimate")
-                if price is None:
-                    continue
-
-                all_results.append({
-                    "location":    label,
-                    "pickup_lat":  lat,
-                    "pickup_lon":  lon,
-                    "price":       price,
-                    "ride_type":   ride.get("display_name"),
-                })
+    client = get_client()
+    usage = {"upstream_quotes": 0}
+    async def quote_batch(locations):
+        return await quote_locations(client, locations, end_lat, end_lon, usage)
+
+    if mode == "adaptive":
+        all_results, candidate_stats, search_stats = await adaptive_search(
+            client, start_lat, start_lon, search_range, quote_batch, limit, quote_budget,
+            concurrency
+        )
+        skipped = search_stats.pop("skipped")
+    else:
+        locations = generate_candidates(start_lat, start_lon, search_range, pattern)
+        locations, candidate_stats = await prepare_candidates(client, locations,
+                                                              concurrency=concurrency)
+        skipped = candidate_stats["skipped"]
+        results = await until_deadline(quote_batch(locations))
+        if results is SKIPPED:
+            skipped += len(locations)
+            results = []
+        all_results = [option for options in results for option in options]
+        search_stats = {"mode": "exhaustive", "candidates_quoted": len(results)}
+    search_stats["quotes_used"] = usage["upstream_quotes"]
 
     # sort ascending and take the top `limit`
     all_results.sort(key=lambda x: x["price"])
-    return all_results[:limit]
+    return {
+        "options": all_results[:limit],
+        "candidates": candidate_stats,
+        "search": search_stats,
+        "partial": skipped > 0,
+        "skipped": skipped,
+    }
 
-def move_location(lat, lon, meters, direction):
+async def quote_location(client, location, end_lat, end_lon):
     """
-    Moves a latitude/longitude coordinate by a given number of meters
-    in a specified direction (N, S, E, W, NE, NW, SE, SW).
+    Quotes one pickup spot and returns its ranked-list options, or SKIPPED while the
+    estimate API's circuit breaker is open.
     """
-    delta_lat = (meters / EARTH_RADIUS) * (180 / math.pi)
-    delta_lon = (meters / EARTH_RADIUS) * (180 / math.pi) / math.cos(math.radians(lat))
-
-    direction_map = {
-        "N": (lat + delta_lat, lon),
-        "S": (lat - delta_lat, lon),
-        "E": (lat, lon + delta_lon),
-        "W": (lat, lon - delta_lon),
-        "NE": (lat + delta_lat, lon + delta_lon),
-        "NW": (lat + delta_lat, lon - delta_lon),
-        "SE": (lat - delta_lat, lon + delta_lon),
-        "SW": (lat - delta_lat, lon - delta_lon),
-    }
-
-    return direction_map.get(direction, (lat, lon))
-
+    try:
+        _, prices = await process_location_uber(client, location, end_lat, end_lon)
+    except CircuitOpen:
+        return SKIPPED
+    return uber_options(location, prices)
 
-def is_valid_street(lat, lon):
+async def quote_locations(client, locations, end_lat, end_lon, usage=None):
     """
-    Checks if the given latitude/longitude corresponds to a valid street address.
-    Uses Google Maps Reverse Geocoding API.
+    Quotes many pickup spots with a single batch estimate call.
+    Returns one list of ranked-list options per location, in input order, or SKIPPED
+    while the estimate API's circuit breaker is open.
+    usage: Optional dict whose "upstream_quotes" counts the estimates loaded from upstream
     """
-    if not USE_GOOGLE_MAPS:
-        return True
-
-    url = f"https://maps.googleapis.com/maps/api/geocode/json?latlng={lat},{lon}&key={GMAP_API_KEY}"
-    response = requests.get(url, timeout=10).json()
-
-    for result in response.get("results", []):
-        #print(result)
-        if "route" in result.get("types", []):  # "route" type indicates a valid street
-            return True
-    return False
+    try:
+        batch = await get_uber_price_estimates_batch(client, locations, end_lat, end_lon, usage)
+    except CircuitOpen:
+        return SKIPPED
+    return [uber_options(location, prices) for location, prices in zip(locations, batch)]
 
+def uber_options(location, prices):
+    """
+    Turns the Uber price estimates for one pickup spot into ranked-list options.
+    """
+    lat, lon, label = location
+    return [
+        {
+            "location":    label,
+            "pickup_lat":  lat,
+            "pickup_lon":  lon,
+            "price":       ride["low_estimate"],
+            "ride_type":   ride.get("display_name"),
+        }
+        for ride in prices
+        if ride.get("low_estimate") is not None
+    ]
 
-def get_uber_price_estimates(start_lat, start_lon, end_lat, end_lon):
+async def get_uber_price_estimates(client, start_lat, start_lon, end_lat, end_lon):
     """
-    Queries the mock API to get ride price estimates between the start and end locations.
+    Gets ride price estimates between the start and end locations, either from the
+    in-process mock pricing logic or from the estimate API depending on PRICING_PROVIDER.
+    Estimates are cached briefly per pickup/drop-off cell, and identical concurrent
+    requests share one upstream call.
     """
+    key = quote_key("uber", None, start_lat, start_lon, end_lat, end_lon)
+    return await quote_cache.get_or_load(
+        key, lambda: _fetch_uber_price_estimates(client, start_lat, start_lon, end_lat, end_lon)
+    )
+
+async def _fetch_uber_price_estimates(client, start_lat, start_lon, end_lat, end_lon):
+    """ Uncached single-pickup call behind the quote cache """
+    if PRICING_PROVIDER == "local":
+        response = uber_price_estimates(start_lat, start_lon, end_lat, end_lon, seat_count=1)
+        return [estimate.model_dump() for estimate in response.prices]
+
     params = {
         "start_latitude": start_lat,
         "start_longitude": start_lon,
@@ -171,82 +234,76 @@ def get_uber_price_estimates(start_lat, start_lon, end_lat, end_lon):
         "seat_count": 1
     }
 
-    response = requests.get(MOCK_ESTIMATE_URL, params=params, timeout=10)
+    response = await call_upstream(
+        UBER_ESTIMATES,
+        lambda: client.get(MOCK_ESTIMATE_URL, params=params, timeout=call_timeout()),
+    )
 
     if response.status_code != 200:
         raise HTTPException(status_code=response.status_code, detail=response.json())
 
     return response.json().get("prices", [])
 
-def process_location_uber(location, end_lat, end_lon):
+async def get_uber_price_estimates_batch(client, starts, end_lat, end_lon, usage=None):
     """
-    For a given location, checks if it's valid and retrieves Uber price estimates.
-    Returns a tuple (label, prices) or None if the location isn't valid.
+    Gets price estimates from every start point to the same destination in one call:
+    one vectorized pass in-process, or one POST to the batch estimate API.
+    starts: (lat, lon, ...) tuples; returns one list of estimates per start, in input order.
+    Only starts whose cell isn't in the quote cache (or already being quoted) are sent.
+    usage: Optional dict whose "upstream_quotes" is increased by the number of starts sent
     """
-    lat, lon, label = location
-    if is_valid_street(lat, lon):
-        prices = get_uber_price_estimates(lat, lon, end_lat, end_lon)
-        return (label, prices)
-    return None
+    keys = [quote_key("uber", None, start[0], start[1], end_lat, end_lon) for start in starts]
+    by_key = dict(zip(keys, starts))
+
+    async def load(missing):
+        estimates = await _fetch_uber_price_estimates_batch(
+            client, [by_key[key] for key in missing], end_lat, end_lon
+        )
+        if usage is not None:
+            usage["upstream_quotes"] += len(missing)
+        return estimates
+
+    return await quote_cache.get_many_or_load(keys, load)
+
+async def _fetch_uber_price_estimates_batch(client, starts, end_lat, end_lon):
+    """ Uncached batch call behind the quote cache """
+    start_lats = [start[0] for start in starts]
+    start_lons = [start[1] for start in starts]
+
+    if PRICING_PROVIDER == "local":
+        return uber_price_estimates_batch(start_lats, start_lons, end_lat, end_lon, seat_count=1)
+
+    body = {
+        "requests": [
+            {
+                "start_latitude": lat,
+                "start_longitude": lon,
+                "end_latitude": end_lat,
+                "end_longitude": end_lon,
+            }
+            for lat, lon in zip(start_lats, start_lons)
+        ],
+        "seat_count": 1,
+    }
 
-def find_best_fare(start_lat, start_lon, end_lat, end_lon, search_range=500):
-    """
-    Finds the best Uber fare by checking the original location and nearby pickup spots in parallel.
-    search_range: Maximum distance in feet to search for alternative pickup locations
-    """
-    # Convert search range from feet to meters
-    search_range_meters = search_range * 0.3048
-    
-    # Calculate the number of steps based on search range
-    # We'll search at 30% and 60% of the max range
-    step1 = int(search_range_meters * 0.3)
-    step2 = int(search_range_meters * 0.6)
-    
-    locations = [
-        (start_lat, start_lon, "Original"),
-        move_location(start_lat, start_lon, step1, "N") + (f"N {int(step1/0.3048)}ft",),
-        move_location(start_lat, start_lon, step2, "N") + (f"N {int(step2/0.3048)}ft",),
-        move_location(start_lat, start_lon, step1, "E") + (f"E {int(step1/0.3048)}ft",),
-        move_location(start_lat, start_lon, step2, "E") + (f"E {int(step2/0.3048)}ft",),
-        move_location(start_lat, start_lon, step1, "S") + (f"S {int(step1/0.3048)}ft",),
-        move_location(start_lat, start_lon, step2, "S") + (f"S {int(step2/0.3048)}ft",),
-        move_location(start_lat, start_lon, step1, "W") + (f"W {int(step1/0.3048)}ft",),
-        move_location(start_lat, start_lon, step2, "W") + (f"W {int(step2/0.3048)}ft",),
-        move_location(start_lat, start_lon, step1, "NE") + (f"NE {int(step1/0.3048)}ft",),
-        move_location(start_lat, start_lon, step2, "NE") + (f"NE {int(step2/0.3048)}ft",),
-        move_location(start_lat, start_lon, step1, "NW") + (f"NW {int(step1/0.3048)}ft",),
-        move_location(start_lat, start_lon, step2, "NW") + (f"NW {int(step2/0.3048)}ft",),
-        move_location(start_lat, start_lon, step1, "SE") + (f"SE {int(step1/0.3048)}ft",),
-        move_location(start_lat, start_lon, step2, "SE") + (f"SE {int(step2/0.3048)}ft",),
-        move_location(start_lat, start_lon, step1, "SW") + (f"SW {int(step1/0.3048)}ft",),
-        move_location(start_lat, start_lon, step2, "SW") + (f"SW {int(step2/0.3048)}ft",),
-    ]
-    
-    best_price = None
-    best_location = None
-    best_ride_type = None
-
-    with ThreadPoolExecutor(max_workers=len(locations)) as executor:
-        futures = [executor.submit(process_location_uber, loc, end_lat, end_lon) for loc in locations]
-        for future in as_completed(futures):
-            result = future.result()
-            if result is None:
-                continue
-            label, prices = result
-            for ride in prices:
-                price = ride.get("low_estimate")
-                ride_type = ride.get("display_name")
-                if best_price is None or (price is not None and price < best_price):
-                    best_price = price
-                    best_location = label
-                    best_ride_type = ride_type
+    response = await call_upstream(
+        UBER_ESTIMATES,
+        lambda: client.post(MOCK_ESTIMATE_BATCH_URL, json=body, timeout=call_timeout()),
+    )
 
-    return {
-        "best_location": best_location,
-        "best_price": best_price,
-        "best_ride_type": best_ride_type
-    }
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail=response.json())
+
+    return [result.get("prices", []) for result in response.json().get("results", [])]
 
+async def process_location_uber(client, location, end_lat, end_lon):
+    """
+    For a given candidate from prepare_candidates, retrieves Uber price estimates.
+    Returns a tuple (label, prices).
+    """
+    lat, lon, label = location
+    prices = await get_uber_price_estimates(client, lat, lon, end_lat, end_lon)
+    return (label, prices)
 
 
 def random_offset(lat, lon, max_offset=400):
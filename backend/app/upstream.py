@@ -0,0 +1,129 @@
+""" Shared pooled HTTP client for every upstream API (Google, Uber, Lyft and the local mocks). """
+import atexit
+from collections import defaultdict
+from contextlib import asynccontextmanager
+import httpx
+from .config import (UPSTREAM_TIMEOUT, UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_POOL_TIMEOUT,
+                     UPSTREAM_MAX_CONNECTIONS, UPSTREAM_MAX_KEEPALIVE,
+                     UPSTREAM_KEEPALIVE_EXPIRY, UPSTREAM_HTTP2, UPSTREAM_CASSETTE_MODE,
+                     UPSTREAM_CASSETTE_PATH, UPSTREAM_REPLAY_TIME_SCALE)
+from .cassette import CassetteWriter, RecordingTransport, ReplayTransport
+
+_client = None
+_cassette = None  # Recording or replaying transport of the current client, if any
+_writer = None  # Cassette being recorded, shared by every client the process creates
+
+# Per-host counters, so connection reuse can be checked from /stats/http
+_requests = defaultdict(int)
+_tcp_connects = defaultdict(int)
+_tls_handshakes = defaultdict(int)
+
+
+def create_client():
+    """
+    Builds the process-wide client: keep-alive pools per host, bounded by
+    UPSTREAM_MAX_CONNECTIONS, with HTTP/2 when UPSTREAM_HTTP2 is set.
+    httpx asks for compressed responses and decompresses them transparently.
+    UPSTREAM_CASSETTE_MODE "record" saves the traffic to a cassette and "replay" answers
+    from one instead of the network.
+    """
+    global _cassette, _writer  # pylint: disable=global-statement
+    if UPSTREAM_HTTP2:
+        try:
+            import h2  # pylint: disable=import-outside-toplevel,unused-import
+        except ImportError as e:
+            raise RuntimeError("UPSTREAM_HTTP2 needs the h2 package "
+                               "(pip install 'httpx[http2]')") from e
+
+    limits = httpx.Limits(
+        max_connections=UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+        keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(UPSTREAM_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT,
+                            pool=UPSTREAM_POOL_TIMEOUT)
+    if UPSTREAM_CASSETTE_MODE == "replay":
+        transport = ReplayTransport(UPSTREAM_CASSETTE_PATH, UPSTREAM_REPLAY_TIME_SCALE)
+    else:
+        transport = httpx.AsyncHTTPTransport(limits=limits, http2=UPSTREAM_HTTP2)
+        if UPSTREAM_CASSETTE_MODE == "record":
+            if _writer is None or _writer.closed:
+                # A cassette closed earlier in this process is reopened, not overwritten
+                _writer = CassetteWriter(UPSTREAM_CASSETTE_PATH, resume=_writer is not None)
+                atexit.register(_writer.close)
+            transport = RecordingTransport(transport, _writer)
+        elif UPSTREAM_CASSETTE_MODE != "off":
+            raise RuntimeError(f"Unknown UPSTREAM_CASSETTE_MODE: {UPSTREAM_CASSETTE_MODE}")
+    _cassette = transport if UPSTREAM_CASSETTE_MODE != "off" else None
+    return httpx.AsyncClient(transport=transport, timeout=timeout,
+                             event_hooks={"request": [_count_request]})
+
+
+def get_client():
+    """
+    Returns the shared client. It is opened by the app lifespan; scripts that import the
+    modules without running the app get one created on first use.
+    """
+    global _client  # pylint: disable=global-statement
+    if _client is None or _client.is_closed:
+        _client = create_client()
+    return _client
+
+
+async def close_client():
+    """ Closes the shared client and its pooled connections. """
+    global _client  # pylint: disable=global-statement
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def close_cassette():
+    """ Writes the index of the cassette being recorded, if any, and closes it. """
+    if _writer is not None:
+        _writer.close()
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    """
+    FastAPI lifespan: open the upstream pools at startup, and close them and finish the
+    cassette being recorded at shutdown.
+    """
+    get_client()
+    try:
+        yield
+    finally:
+        await close_client()
+        close_cassette()
+
+
+async def _count_request(request):
+    host = request.url.host
+    _requests[host] += 1
+
+    async def trace(event, _info):
+        if event == "connection.connect_tcp.complete":
+            _tcp_connects[host] += 1
+        elif event == "connection.start_tls.complete":
+            _tls_handshakes[host] += 1
+
+    request.extensions["trace"] = trace
+
+
+def stats():
+    """ Requests, new TCP connections and TLS handshakes per upstream host. """
+    return {
+        host: {
+            "requests": count,
+            "tcp_connects": _tcp_connects[host],
+            "tls_handshakes": _tls_handshakes[host],
+            "connection_reuse": round(1 - _tcp_connects[host] / count, 4),
+        }
+        for host, count in _requests.items()
+    }
+
+
+def cassette_stats():
+    """ What the record/replay cassette has recorded or replayed, when one is in use. """
+    return _cassette.stats if _cassette is not None else {"mode": UPSTREAM_CASSETTE_MODE}
@@ -0,0 +1,381 @@
+"""
+End-to-end load benchmark for the fare, autocomplete and profile endpoints.
+
+Starts the app with uvicorn against simulated upstreams (app.simulator) or a replayed
+cassette, and a fresh SQLite database, then drives each scenario with a fixed number of
+concurrent clients. Reports throughput, latency percentiles, the server's thread count and
+peak RSS, and saves them as JSON; --compare checks the run against an earlier one.
+
+Run from backend/:
+    python -m benchmarks.load --concurrency 16 --duration 20
+    python -m benchmarks.load --scenarios uber lyft --compare benchmarks/results/baseline.json
+    python -m benchmarks.load --upstreams replay --cassette upstream.cassette
+Server thread and memory figures are read from /proc and are only reported on Linux.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+import httpx
+import numpy as np
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+# Trips are drawn from this (south, west, north, east) box
+AREA = (37.74, -122.45, 37.80, -122.40)
+PREFIXES = ["1", "12", "Mar", "Market", "Mission St", "Va", "Valencia", "Home", "Office", "Gym"]
+SAVED_ADDRESSES = [
+    ("1 Market St, San Francisco, CA", "Office"),
+    ("1200 Valencia St, San Francisco, CA", "Gym"),
+    ("500 Mission St, San Francisco, CA", None),
+    ("12 Marina Blvd, San Francisco, CA", None),
+]
+BENCH_USER = {"username": "loadbench", "email": "loadbench@example.com", "password": "Bench1234"}
+
+
+def random_point(rng):
+    """ A point in the benchmark area, rounded like coordinates sent by the frontend. """
+    south, west, north, east = AREA
+    return round(rng.uniform(south, north), 6), round(rng.uniform(west, east), 6)
+
+
+def make_routes(count, seed):
+    """ `count` distinct (start, end) trips; requests cycle through them, as repeat users do. """
+    rng = random.Random(seed)
+    return [(*random_point(rng), *random_point(rng)) for _ in range(count)]
+
+
+# Scenario name -> function (rng, routes) returning (method, path, params, json body)
+def uber_request(rng, routes):
+    start_lat, start_lon, end_lat, end_lon = rng.choice(routes)
+    params = {"start_lat": start_lat, "start_lon": start_lon, "end_lat": end_lat,
+              "end_lon": end_lon}
+    return "GET", "/uber/best-uber-fare/", params, None
+
+
+def lyft_request(rng, routes):
+    start_lat, start_lon, end_lat, end_lon = rng.choice(routes)
+    params = {"start_lat": start_lat, "start_lon": start_lon, "end_lat": end_lat,
+              "end_lon": end_lon}
+    return "GET", "/lyft/best-lyft-fare/", params, None
+
+
+def autocomplete_request(rng, routes):
+    lat, lng, _, _ = rng.choice(routes)
+    return "GET", "/autocomplete", {"input": rng.choice(PREFIXES), "lat": lat, "lng": lng}, None
+
+
+def profile_request(rng, routes):
+    # Mostly reads, as the profile pages make them, with an occasional history write
+    draw = rng.random()
+    if draw < 0.1:
+        start_lat, start_lon, end_lat, end_lon = rng.choice(routes)
+        body = {
+            "written_address": f"{rng.randint(1, 2000)} Market St, San Francisco, CA",
+            "final_address": f"{rng.randint(1, 2000)} Mission St, San Francisco, CA",
+            "latitude_start": start_lat, "longitude_start": start_lon,
+            "latitude_end": end_lat, "longitude_end": end_lon,
+        }
+        return "POST", "/profile/history/add", None, body
+    path = rng.choice(["/profile/info", "/profile/history", "/profile/saved-addresses",
+                       "/profile/preferences"])
+    return "GET", path, None, None
+
+
+SCENARIOS = {
+    "uber": uber_request,
+    "lyft": lyft_request,
+    "autocomplete": autocomplete_request,
+    "profile": profile_request,
+}
+
+
+def free_port():
+    """ A TCP port nothing is listening on. """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(module, port, env, log_path):
+    """ Runs `module`'s ASGI app with uvicorn in a child process. """
+    log = open(log_path, "wb")  # pylint: disable=consider-using-with
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", module, "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+
+
+async def wait_ready(base_url, process, timeout=30):
+    """ Waits until the server answers, failing early if it exits. """
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {process.returncode}")
+            try:
+                await client.get(base_url + "/openapi.json")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} didn't start in {timeout} s")
+
+
+async def sign_in(client):
+    """ Registers the benchmark user, saves a few addresses, and returns its session headers. """
+    await client.post("/auth/register", json=BENCH_USER)
+    response = await client.post("/auth/login", json={
+        "username": BENCH_USER["username"], "password": BENCH_USER["password"],
+    })
+    response.raise_for_status()
+    # The cookie is marked Secure, so it isn't sent back over plain HTTP automatically
+    session = {"Cookie": f"session={response.cookies['session']}"}
+    for address, nickname in SAVED_ADDRESSES:
+        await client.post("/profile/saved-addresses/add", headers=session, json={
+            "address": address, "nickname": nickname, "latitude": 37.77, "longitude": -122.42,
+        })
+    return session
+
+
+def read_proc_status(pid):
+    """ Threads, current RSS and peak RSS (bytes) of a process, or None off Linux. """
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            fields = dict(line.split(":", 1) for line in f)
+    except OSError:
+        return None
+    return {
+        "threads": int(fields["Threads"]),
+        "rss": int(fields["VmRSS"].split()[0]) * 1024,
+        "peak_rss": int(fields["VmHWM"].split()[0]) * 1024,
+    }
+
+
+async def run_scenario(client, name, routes, session, concurrency, duration, warmup, seed, pid):
+    """
+    Drives one scenario with `concurrency` clients, each sending its next request as soon as
+    the previous one is answered. Requests made during `warmup` seconds are not counted.
+    """
+    build = SCENARIOS[name]
+    latencies = []
+    errors = {}
+    samples = []
+    started = time.monotonic()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+
+    async def worker(number):
+        rng = random.Random(f"{seed}-{name}-{number}")
+        while True:
+            method, path, params, body = build(rng, routes)
+            sent = time.monotonic()
+            if sent >= stop_at:
+                return
+            try:
+                response = await client.request(method, path, params=params, json=body,
+                                                headers=session)
+                status = response.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            answered = time.monotonic()
+            if sent >= measure_from:
+                latencies.append(answered - sent)
+                if status != 200:
+                    errors[str(status)] = errors.get(str(status), 0) + 1
+
+    async def monitor():
+        while True:
+            status = read_proc_status(pid)
+            if status is not None and time.monotonic() >= measure_from:
+                samples.append(status)
+            await asyncio.sleep(0.1)
+
+    sampler = asyncio.ensure_future(monitor())
+    try:
+        await asyncio.gather(*(worker(number) for number in range(concurrency)))
+    finally:
+        sampler.cancel()
+    elapsed = time.monotonic() - measure_from
+
+    latencies_ms = np.array(latencies) * 1000
+    result = {
+        "requests": len(latencies),
+        "errors": errors,
+        "error_rate": round(sum(errors.values()) / len(latencies), 4) if latencies else 0.0,
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "latency_ms": {
+            "mean": round(float(latencies_ms.mean()), 2) if latencies else None,
+            **{
+                f"p{q}": round(float(np.percentile(latencies_ms, q)), 2) if latencies else None
+                for q in (50, 95, 99)
+            },
+            "max": round(float(latencies_ms.max()), 2) if latencies else None,
+        },
+    }
+    if samples:
+        result["server"] = {
+            "threads_peak": max(sample["threads"] for sample in samples),
+            "rss_peak_mb": round(max(sample["rss"] for sample in samples) / 2 ** 20, 1),
+        }
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints each scenario's change against `baseline` and returns the regressions: p95
+    latency up, or throughput down, by more than `tolerance` (a fraction).
+    """
+    regressions = []
+    print(f"\n{'scenario':<14}{'rps':>10}{'base':>10}{'p95 ms':>10}{'base':>10}")
+    for name, result in results["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if base is None:
+            continue
+        rps, base_rps = result["throughput_rps"], base["throughput_rps"]
+        p95, base_p95 = result["latency_ms"]["p95"], base["latency_ms"]["p95"]
+        print(f"{name:<14}{rps:>10}{base_rps:>10}{p95:>10}{base_p95:>10}")
+        if base_p95 and p95 > base_p95 * (1 + tolerance):
+            regressions.append(f"{name}: p95 {base_p95} -> {p95} ms")
+        if base_rps and rps < base_rps * (1 - tolerance):
+            regressions.append(f"{name}: throughput {base_rps} -> {rps} req/s")
+    return regressions
+
+
+def git_revision():
+    """ The commit being benchmarked, with a "+dirty" mark for uncommitted changes. """
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                               cwd=BACKEND_DIR, capture_output=True, text=True,
+                               check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return revision + ("+dirty" if dirty else "")
+
+
+async def main(args):
+    workdir = Path(tempfile.mkdtemp(prefix="farefinder-load-"))
+    app_port, sim_port = free_port(), free_port()
+    env = {
+        **os.environ,
+        "DATABASE_URL": args.database_url or f"sqlite:///{workdir / 'bench.db'}",
+        "PRICING_PROVIDER": "http",
+        "GMAP_API_KEY": os.environ.get("GMAP_API_KEY", "benchmark"),
+        "ROUTE_MAX_STALE": "0",
+    }
+    processes = []
+    if args.upstreams == "simulator":
+        sim_url = f"http://127.0.0.1:{sim_port}"
+        env.update({
+            "GOOGLE_MAPS_API_URL": f"{sim_url}/maps/api",
+            "UBER_ESTIMATE_API_URL": f"{sim_url}/estimates",
+            "LYFT_COST_API_URL": f"{sim_url}/lyft",
+            "SIM_SEED": str(args.seed),
+        })
+        sim = start_server("app.simulator:app", sim_port, env, workdir / "simulator.log")
+        processes.append(sim)
+    else:
+        env.update({"UPSTREAM_CASSETTE_MODE": "replay",
+                    "UPSTREAM_CASSETTE_PATH": str(Path(args.cassette).resolve())})
+
+    server = start_server("app.main:app", app_port, env, workdir / "server.log")
+    processes.append(server)
+    base_url = f"http://127.0.0.1:{app_port}"
+    try:
+        if args.upstreams == "simulator":
+            await wait_ready(f"http://127.0.0.1:{sim_port}", sim)
+        await wait_ready(base_url, server)
+
+        limits = httpx.Limits(max_connections=args.concurrency,
+                              max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits,
+                                     timeout=args.timeout) as client:
+            session = await sign_in(client)
+            routes = make_routes(args.routes, args.seed)
+            results = {
+                "started_at": datetime.now().isoformat(timespec="seconds"),
+                "revision": git_revision(),
+                "config": {
+                    "concurrency": args.concurrency, "duration_s": args.duration,
+                    "warmup_s": args.warmup, "routes": args.routes, "seed": args.seed,
+                    "upstreams": args.upstreams,
+                    "simulator_profiles": {
+                        name: os.environ.get(f"SIM_{name.upper()}_PROFILE")
+                        for name in ("google", "uber", "lyft")
+                    } if args.upstreams == "simulator" else None,
+                },
+                "scenarios": {},
+            }
+            for name in args.scenarios:
+                print(f"{name}: {args.concurrency} clients for {args.duration} s ...",
+                      flush=True)
+                result = await run_scenario(client, name, routes, session, args.concurrency,
+                                            args.duration, args.warmup, args.seed, server.pid)
+                results["scenarios"][name] = result
+                latency = result["latency_ms"]
+                print(f"  {result['throughput_rps']} req/s, p50 {latency['p50']} ms, "
+                      f"p95 {latency['p95']} ms, p99 {latency['p99']} ms, "
+                      f"errors {result['error_rate']:.2%}", flush=True)
+
+        final = read_proc_status(server.pid)
+        if final is not None:
+            results["server_peak_rss_mb"] = round(final["peak_rss"] / 2 ** 20, 1)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+    output = Path(args.output) if args.output else \
+        RESULTS_DIR / f"load-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"\nSaved {output} (server logs in {workdir})")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\nRegressions beyond the tolerance:\n  " + "\n  ".join(regressions))
+            return 1
+        print("\nNo regressions beyond the tolerance")
+    return 0
+
+
+def parse_args(argv=None):
+    """ Command line options. """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS),
+                        default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=20, help="Measured seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=3, help="Unmeasured seconds first")
+    parser.add_argument("--routes", type=int, default=200, help="Distinct trips requested")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds per request")
+    parser.add_argument("--upstreams", choices=["simulator", "replay"], default="simulator",
+                        help="Simulated upstreams (profiles from SIM_*_PROFILE) or a cassette")
+    parser.add_argument("--cassette", help="Cassette to replay with --upstreams replay")
+    parser.add_argument("--database-url", help="Database to use instead of a fresh SQLite file")
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/load-*.json)")
+    parser.add_argument("--compare", help="Earlier results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="Allowed fractional p95 increase or throughput drop")
+    args = parser.parse_args(argv)
+    if args.upstreams == "replay" and not args.cassette:
+        parser.error("--upstreams replay needs --cassette")
+    return args
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
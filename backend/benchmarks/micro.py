@@ -0,0 +1,326 @@
+"""
+Microbenchmarks for the geo and pricing kernels run on every candidate and quote.
+
+Each kernel is timed over a fixed, seeded set of San Francisco trips, scalar and batched,
+after checking its results against the scalar implementations it replaces or mirrors.
+Timings are relative: each timed run of a kernel is paired with a run of a fixed
+calibration workload in the same process, and the kernel's cost is the median ratio of the
+two. That cancels out machine speed and load, so the stored baseline holds across runs and
+machines. The run fails when a kernel's relative cost exceeds the baseline's by more than
+the tolerance.
+
+Run from backend/:
+    python -m benchmarks.micro                    # check correctness and against the baseline
+    python -m benchmarks.micro --tolerance 0.5    # allow 50% slowdowns (noisy machines)
+    python -m benchmarks.micro --save-baseline    # store this run's relative costs as the baseline
+Save a new baseline after an intended performance change, or after upgrading Python or numpy.
+"""
+import argparse
+import json
+import math
+import platform
+import random
+import statistics
+import sys
+import timeit
+from pathlib import Path
+import numpy as np
+from app import lyft, uber
+from app.candidates import generate_candidates, offset_points
+from app.config import MAX_CANDIDATES
+from app.geo import distance_m, geohash
+from app.pricing import (LYFT_PRODUCTS, UBER_PRODUCTS, haversine_distance,
+                         haversine_distance_batch, lyft_cost_estimates, lyft_cost_estimates_batch,
+                         uber_price_estimates, uber_price_estimates_batch)
+
+BASELINE_PATH = Path(__file__).resolve().parent / "baselines" / "micro.json"
+
+# Calibration workload: a pure-Python loop plus a NumPy pass, like the kernels' mix
+_CALIBRATION_ARRAY = np.linspace(0.0, 1.0, 20000)
+
+# Trips are drawn from this (south, west, north, east) box
+AREA = (37.70, -122.51, 37.81, -122.38)
+# One search's worth of offsets: two rings of eight compass bearings, 250 and 500 ft out
+SEARCH_DISTANCES_M = np.repeat([250 * 0.3048, 500 * 0.3048], 8)
+SEARCH_BEARINGS = np.tile(np.arange(8) * 45.0, 2)
+
+
+class Data:
+    """ Seeded coordinates shared by every kernel. """
+
+    def __init__(self, pairs=1000, quotes=200, seed=1):
+        rng = np.random.default_rng(seed)
+        south, west, north, east = AREA
+        self.start_lats = rng.uniform(south, north, pairs)
+        self.start_lons = rng.uniform(west, east, pairs)
+        self.end_lats = rng.uniform(south, north, pairs)
+        self.end_lons = rng.uniform(west, east, pairs)
+        self.pairs = list(zip(self.start_lats.tolist(), self.start_lons.tolist(),
+                              self.end_lats.tolist(), self.end_lons.tolist()))
+        # Pickup offsets up to 500 ft around each start, as in a fare search
+        self.offsets_m = rng.uniform(0, 500 * 0.3048, pairs)
+        self.bearings = rng.uniform(0, 360, pairs)
+        # Quotes use fewer pairs: the scalar pricing path builds pydantic models per product
+        self.quotes = self.pairs[:quotes]
+        self.seed = seed
+
+
+def _quote_columns(pairs):
+    return [list(column) for column in zip(*pairs)]
+
+
+# Kernel name -> (function taking Data and returning a zero-argument callable, items per call)
+def kernels(data):
+    """ The timed kernels, each with the number of items (pairs, points) one call handles. """
+    pairs, quotes = data.pairs, data.quotes
+    lat, lon = data.start_lats[0], data.start_lons[0]
+    quote_columns = _quote_columns(quotes)
+    return {
+        "haversine.scalar": (lambda: [haversine_distance(*p) for p in pairs], len(pairs)),
+        "haversine.batch": (lambda: haversine_distance_batch(
+            data.start_lats, data.start_lons, data.end_lats, data.end_lons), len(pairs)),
+        "distance_m.scalar": (lambda: [distance_m(*p) for p in pairs], len(pairs)),
+        "geohash.scalar": (lambda: [geohash(p[0], p[1], 8) for p in pairs], len(pairs)),
+        "offset_points.search": (lambda: [
+            offset_points(p[0], p[1], SEARCH_DISTANCES_M, SEARCH_BEARINGS) for p in quotes
+        ], len(quotes)),
+        "offset_points.batch": (lambda: offset_points(lat, lon, data.offsets_m, data.bearings),
+                                len(pairs)),
+        "random_offset.uber": (lambda: [uber.random_offset(p[0], p[1]) for p in pairs],
+                               len(pairs)),
+        "random_offset.lyft": (lambda: [lyft.random_offset(p[0], p[1]) for p in pairs],
+                               len(pairs)),
+        "generate_candidates.rings": (lambda: [
+            generate_candidates(p[0], p[1], 500, "rings") for p in quotes
+        ], len(quotes)),
+        "uber_pricing.scalar": (lambda: [uber_price_estimates(*p) for p in quotes], len(quotes)),
+        "uber_pricing.batch": (lambda: uber_price_estimates_batch(*quote_columns), len(quotes)),
+        "lyft_pricing.scalar": (lambda: [lyft_cost_estimates(None, *p) for p in quotes],
+                                len(quotes)),
+        "lyft_pricing.batch": (lambda: lyft_cost_estimates_batch(None, *quote_columns),
+                               len(quotes)),
+    }
+
+
+def check(data):
+    """ Compares each kernel's results with the reference implementation; returns failures. """
+    failures = []
+
+    def expect(condition, message):
+        if not condition:
+            failures.append(message)
+
+    pairs, quotes = data.pairs, data.quotes
+
+    # Haversine: the batch form matches the scalar one, which matches a known distance
+    scalar = np.array([haversine_distance(*p) for p in pairs])
+    batch = haversine_distance_batch(data.start_lats, data.start_lons, data.end_lats,
+                                     data.end_lons)
+    expect(np.allclose(batch, scalar, rtol=1e-12, atol=1e-9),
+           "haversine_distance_batch differs from haversine_distance")
+    expect(abs(haversine_distance(37.7749, -122.4194, 34.0522, -118.2437) - 559.12) < 0.1,
+           "haversine_distance San Francisco -> Los Angeles is not ~559.12 km")
+
+    # distance_m: within half a percent of haversine over pickup-search distances
+    lat, lon = data.start_lats[0], data.start_lons[0]
+    lats, lons = offset_points(lat, lon, data.offsets_m, data.bearings)
+    for p_lat, p_lon, meters in zip(lats, lons, data.offsets_m):
+        exact = haversine_distance(lat, lon, p_lat, p_lon) * 1000
+        approx = distance_m(lat, lon, p_lat, p_lon)
+        if exact > 1 and abs(approx - exact) / exact > 0.005:
+            expect(False, f"distance_m is {approx:.2f} m where haversine gives {exact:.2f} m")
+            break
+        if abs(exact - meters) / max(meters, 1) > 0.005:
+            expect(False, f"offset_points moved {exact:.2f} m instead of {meters:.2f} m")
+            break
+
+    # geohash: reference vectors
+    expect(geohash(57.64911, 10.40744, 11) == "u4pruydqqvj", "geohash reference vector failed")
+    expect(geohash(37.7749, -122.4194, 5) == "9q8yy", "geohash San Francisco cell is not 9q8yy")
+
+    # offset_points: north and east offsets move only the latitude and longitude respectively
+    (north_lat, east_lat), (north_lon, east_lon) = offset_points(lat, lon, [100.0, 100.0],
+                                                                 [0.0, 90.0])
+    expect(north_lat > lat and math.isclose(north_lon, lon, abs_tol=1e-12) and
+           east_lon > lon and math.isclose(east_lat, lat, abs_tol=1e-12),
+           "offset_points moves points off their bearing")
+
+    # random_offset: stays within max_offset feet (plus the 6-decimal rounding)
+    random.seed(data.seed)
+    for module in (uber, lyft):
+        for p in pairs:
+            moved = module.random_offset(p[0], p[1], 400)
+            if distance_m(p[0], p[1], *moved) > 400 * 0.3048 + 0.2:
+                expect(False, f"{module.__name__}.random_offset went past 400 ft")
+                break
+
+    # generate_candidates: the original spot first, the rest inside the search range
+    for p in quotes:
+        candidates = generate_candidates(p[0], p[1], 500, "rings")
+        far = max(distance_m(p[0], p[1], c_lat, c_lon) for c_lat, c_lon, _ in candidates)
+        if candidates[0][2] != "Original" or len(candidates) > MAX_CANDIDATES or \
+                far > 500 * 0.3048 + 0.01:
+            expect(False, "generate_candidates returned candidates outside the search range")
+            break
+
+    # Pricing: the batch forms follow the scalar fare models product by product
+    uber_batch = uber_price_estimates_batch(*_quote_columns(quotes))
+    lyft_batch = lyft_cost_estimates_batch(None, *_quote_columns(quotes))
+    problems = (
+        problem
+        for p, batch_prices, batch_costs in zip(quotes, uber_batch, lyft_batch)
+        for problem in (
+            _pricing_problem("uber", [e.model_dump() for e in uber_price_estimates(*p).prices],
+                             batch_prices, UBER_PRODUCTS, haversine_distance(*p), 1.0,
+                             (1.1, 1.5)),
+            _pricing_problem("lyft", [e.model_dump() for e in
+                                      lyft_cost_estimates(None, *p).cost_estimates],
+                             batch_costs, LYFT_PRODUCTS, haversine_distance(*p), 0.5,
+                             (1.05, 1.2)),
+        )
+        if problem
+    )
+    problem = next(problems, None)
+    expect(problem is None, problem)
+
+    return failures
+
+
+def _pricing_problem(name, scalar, batch, products, distance_km, noise, spread):
+    """
+    What is wrong with one trip's scalar and batch estimates, or None: each product's low
+    estimate must be the fare model plus at most `noise` dollars, high/low within `spread`,
+    and both paths must agree on distance and duration.
+    """
+    if [e["display_name"] for e in scalar] != [e["display_name"] for e in batch]:
+        return f"{name} batch pricing returns different products"
+    for product, one, many in zip(products, scalar, batch):
+        for estimate in (one, many):
+            if name == "uber":
+                low, high = estimate["low_estimate"], estimate["high_estimate"]
+            else:
+                low = estimate["estimated_cost_cents_min"] / 100
+                high = estimate["estimated_cost_cents_max"] / 100
+            fare = product["base_fare"] + product["per_km"] * distance_km
+            if abs(low - fare) > noise + 0.01:
+                return f"{name} {product['display_name']} low estimate {low} is off the fare model"
+            if not spread[0] - 0.01 <= high / low <= spread[1] + 0.01:
+                return f"{name} {product['display_name']} high/low spread is {high / low:.3f}"
+        if name == "uber":
+            same = math.isclose(one["distance"], many["distance"], rel_tol=1e-12) and \
+                one["duration"] == many["duration"]
+        else:
+            same = one["estimated_distance_miles"] == many["estimated_distance_miles"] and \
+                one["estimated_duration_seconds"] == many["estimated_duration_seconds"]
+        if not same:
+            return f"{name} batch pricing distance or duration differs from the scalar path"
+    return None
+
+
+def calibration():
+    """ Fixed workload every kernel is timed against. """
+    total = 0.0
+    for i in range(2000):
+        total += math.sin(i) * math.sqrt(i)
+    return total + float(np.sin(_CALIBRATION_ARRAY).sum())
+
+
+def time_kernel(function, repeat, min_time):
+    """
+    (seconds per call, relative cost) of `function`: the best seconds per call over
+    `repeat` runs of at least `min_time` seconds each, and the median over those runs of
+    its time divided by that of the calibration workload timed right before it.
+    """
+    timers = []
+    for workload in (calibration, function):
+        timer = timeit.Timer(workload)
+        number, _ = timer.autorange()
+        timers.append((timer, max(1, int(number * min_time / 0.2))))
+
+    seconds, ratios = [], []
+    for _ in range(repeat):
+        (reference, ref_number), (kernel, number) = timers
+        reference_seconds = reference.timeit(ref_number) / ref_number
+        kernel_seconds = kernel.timeit(number) / number
+        seconds.append(kernel_seconds)
+        ratios.append(kernel_seconds / reference_seconds)
+    return min(seconds), statistics.median(ratios)
+
+
+def machine():
+    """ What the baseline was recorded on (for reference; costs are relative). """
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--only", nargs="+", help="Kernel names (or prefixes) to run")
+    parser.add_argument("--repeat", type=int, default=7, help="Timed runs per kernel")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Seconds per timed run")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed fractional increase of a relative cost over the baseline")
+    parser.add_argument("--baseline", default=str(BASELINE_PATH))
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Store these relative costs as the baseline instead of comparing")
+    parser.add_argument("--output", help="Also write this run's results to a JSON file")
+    args = parser.parse_args(argv)
+
+    data = Data()
+    failures = check(data)
+    for failure in failures:
+        print(f"WRONG  {failure}")
+    if failures:
+        return 1
+    print("Results match the reference implementations")
+
+    baseline_path = Path(args.baseline)
+    baseline = {}
+    if baseline_path.exists() and not args.save_baseline:
+        baseline = json.loads(baseline_path.read_text())["kernels"]
+
+    results = {}
+    slower = []
+    print(f"\n{'kernel':<28}{'us/call':>12}{'us/item':>10}{'relative':>10}{'baseline':>10}"
+          f"{'change':>9}")
+    for name, (function, items) in kernels(data).items():
+        if args.only and not any(name.startswith(prefix) for prefix in args.only):
+            continue
+        seconds, relative = time_kernel(function, args.repeat, args.min_time)
+        results[name] = {"relative_cost": round(relative, 4), "items": items,
+                         "us_per_call": round(seconds * 1e6, 3)}
+        line = f"{name:<28}{seconds * 1e6:>12.1f}{seconds * 1e6 / items:>10.3f}{relative:>10.3f}"
+        base = baseline.get(name)
+        if base:
+            change = relative / base["relative_cost"] - 1
+            line += f"{base['relative_cost']:>10.3f}{change:>+9.1%}"
+            if change > args.tolerance:
+                slower.append(f"{name} costs {change:.1%} more than the baseline")
+        print(line)
+
+    report = {"machine": machine(), "kernels": results}
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(report, indent=2) + "\n")
+        print(f"\nSaved the baseline to {baseline_path}")
+        return 0
+
+    if not baseline:
+        print(f"\nNo baseline at {baseline_path}; run with --save-baseline to store one")
+    elif slower:
+        print(f"\nMore costly than the baseline by more than {args.tolerance:.0%}:\n  " +
+              "\n  ".join(slower))
+        return 1
+    else:
+        print(f"\nNo kernel costs more than {args.tolerance:.0%} over the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
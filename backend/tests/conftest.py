@@ -0,0 +1,4 @@
+""" Test setup: app modules build their SQLAlchemy engine at import, so point it at SQLite. """
+import os
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
@@ -0,0 +1,56 @@
+""" AddressIndex prefix search and ranking. """
+from app.address_index import AddressIndex, SAVED_RANK, HISTORY_RANK
+
+
+def descriptions(predictions):
+    """ The description of each prediction, in order. """
+    return [prediction["description"] for prediction in predictions]
+
+
+def test_search_matches_a_case_and_space_insensitive_prefix():
+    """ Typed prefixes match whatever their case and spacing. """
+    index = AddressIndex()
+    index.add("500 Market St, San Francisco", "p1", "saved", (SAVED_RANK, 0))
+    index.add("1 Ferry Building, San Francisco", "p2", "saved", (SAVED_RANK, 0))
+    assert descriptions(index.search("500  MAR", 5)) == ["500 Market St, San Francisco"]
+    assert index.search("Mission", 5) == []
+
+
+def test_search_matches_nicknames():
+    """ An address is found by its nickname as well as its text. """
+    index = AddressIndex()
+    index.add("500 Market St, San Francisco", "p1", "saved", (SAVED_RANK, 0), nickname="Work")
+    predictions = index.search("wo", 5)
+    assert descriptions(predictions) == ["500 Market St, San Francisco"]
+    assert predictions[0]["nickname"] == "Work"
+
+
+def test_saved_addresses_rank_before_history():
+    """ Matches come in rank order, saved addresses first, then newer history first. """
+    index = AddressIndex()
+    index.add("12 Main St (older)", "h1", "history", (HISTORY_RANK, -100))
+    index.add("12 Main St (newer)", "h2", "history", (HISTORY_RANK, -200))
+    index.add("12 Main St (saved)", "s1", "saved", (SAVED_RANK, 0))
+    assert descriptions(index.search("12 main", 5)) == [
+        "12 Main St (saved)", "12 Main St (newer)", "12 Main St (older)",
+    ]
+
+
+def test_search_drops_repeated_addresses_and_honours_the_limit():
+    """ The same address saved and in history is suggested once; `limit` caps the list. """
+    index = AddressIndex()
+    index.add("12 Main St", "h1", "history", (HISTORY_RANK, 0))
+    index.add("12 Main St", "s1", "saved", (SAVED_RANK, 0))
+    index.add("12 Main Ave", "s2", "saved", (SAVED_RANK, 1))
+    predictions = index.search("12 main", 5)
+    assert [prediction["place_id"] for prediction in predictions] == ["s1", "s2"]
+    assert len(index.search("12 main", 1)) == 1
+
+
+def test_empty_prefix_and_empty_addresses():
+    """ Blank input finds nothing, and blank addresses aren't indexed. """
+    index = AddressIndex()
+    index.add("", "p0", "saved", (SAVED_RANK, 0))
+    index.add("500 Market St", "p1", "saved", (SAVED_RANK, 0))
+    assert index.search("   ", 5) == []
+    assert len(index.search("5", 5)) == 1
@@ -0,0 +1,211 @@
+""" TTLCache: expiry, LRU bound and single-flight loading. """
+import asyncio
+import pytest
+from app.cache import TTLCache
+
+
+def make_cache(ttl=60, max_entries=100):
+    """ A cache kept out of the /metrics registry. """
+    return TTLCache("test", ttl, max_entries, register=False)
+
+
+def test_get_or_load_caches_the_loaded_value():
+    """ The loader runs on the first miss only. """
+    cache = make_cache()
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        return "value"
+
+    async def run():
+        return [await cache.get_or_load("key", loader) for _ in range(3)]
+
+    assert asyncio.run(run()) == ["value"] * 3
+    assert len(calls) == 1
+    assert (cache.misses, cache.hits) == (1, 2)
+
+
+def test_expired_entries_are_loaded_again():
+    """ An entry past its TTL counts as missing. """
+    cache = make_cache(ttl=0)
+    cache.set("key", "old")
+    assert cache.get("key") == (False, None)
+
+    async def loader():
+        return "new"
+
+    assert asyncio.run(cache.get_or_load("key", loader)) == "new"
+
+
+def test_least_recently_used_entry_is_evicted():
+    """ Reading an entry keeps it over older ones when the cache is full. """
+    cache = make_cache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("a") == (True, 1)
+    assert cache.get("b") == (False, None)
+    assert cache.get("c") == (True, 3)
+
+
+def test_concurrent_misses_share_one_load():
+    """ Callers missing on a key that is loading wait for that load. """
+    cache = make_cache()
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_load("key", loader) for _ in range(5)))
+
+    assert asyncio.run(run()) == ["value"] * 5
+    assert len(calls) == 1
+    assert (cache.misses, cache.coalesced) == (1, 4)
+
+
+def test_failed_load_reaches_every_waiter_and_is_not_cached():
+    """ A loader error is raised to all callers sharing the load, and the next call retries. """
+    cache = make_cache()
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def working():
+        return "value"
+
+    async def run():
+        results = await asyncio.gather(cache.get_or_load("key", failing),
+                                       cache.get_or_load("key", failing),
+                                       return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        return await cache.get_or_load("key", working)
+
+    assert asyncio.run(run()) == "value"
+
+
+def test_cancelled_owner_hands_the_load_to_a_waiter():
+    """ When the caller that started a load is cancelled, a waiting caller loads it itself. """
+    cache = make_cache()
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return len(calls)
+
+    async def run():
+        owner = asyncio.create_task(cache.get_or_load("key", loader))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get_or_load("key", loader))
+        await asyncio.sleep(0.01)
+        owner.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await owner
+        return await waiter
+
+    assert asyncio.run(run()) == 2
+    assert len(calls) == 2
+
+
+def test_cancelled_waiter_leaves_the_load_running():
+    """ Cancelling a caller that only waits doesn't cancel the shared load. """
+    cache = make_cache()
+
+    async def loader():
+        await asyncio.sleep(0.05)
+        return "value"
+
+    async def run():
+        owner = asyncio.create_task(cache.get_or_load("key", loader))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get_or_load("key", loader))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return await owner
+
+    assert asyncio.run(run()) == "value"
+    assert cache.get("key") == (True, "value")
+
+
+def test_get_many_or_load_loads_only_missing_keys_once():
+    """ Cached and repeated keys are left out of the single loader call. """
+    cache = make_cache()
+    cache.set("a", "A")
+    requested = []
+
+    async def loader(missing):
+        requested.append(missing)
+        return [key.upper() for key in missing]
+
+    result = asyncio.run(cache.get_many_or_load(["a", "b", "b", "c"], loader))
+    assert result == ["A", "B", "B", "C"]
+    assert requested == [["b", "c"]]
+    assert cache.get("c") == (True, "C")
+
+
+def test_get_many_or_load_waits_for_keys_already_loading():
+    """ Keys another caller is loading come from that load, not from this batch. """
+    cache = make_cache()
+    requested = []
+
+    async def single():
+        await asyncio.sleep(0.02)
+        return "from single"
+
+    async def loader(missing):
+        requested.append(missing)
+        return [key.upper() for key in missing]
+
+    async def run():
+        single_load = asyncio.create_task(cache.get_or_load("a", single))
+        await asyncio.sleep(0)
+        batch = await cache.get_many_or_load(["a", "b"], loader)
+        await single_load
+        return batch
+
+    assert asyncio.run(run()) == ["from single", "B"]
+    assert requested == [["b"]]
+
+
+def test_get_many_or_load_rejects_a_short_result():
+    """ A loader returning the wrong number of values fails instead of misaligning keys. """
+    cache = make_cache()
+
+    async def loader(missing):
+        return missing[:1]
+
+    with pytest.raises(ValueError):
+        asyncio.run(cache.get_many_or_load(["a", "b"], loader))
+    assert cache.get("a") == (False, None)
+
+
+def test_cancelled_batch_owner_hands_keys_to_a_waiter():
+    """ A waiter on a key whose batch load was cancelled loads the key itself. """
+    cache = make_cache()
+
+    async def batch_loader(missing):
+        await asyncio.sleep(0.05)
+        return ["batch"] * len(missing)
+
+    async def single():
+        return "single"
+
+    async def run():
+        owner = asyncio.create_task(cache.get_many_or_load(["a", "b"], batch_loader))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get_or_load("a", single))
+        await asyncio.sleep(0.01)
+        owner.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await owner
+        return await waiter
+
+    assert asyncio.run(run()) == "single"
@@ -0,0 +1,68 @@
+""" Pickup candidate generation for each pattern. """
+import numpy as np
+import pytest
+from app.candidates import generate_candidates
+from app.geo import distance_m
+
+LAT, LON = 37.7749, -122.4194
+
+
+def distances_ft(candidates):
+    """ Distance of every candidate from the start point, in feet. """
+    return [distance_m(LAT, LON, lat, lon) / 0.3048 for lat, lon, _ in candidates]
+
+
+def test_original_spot_comes_first():
+    """ Every pattern starts with the requested pickup spot itself. """
+    for pattern in ("rings", "hex", "random"):
+        assert generate_candidates(LAT, LON, 500, pattern)[0] == (LAT, LON, "Original")
+
+
+def test_rings_are_evenly_spaced_compass_points():
+    """ Rings of `bearings` points at multiples of the spacing, nearest ring first. """
+    candidates = generate_candidates(LAT, LON, 500, "rings", bearings=8, spacing_ft=250)
+    assert len(candidates) == 1 + 2 * 8
+    assert [label for _, _, label in candidates[1:9]] == [
+        "N 250ft", "NE 250ft", "E 250ft", "SE 250ft", "S 250ft", "SW 250ft", "W 250ft", "NW 250ft",
+    ]
+    assert distances_ft(candidates[1:9]) == pytest.approx([250] * 8, rel=1e-3)
+    assert distances_ft(candidates[9:]) == pytest.approx([500] * 8, rel=1e-3)
+
+
+def test_rings_keep_whole_rings_under_the_cap():
+    """ A large search range is cut back to complete rings within `max_candidates`. """
+    candidates = generate_candidates(LAT, LON, 5000, "rings", bearings=8, max_candidates=20)
+    assert len(candidates) == 1 + 2 * 8
+
+
+def test_hex_grid_points_are_inside_the_range_and_distinct():
+    """ The hex pattern covers the disk with distinct points, nearest first. """
+    candidates = generate_candidates(LAT, LON, 500, "hex", spacing_ft=250)
+    distances = [round(distance, 1) for distance in distances_ft(candidates[1:])]
+    assert len(candidates) == 1 + 18
+    assert max(distances) <= 500 * 1.001
+    assert distances == sorted(distances)
+    assert len({(round(lat, 7), round(lon, 7)) for lat, lon, _ in candidates}) == len(candidates)
+
+
+def test_random_points_are_inside_the_range():
+    """ Random samples stay in the disk and are as many as the rings pattern makes. """
+    rng = np.random.default_rng(7)
+    candidates = generate_candidates(LAT, LON, 500, "random", bearings=8, spacing_ft=250, rng=rng)
+    assert len(candidates) == 1 + 2 * 8
+    assert max(distances_ft(candidates[1:])) <= 500 * 1.001
+
+
+def test_random_points_repeat_with_the_same_seed():
+    """ Passing a seeded generator makes the random pattern reproducible. """
+    first = generate_candidates(LAT, LON, 500, "random", rng=np.random.default_rng(3))
+    second = generate_candidates(LAT, LON, 500, "random", rng=np.random.default_rng(3))
+    assert first == second
+
+
+def test_bad_arguments_are_rejected():
+    """ Unknown patterns and non-positive ranges raise ValueError. """
+    with pytest.raises(ValueError):
+        generate_candidates(LAT, LON, 500, "spiral")
+    with pytest.raises(ValueError):
+        generate_candidates(LAT, LON, 0)
@@ -0,0 +1,129 @@
+""" Cassette recording, replay and misses. """
+import asyncio
+import httpx
+import pytest
+from app.cassette import (Cassette, CassetteMiss, CassetteWriter, RecordingTransport,
+                          ReplayTransport)
+
+URL = "https://upstream.test/estimates/price"
+
+
+def upstream(request):
+    """ Fake upstream answering with what it was asked. """
+    body = request.content.decode("utf-8")
+    return httpx.Response(200, json={"path": request.url.path, "body": body},
+                          headers={"x-upstream": "fake"})
+
+
+async def record(path, send, resume=False):
+    """ Runs `send(client)` through a recording client and closes the cassette. """
+    writer = CassetteWriter(path, resume=resume)
+    transport = RecordingTransport(httpx.MockTransport(upstream), writer)
+    async with httpx.AsyncClient(transport=transport) as client:
+        await send(client)
+    writer.close()
+    return writer.stats
+
+
+async def replay(path, send):
+    """ Runs `send(client)` through a replaying client and returns its result and stats. """
+    transport = ReplayTransport(path, time_scale=0)
+    async with httpx.AsyncClient(transport=transport) as client:
+        result = await send(client)
+    return result, transport.stats
+
+
+def test_replay_returns_the_recorded_responses(tmp_path):
+    """ Replay answers with the recorded status, headers and body. """
+    path = str(tmp_path / "run.cassette")
+
+    async def send(client):
+        get = await client.get(URL, params={"start": "1", "end": "2"})
+        post = await client.post(URL + "/batch", json={"b": 2, "a": 1})
+        return get, post
+
+    stats = asyncio.run(record(path, send))
+    assert stats["recorded"] == 2
+
+    (get, post), stats = asyncio.run(replay(path, send))
+    assert get.status_code == 200
+    assert get.json()["path"] == "/estimates/price"
+    assert get.headers["x-upstream"] == "fake"
+    assert post.json()["body"] == '{"b":2,"a":1}'
+    assert stats["replayed"] == 2
+
+
+def test_requests_match_regardless_of_parameter_order_and_credentials(tmp_path):
+    """ Query parameter order, JSON key order and API keys don't change the request key. """
+    path = str(tmp_path / "run.cassette")
+
+    async def recorded(client):
+        await client.get(URL, params={"start": "1", "end": "2", "key": "secret"})
+        await client.post(URL + "/batch", json={"b": 2, "a": 1})
+
+    async def replayed(client):
+        await client.get(URL, params={"end": "2", "start": "1", "key": "other"})
+        await client.post(URL + "/batch", json={"a": 1, "b": 2})
+
+    asyncio.run(record(path, recorded))
+    _, stats = asyncio.run(replay(path, replayed))
+    assert (stats["replayed"], stats["misses"]) == (2, 0)
+
+
+def test_unrecorded_request_is_a_miss(tmp_path):
+    """ A request missing from the cassette raises CassetteMiss instead of going out. """
+    path = str(tmp_path / "run.cassette")
+
+    async def recorded(client):
+        await client.get(URL, params={"start": "1"})
+
+    async def replayed(client):
+        await client.get(URL, params={"start": "2"})
+
+    asyncio.run(record(path, recorded))
+    with pytest.raises(CassetteMiss):
+        asyncio.run(replay(path, replayed))
+
+
+def test_duplicate_requests_are_recorded_once(tmp_path):
+    """ Only the first response to a request is kept. """
+    path = str(tmp_path / "run.cassette")
+
+    async def send(client):
+        for _ in range(3):
+            await client.get(URL, params={"start": "1"})
+
+    stats = asyncio.run(record(path, send))
+    assert (stats["recorded"], stats["duplicates"]) == (1, 2)
+
+
+def test_resumed_recording_keeps_earlier_responses(tmp_path):
+    """ Reopening a cassette appends to it instead of starting over. """
+    path = str(tmp_path / "run.cassette")
+
+    async def first(client):
+        await client.get(URL, params={"start": "1"})
+
+    async def second(client):
+        await client.get(URL, params={"start": "2"})
+
+    asyncio.run(record(path, first))
+    asyncio.run(record(path, second, resume=True))
+
+    async def both(client):
+        await first(client)
+        await second(client)
+
+    _, stats = asyncio.run(replay(path, both))
+    assert (stats["entries"], stats["replayed"]) == (2, 2)
+
+
+def test_cassette_without_an_index_is_rejected(tmp_path):
+    """ A recording that was never closed can't be replayed. """
+    path = str(tmp_path / "run.cassette")
+    writer = CassetteWriter(path)
+    writer.add(b"k" * 16, 200, 0.1, [], b"{}")
+    writer._file.flush()  # pylint: disable=protected-access
+    with pytest.raises(ValueError):
+        Cassette(path)
+    writer.close()
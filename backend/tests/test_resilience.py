@@ -0,0 +1,86 @@
+""" CircuitBreaker state changes. """
+from app.resilience import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+
+def open_breaker(threshold=3):
+    """ A breaker opened by `threshold` failures in a row. """
+    breaker = CircuitBreaker(threshold=threshold, reset_timeout=60)
+    for _ in range(threshold):
+        assert breaker.allow()
+        breaker.failed()
+    return breaker
+
+
+def expire(breaker):
+    """ Moves the breaker's opening time past its reset timeout. """
+    breaker.opened_at -= breaker.reset_timeout + 1
+
+
+def test_opens_after_consecutive_failures():
+    """ The breaker stays closed below the threshold and opens on reaching it. """
+    breaker = CircuitBreaker(threshold=3, reset_timeout=60)
+    breaker.failed()
+    breaker.failed()
+    assert breaker.state == CLOSED
+    breaker.failed()
+    assert breaker.state == OPEN
+    assert breaker.times_opened == 1
+
+
+def test_success_resets_the_failure_count():
+    """ Only failures in a row count towards the threshold. """
+    breaker = CircuitBreaker(threshold=3, reset_timeout=60)
+    breaker.failed()
+    breaker.failed()
+    breaker.succeeded()
+    breaker.failed()
+    breaker.failed()
+    assert breaker.state == CLOSED
+
+
+def test_open_breaker_rejects_calls():
+    """ Calls fail fast until the reset timeout has passed. """
+    breaker = open_breaker()
+    assert not breaker.allow()
+    assert not breaker.allow()
+    assert breaker.rejected == 2
+
+
+def test_half_open_lets_one_trial_call_through():
+    """ After the reset timeout one call may go through; others are rejected meanwhile. """
+    breaker = open_breaker()
+    expire(breaker)
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+
+
+def test_successful_trial_closes_the_breaker():
+    """ A trial call that succeeds closes the breaker. """
+    breaker = open_breaker()
+    expire(breaker)
+    breaker.allow()
+    breaker.succeeded()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_failed_trial_reopens_the_breaker():
+    """ A trial call that fails reopens the breaker for another reset timeout. """
+    breaker = open_breaker()
+    expire(breaker)
+    breaker.allow()
+    breaker.failed()
+    assert breaker.state == OPEN
+    assert breaker.times_opened == 2
+    assert not breaker.allow()
+
+
+def test_abandoned_trial_allows_another():
+    """ A trial call that ends without a verdict frees the slot for the next one. """
+    breaker = open_breaker()
+    expire(breaker)
+    breaker.allow()
+    breaker.abandoned()
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
@@ -0,0 +1,67 @@
+""" RoadIndex nearest-road lookups. """
+import math
+import pytest
+from app.geo import METERS_PER_DEGREE
+from app.roads import RoadIndex
+
+LAT, LON = 37.7749, -122.4194
+
+# One east-west road through (LAT, LON), 0.002 degrees of longitude (~176 m) long
+ROAD = [(LAT, LON - 0.001, LAT, LON + 0.001)]
+
+
+def north_of(lat, lon, meters):
+    """ The point `meters` north of (lat, lon). """
+    return lat + meters / METERS_PER_DEGREE, lon
+
+
+def test_nearest_projects_onto_the_segment():
+    """ A point beside a road snaps to the foot of the perpendicular. """
+    index = RoadIndex.build(ROAD)
+    lat, lon, dist = index.nearest(*north_of(LAT, LON, 10), max_distance_m=25)
+    assert dist == pytest.approx(10, abs=0.01)
+    assert (lat, lon) == pytest.approx((LAT, LON), abs=1e-7)
+
+
+def test_nearest_clamps_to_the_segment_end():
+    """ Past the end of a road the closest point is its endpoint. """
+    index = RoadIndex.build(ROAD)
+    lat, lon, dist = index.nearest(LAT, LON + 0.0012, max_distance_m=50)
+    assert (lat, lon) == pytest.approx((LAT, LON + 0.001), abs=1e-7)
+    assert dist == pytest.approx(0.0002 * METERS_PER_DEGREE * math.cos(math.radians(LAT)),
+                                 rel=1e-3)
+
+
+def test_nothing_within_range_returns_none():
+    """ Roads farther than `max_distance_m` are ignored. """
+    index = RoadIndex.build(ROAD)
+    assert index.nearest(*north_of(LAT, LON, 40), max_distance_m=25) is None
+    assert not index.is_near_road(*north_of(LAT, LON, 40), 25)
+    assert index.is_near_road(*north_of(LAT, LON, 20), 25)
+
+
+def test_nearest_picks_the_closest_of_several_roads():
+    """ With roads in neighbouring grid cells the closest one wins. """
+    far_lat = north_of(LAT, LON, 30)[0]
+    index = RoadIndex.build(ROAD + [(far_lat, LON - 0.001, far_lat, LON + 0.001)],
+                            cell_size_m=10)
+    _, _, dist = index.nearest(*north_of(LAT, LON, 20), max_distance_m=25)
+    assert dist == pytest.approx(10, abs=0.01)
+
+
+def test_saved_index_loads_with_the_same_answers(tmp_path):
+    """ An index saved to disk and memory-mapped back finds the same points. """
+    index = RoadIndex.build(ROAD)
+    index.save(tmp_path)
+    loaded = RoadIndex.load(tmp_path)
+    point = north_of(LAT, LON + 0.0005, 12)
+    assert loaded.nearest(*point, 25) == pytest.approx(index.nearest(*point, 25))
+
+
+def test_csv_skips_roads_cars_cannot_use(tmp_path):
+    """ Footways and other non-drivable highway classes are left out of the index. """
+    path = tmp_path / "roads.csv"
+    path.write_text("lat1,lon1,lat2,lon2,highway\n"
+                    f"{LAT},{LON - 0.001},{LAT},{LON + 0.001},footway\n", encoding="utf-8")
+    assert RoadIndex.from_csv(path).nearest(LAT, LON, 25) is None
+    assert RoadIndex.from_csv(path, drivable_only=False).nearest(LAT, LON, 25) is not None
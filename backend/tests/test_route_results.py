@@ -0,0 +1,112 @@
+""" Stale-while-revalidate serving of route search results. """
+import asyncio
+import time
+import pytest
+from app import route_results
+from app.config import ROUTE_REFRESH_AFTER
+from app.route_results import cached_search, route_cache
+
+KEY = ("test", "9q8yy", "9q8yz")
+
+
+@pytest.fixture(autouse=True)
+def empty_route_cache():
+    """ Every test starts without stored results. """
+    route_cache.clear()
+    yield
+    route_cache.clear()
+
+
+def searcher(*results):
+    """ A search returning `results` one call after another, and the list of its calls. """
+    calls = []
+
+    async def search():
+        calls.append(1)
+        return results[len(calls) - 1]
+
+    return search, calls
+
+
+def store(result, age):
+    """ Stores `result` as if its search had finished `age` seconds ago. """
+    route_cache.set(KEY, (time.monotonic() - age, result))
+
+
+def test_miss_runs_the_search_and_stores_it():
+    """ Without a stored result the caller waits for a fresh one. """
+    search, calls = searcher({"options": [1]})
+
+    async def run():
+        first = await cached_search(KEY, search, max_stale=60)
+        second = await cached_search(KEY, search, max_stale=60)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == {"options": [1], "age_seconds": 0.0}
+    assert second["options"] == [1]
+    assert len(calls) == 1
+
+
+def test_stale_result_is_served_and_refreshed_in_the_background():
+    """ A result older than ROUTE_REFRESH_AFTER but within max_stale is returned at once. """
+    store({"options": ["old"]}, age=ROUTE_REFRESH_AFTER + 1)
+    search, calls = searcher({"options": ["new"]})
+
+    async def run():
+        stale = await cached_search(KEY, search, max_stale=ROUTE_REFRESH_AFTER + 60)
+        await asyncio.gather(*route_results._refreshing.values())  # pylint: disable=protected-access
+        fresh = await cached_search(KEY, search, max_stale=ROUTE_REFRESH_AFTER + 60)
+        return stale, fresh
+
+    stale, fresh = asyncio.run(run())
+    assert stale["options"] == ["old"]
+    assert stale["age_seconds"] >= ROUTE_REFRESH_AFTER
+    assert fresh["options"] == ["new"]
+    assert len(calls) == 1
+
+
+def test_recent_result_is_served_without_a_refresh():
+    """ A result younger than ROUTE_REFRESH_AFTER is served and left alone. """
+    store({"options": ["recent"]}, age=0)
+    search, calls = searcher({"options": ["new"]})
+    result = asyncio.run(cached_search(KEY, search, max_stale=60))
+    assert result["options"] == ["recent"]
+    assert not calls
+
+
+def test_result_older_than_max_stale_is_replaced_before_answering():
+    """ Callers don't get results older than they accept. """
+    store({"options": ["old"]}, age=30)
+    search, calls = searcher({"options": ["new"]})
+    result = asyncio.run(cached_search(KEY, search, max_stale=10))
+    assert result == {"options": ["new"], "age_seconds": 0.0}
+    assert len(calls) == 1
+
+
+def test_concurrent_misses_share_one_search():
+    """ Callers missing on the same route wait for one search. """
+    calls = []
+
+    async def search():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"options": []}
+
+    async def run():
+        return await asyncio.gather(*(cached_search(KEY, search, max_stale=60) for _ in range(3)))
+
+    assert len(asyncio.run(run())) == 3
+    assert len(calls) == 1
+
+
+def test_partial_results_under_a_budget_are_not_stored():
+    """ A search the latency budget cut short is returned but not kept for others. """
+    search, calls = searcher({"options": [], "partial": True}, {"options": [1], "partial": False})
+
+    async def run():
+        await cached_search(KEY, search, max_stale=60, budget_ms=1000)
+        return await cached_search(KEY, search, max_stale=60, budget_ms=1000)
+
+    assert asyncio.run(run())["options"] == [1]
+    assert len(calls) == 2
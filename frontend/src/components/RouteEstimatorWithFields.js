@@ -221,7 +221,7 @@ const RouteEstimatorWithFields = () => {
       if (location) {
         url += `&lat=${location[1]}&lng=${location[0]}`;
       }
-      const response = await fetch(url);
+      const response = await fetch(url, { credentials: "include" });
       const data = await response.json();
       if (data.predictions) {
         setterFunction(data.predictions);